@@ -1,3 +1,4 @@
+from .artifact_tools import *
 from .fabric_tools import *
 from .file_tools import *
 from .git_tools import *
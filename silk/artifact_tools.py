@@ -0,0 +1,161 @@
+import os
+import json
+import stat
+import shutil
+import hashlib
+import tarfile
+from typing import Any
+from typing import Dict
+from typing import Callable
+
+from silk.file_tools import file_lock
+from silk.file_tools import generate_random_str
+
+
+class ArtifactCache:
+    # hardlink 模式下恢复出来的文件和缓存共用 inode, 不适合原地重新构建:
+    # 普通用户原地写入只读文件会直接失败, 需要构建工具先删除再写入;
+    # root 不受只读权限限制, 原地写入会改坏缓存, 所以 root 恢复时改为复制
+    modes = ("tar", "hardlink")
+
+    def __init__(self, cache_dir: str, max_size: int = 10 * 1024 ** 3, mode: str = "tar"):
+        if mode not in self.modes:
+            raise ValueError("mode 必须是 {0} 之一, 实际收到 {1}".format(", ".join(self.modes), mode))
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.mode = mode
+        self.__lock_file = os.path.join(cache_dir, ".lock")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(state: Dict[str, str], recipe_key: str = "") -> str:
+        # state 就是 GitProject.get_current_state() 的结果, 和构建方式一起决定产物
+        content = json.dumps({"state": state, "recipe": recipe_key}, sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def __entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    @staticmethod
+    def __get_dir_size(dir_path: str) -> int:
+        size = 0
+        for top, dirs, files in os.walk(dir_path):
+            for file in files:
+                size += os.lstat(os.path.join(top, file)).st_size
+        return size
+
+    @staticmethod
+    def __copy_read_only(source_dir: str, target_dir: str):
+        # 缓存里保存独立的副本并去掉写权限, 构建目录之后被原地修改也不会影响缓存,
+        # 恢复时只把这些只读的文件硬链接出去
+        shutil.copytree(source_dir, target_dir, symlinks=True)
+        write_bits = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+        for top, dirs, files in os.walk(target_dir):
+            for file in files:
+                file_path = os.path.join(top, file)
+                if not os.path.islink(file_path):
+                    os.chmod(file_path, stat.S_IMODE(os.lstat(file_path).st_mode) & ~write_bits)
+
+    @staticmethod
+    def __link_tree(source_dir: str, target_dir: str):
+        can_link = os.geteuid() != 0
+
+        def link_or_copy(source, target):
+            # 已有的文件可能是另一个缓存条目的硬链接, 先删除再链接, 不能写入它
+            if os.path.lexists(target):
+                os.remove(target)
+            if can_link:
+                try:
+                    os.link(source, target)
+                    return
+                except OSError:
+                    pass
+            shutil.copy2(source, target)
+
+        shutil.copytree(source_dir, target_dir, symlinks=True, copy_function=link_or_copy, dirs_exist_ok=True)
+
+    def has(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.__entry_path(key), "size"))
+
+    def store(self, key: str, source_dir: str) -> str:
+        entry_path = self.__entry_path(key)
+        if self.has(key):
+            return entry_path
+
+        tmp_path = os.path.join(self.cache_dir, ".tmp-{0}".format(generate_random_str(12)))
+        os.makedirs(tmp_path)
+        try:
+            if self.mode == "tar":
+                with tarfile.open(os.path.join(tmp_path, "artifact.tar"), "w") as tar:
+                    tar.add(source_dir, arcname=".")
+            else:
+                self.__copy_read_only(source_dir, os.path.join(tmp_path, "tree"))
+            with open(os.path.join(tmp_path, "size"), "w") as f:
+                f.write(str(self.__get_dir_size(tmp_path)))
+            with file_lock(self.__lock_file):
+                if self.has(key):
+                    return entry_path
+                shutil.rmtree(entry_path, ignore_errors=True)
+                os.rename(tmp_path, entry_path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        self.evict()
+        return entry_path
+
+    def restore(self, key: str, target_dir: str) -> bool:
+        entry_path = self.__entry_path(key)
+        with file_lock(self.__lock_file, shared=True):
+            if not self.has(key):
+                return False
+            os.makedirs(target_dir, exist_ok=True)
+            if self.mode == "tar":
+                with tarfile.open(os.path.join(entry_path, "artifact.tar"), "r") as tar:
+                    tar.extractall(target_dir)
+            else:
+                # 恢复出来的文件是缓存里只读文件的硬链接 (root 为复制), 需要修改时先删除再重新写入
+                self.__link_tree(os.path.join(entry_path, "tree"), target_dir)
+            os.utime(entry_path)  # 用 mtime 记录最近一次使用时间, LRU 淘汰时使用
+        return True
+
+    def evict(self) -> Dict[str, int]:
+        evicted = dict()
+        with file_lock(self.__lock_file):
+            entries = list()
+            for key in os.listdir(self.cache_dir):
+                size_file = os.path.join(self.__entry_path(key), "size")
+                if key.startswith(".") or not os.path.exists(size_file):
+                    continue
+                with open(size_file, "r") as f:
+                    entries.append((os.path.getmtime(self.__entry_path(key)), key, int(f.read())))
+
+            total_size = sum(size for _, _, size in entries)
+            for _, key, size in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                shutil.rmtree(self.__entry_path(key), ignore_errors=True)
+                total_size -= size
+                evicted[key] = size
+        return evicted
+
+    def fetch_or_build(self, state: Dict[str, str], recipe_key: str, output_dir: str, build: Callable[[], Any]) -> bool:
+        key = self.make_key(state, recipe_key)
+        if self.restore(key, output_dir):
+            return True
+        build()
+        self.store(key, output_dir)
+        return False
+
+    def fetch_or_build_projects(self, state: Dict[str, str], recipe_key: str, output_dirs: Dict[str, str],
+                                builders: Dict[str, Callable[[], Any]]) -> Dict[str, bool]:
+        # 每个项目单独计算 key, 只有 commit 变化了的项目才需要重新构建
+        hits = dict()
+        for name, build in builders.items():
+            hits[name] = self.fetch_or_build({name: state[name]}, recipe_key, output_dirs[name], build)
+        return hits
+
+    def __repr__(self):
+        return "ArtifactCache(\"{0}\")".format(self.cache_dir)
+
+
+__all__ = ["ArtifactCache"]
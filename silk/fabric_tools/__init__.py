@@ -3,10 +3,25 @@ from .fabric_api import (cd, hide, settings, show, path, prefix, lcd, quiet, war
                          task, serial, parallel, require, prompt, put, get, run, sudo, local,
                          reboot, open_shell, output, abort, warn, puts, fastprint, execute)
 from .fabric_contrib_api import (rsync_project, upload_project, confirm, exists, is_link, first,
-                                 upload_template, sed, uncomment, comment, contains, append)
+                                 upload_template, sed, uncomment, comment, contains, append,
+                                 exists_many, contains_many, stat_many)
 
 from .gitlab_ci_context import env
+from .profiler import Profiler, enable_profiling, disable_profiling, get_active_profiler
+from .probe_cache import clear_probe_cache, cached_probe, invalidates_probes
 from .fabric_context import Host, Role, Environment, run_per_host, run_per_role
+from .connection_pool import ConnectionPool
+from .rolling_scheduler import RollingScheduler
+from .output_sinks import OutputSink, ConsoleSink, FileSink, RingBufferSink
+from .async_executor import HostResult, Transport, LocalTransport, SSHTransport, AsyncExecutor
+from .result_aggregator import ResultGroup, ResultAggregator
+from .task_graph import TaskNode, TaskGraph
+from .distribution import plan_fanout, FanoutDistributor, distribute_file
+from .artifact_sync import build_manifest, diff_manifests, sync_artifact
+from .host_selector import HostSelector, compile_selector, select_hosts
+from .inventory import InventoryLoader, load_inventory
+from .dynamic_inventory import (InventorySource, CommandSource, FileSource, HttpSource, register_source,
+                                create_source, DynamicInventory)
 
 __all__ = [
     "env",
@@ -55,9 +70,52 @@ __all__ = [
     "comment",
     "contains",
     "append",
+    "exists_many",
+    "contains_many",
+    "stat_many",
+    "clear_probe_cache",
+    "cached_probe",
+    "invalidates_probes",
+    "Profiler",
+    "enable_profiling",
+    "disable_profiling",
+    "get_active_profiler",
     "Host",
     "Role",
     "Environment",
     "run_per_host",
-    "run_per_role"
+    "run_per_role",
+    "ConnectionPool",
+    "RollingScheduler",
+    "OutputSink",
+    "ConsoleSink",
+    "FileSink",
+    "RingBufferSink",
+    "HostResult",
+    "Transport",
+    "LocalTransport",
+    "SSHTransport",
+    "AsyncExecutor",
+    "ResultGroup",
+    "ResultAggregator",
+    "TaskNode",
+    "TaskGraph",
+    "HostSelector",
+    "compile_selector",
+    "select_hosts",
+    "InventoryLoader",
+    "load_inventory",
+    "InventorySource",
+    "CommandSource",
+    "FileSource",
+    "HttpSource",
+    "register_source",
+    "create_source",
+    "DynamicInventory",
+    "plan_fanout",
+    "FanoutDistributor",
+    "distribute_file",
+    "build_manifest",
+    "diff_manifests",
+    "sync_artifact"
 ]
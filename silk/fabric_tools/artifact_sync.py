@@ -0,0 +1,209 @@
+import os
+import json
+import shlex
+import hashlib
+import tarfile
+import tempfile
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from silk.fabric_tools import env
+from silk.fabric_tools import run
+from silk.fabric_tools import sudo
+from silk.fabric_tools import put
+from silk.file_tools import generate_random_str
+
+staging_dir = ".silk-sync-staging"
+sha256_hex_length = 64
+# 符号链接和空目录也记在 manifest 里, 符号链接用链接目标作为哈希
+symlink_prefix = "symlink:"
+empty_dir_hash = "directory"
+
+
+def get_cache_dir(cache_dir: str = None) -> str:
+    return cache_dir or os.path.join(os.path.expanduser("~"), ".cache", "silk", "artifact_sync")
+
+
+def load_json(file_path: str) -> Any:
+    try:
+        with open(file_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def dump_json(file_path: str, data: Any):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = "{0}.{1}.tmp".format(file_path, generate_random_str(8))
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, file_path)
+
+
+def hash_file(file_path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def is_file_hash(file_hash: str) -> bool:
+    return file_hash != empty_dir_hash and not file_hash.startswith(symlink_prefix)
+
+
+def build_manifest(local_dir: str, cache_dir: str = None) -> Dict[str, str]:
+    # 返回 {相对路径: sha256}, size 和 mtime 没变的文件直接使用上次计算的哈希
+    local_dir = os.path.abspath(local_dir)
+    cache_path = os.path.join(get_cache_dir(cache_dir), "local",
+                              "{0}.json".format(hashlib.sha1(local_dir.encode()).hexdigest()))
+    cached = load_json(cache_path) or dict()
+    manifest, stats = dict(), dict()
+    for top, dirs, files in os.walk(local_dir):
+        dirs.sort()
+        if not dirs and not files and top != local_dir:
+            manifest[os.path.relpath(top, local_dir)] = empty_dir_hash
+        # os.walk 不会进入指向目录的符号链接, 它们和指向文件的符号链接一样处理
+        for file in sorted(files + [name for name in dirs if os.path.islink(os.path.join(top, name))]):
+            file_path = os.path.join(top, file)
+            relative_path = os.path.relpath(file_path, local_dir)
+            if os.path.islink(file_path):
+                manifest[relative_path] = symlink_prefix + os.readlink(file_path)
+                continue
+            stat = os.stat(file_path)
+            entry = cached.get(relative_path, None)
+            if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                file_hash = entry[2]
+            else:
+                file_hash = hash_file(file_path)
+            manifest[relative_path] = file_hash
+            stats[relative_path] = [stat.st_size, stat.st_mtime_ns, file_hash]
+    if stats != cached:
+        dump_json(cache_path, stats)
+    return manifest
+
+
+def build_remote_manifest_command(remote_dir: str) -> str:
+    # 普通文件输出 "<sha256>  ./<path>", 符号链接和空目录输出 "./<path>\t<哈希>"
+    return ("mkdir -p {0} && cd {0} && find . -type f ! -path './{1}/*' -print0 | xargs -0 -r sha256sum && "
+            "find . -mindepth 1 ! -path './{1}' ! -path './{1}/*' "
+            "\\( -type l -printf '%p\\t{2}%l\\n' -o -type d -empty -printf '%p\\t{3}\\n' \\)").format(
+        shlex.quote(remote_dir), staging_dir, symlink_prefix, empty_dir_hash)
+
+
+def parse_remote_manifest(output: str) -> Dict[str, str]:
+    # sha256sum 的输出是 "<hash>  ./<path>", 带反斜杠前缀的是含有特殊字符的文件名, 当作远端没有这个文件
+    manifest = dict()
+    for line in output.splitlines():
+        if line.startswith("./"):
+            file_path, separator, file_hash = line.partition("\t")
+            if separator and (file_hash == empty_dir_hash or file_hash.startswith(symlink_prefix)):
+                manifest[file_path[2:]] = file_hash
+            continue
+        file_hash, separator, file_path = line.partition("  ")
+        if not separator or len(file_hash) != sha256_hex_length or not file_path.startswith("./"):
+            continue
+        manifest[file_path[2:]] = file_hash
+    return manifest
+
+
+def diff_manifests(local_manifest: Dict[str, str], remote_manifest: Dict[str, str],
+                   delete: bool = False) -> Tuple[List[str], Dict[str, str], List[str]]:
+    # 返回 (需要上传的文件, {目标路径: 远端已有相同内容的路径}, 需要删除的文件)
+    # 只有普通文件可以从远端已有的相同内容复制, 符号链接和空目录总是放进 tar 里
+    remote_paths_by_hash = dict()
+    for file_path, file_hash in sorted(remote_manifest.items()):
+        if is_file_hash(file_hash):
+            remote_paths_by_hash.setdefault(file_hash, file_path)
+
+    uploads, copies = list(), dict()
+    for file_path, file_hash in sorted(local_manifest.items()):
+        if remote_manifest.get(file_path, None) == file_hash:
+            continue
+        if file_hash in remote_paths_by_hash:
+            copies[file_path] = remote_paths_by_hash[file_hash]
+        else:
+            uploads.append(file_path)
+    deletes = sorted(set(remote_manifest) - set(local_manifest)) if delete else list()
+    return uploads, copies, deletes
+
+
+def build_apply_command(remote_dir: str, copies: Dict[str, str], deletes: List[str], remote_tar_path: str = None,
+                        empty_dirs: List[str] = None) -> str:
+    # 先把要复制的源文件放到暂存目录, 这样源文件在解包或者删除时被覆盖也不影响复制
+    commands = ["cd {0}".format(shlex.quote(remote_dir))]
+    if copies:
+        commands.append("mkdir -p {0}".format(staging_dir))
+        for source in sorted(set(copies.values())):
+            staged = "{0}/{1}".format(staging_dir, hashlib.sha1(source.encode()).hexdigest())
+            commands.append("cp -p {0} {1}".format(shlex.quote(source), staged))
+        for target, source in sorted(copies.items()):
+            staged = "{0}/{1}".format(staging_dir, hashlib.sha1(source.encode()).hexdigest())
+            target_dir = os.path.dirname(target)
+            if target_dir:
+                commands.append("mkdir -p {0}".format(shlex.quote(target_dir)))
+            commands.append("cp -p --remove-destination {0} {1}".format(staged, shlex.quote(target)))
+    if remote_tar_path:
+        commands.append("tar -xzf {0}".format(shlex.quote(remote_tar_path)))
+        commands.append("rm -f {0}".format(shlex.quote(remote_tar_path)))
+    for file_path in deletes:
+        # 空目录只在仍然为空时删除, 它可能刚刚被解包出来的文件使用
+        if empty_dirs and file_path in empty_dirs:
+            commands.append("{{ rmdir {0} 2>/dev/null || true; }}".format(shlex.quote(file_path)))
+        else:
+            commands.append("rm -f {0}".format(shlex.quote(file_path)))
+    if copies:
+        commands.append("rm -rf {0}".format(staging_dir))
+    return " && ".join(commands)
+
+
+def create_tar(local_dir: str, file_paths: List[str], tar_path: str):
+    with tarfile.open(tar_path, "w:gz") as tar:
+        for file_path in file_paths:
+            # 符号链接保存为链接本身, 空目录只保存目录本身
+            tar.add(os.path.join(local_dir, file_path), arcname=file_path, recursive=False)
+
+
+def get_host_cache_path(remote_dir: str, cache_dir: str = None) -> str:
+    host_key = "{0}:{1}".format(env.host_string or "localhost", remote_dir)
+    return os.path.join(get_cache_dir(cache_dir), "hosts", "{0}.json".format(hashlib.sha1(host_key.encode()).hexdigest()))
+
+
+def sync_artifact(local_dir: str, remote_dir: str, delete: bool = False, use_sudo: bool = False,
+                  trust_cache: bool = False, cache_dir: str = None) -> Dict[str, Any]:
+    # 在 fabric 任务中调用, 只上传远端没有的内容:
+    # 1. 一条命令取回远端所有文件的 sha256 (trust_cache 时直接使用本地缓存的上次同步结果)
+    # 2. 远端已有相同内容的文件在远端复制, 其余变化的文件打成一个 tar 上传
+    run_ = sudo if use_sudo else run
+    local_manifest = build_manifest(local_dir, cache_dir)
+    host_cache_path = get_host_cache_path(remote_dir, cache_dir)
+    remote_manifest = load_json(host_cache_path) if trust_cache else None
+    if remote_manifest is None:
+        output = run_(build_remote_manifest_command(remote_dir), pty=False, combine_stderr=False, quiet=True)
+        if output.failed:
+            raise Exception("获取 {0} 上 {1} 的文件列表失败: {2}".format(env.host_string, remote_dir, output.stderr))
+        remote_manifest = parse_remote_manifest(output)
+
+    uploads, copies, deletes = diff_manifests(local_manifest, remote_manifest, delete)
+    uploaded_size = 0
+    if uploads or copies or deletes:
+        remote_tar_path = None
+        with tempfile.TemporaryDirectory(prefix="silk-sync-") as tmp_dir:
+            if uploads:
+                tar_path = os.path.join(tmp_dir, "artifact.tar.gz")
+                create_tar(local_dir, uploads, tar_path)
+                uploaded_size = os.path.getsize(tar_path)
+                remote_tar_path = "/tmp/silk-sync-{0}.tar.gz".format(generate_random_str(12))
+                put(tar_path, remote_tar_path, use_sudo=use_sudo)
+            empty_dirs = [file_path for file_path in deletes if remote_manifest[file_path] == empty_dir_hash]
+            run_(build_apply_command(remote_dir, copies, deletes, remote_tar_path, empty_dirs), pty=False)
+
+    synced_manifest = dict(local_manifest) if delete else dict(remote_manifest, **local_manifest)
+    dump_json(host_cache_path, synced_manifest)
+    return {"uploaded": uploads, "copied": copies, "deleted": deletes,
+            "unchanged": len(local_manifest) - len(uploads) - len(copies), "uploaded_size": uploaded_size}
+
+
+__all__ = ["build_manifest", "diff_manifests", "sync_artifact"]
@@ -0,0 +1,299 @@
+import os
+import shlex
+import codecs
+import signal
+import asyncio
+from typing import Dict
+from typing import Union
+from typing import Mapping
+from typing import Callable
+from typing import Iterable
+from typing import Sequence
+from typing import AsyncIterator
+
+from silk.fabric_tools.fabric_context import Host
+from silk.fabric_tools.connection_pool import ConnectionPool
+from silk.fabric_tools.output_sinks import OutputSink
+from silk.fabric_tools.output_sinks import BoundedBuffer
+from silk.fabric_tools.profiler import get_active_profiler
+
+
+class HostResult:
+    def __init__(self, host: Host, command: str):
+        self.host = host
+        self.command = command
+        self.exit_code = None
+        self.stdout = ""
+        self.stderr = ""
+        self.duration = 0.0
+        self.error = None
+        self.truncated = False
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None and self.exit_code == 0
+
+    def __repr__(self):
+        return "HostResult(\"{0}\", {1})".format(self.host.name, self.exit_code)
+
+
+class Transport:
+    async def open(self, host: Host, command: str) -> asyncio.subprocess.Process:
+        raise NotImplementedError
+
+    async def put(self, host: Host, local_path: str, remote_path: str) -> asyncio.subprocess.Process:
+        raise NotImplementedError
+
+    def get_relay_command(self, source: Host, target: Host, remote_path: str) -> str:
+        # 在 source 上执行, 把 source 上的 remote_path 复制到 target 的同一路径
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+async def create_process(*args, **kwargs) -> asyncio.subprocess.Process:
+    return await asyncio.create_subprocess_exec(*args, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+                                                stderr=asyncio.subprocess.PIPE, start_new_session=True, **kwargs)
+
+
+class LocalTransport(Transport):
+    # 在本机执行命令, 用来在测试里代替 ssh; 通过环境变量告诉命令它代表哪台服务器
+    # 指定 root_dir 时每台服务器有自己的目录, 命令在这个目录下执行, 相对路径的文件互不影响
+    def __init__(self, root_dir: str = None):
+        self.root_dir = root_dir
+
+    def get_host_root(self, host: Host) -> str:
+        if not self.root_dir:
+            return None
+        host_root = os.path.join(self.root_dir, host.full_address)  # 名称可能重复, 地址不会
+        os.makedirs(host_root, exist_ok=True)
+        return host_root
+
+    def get_host_path(self, host: Host, remote_path: str) -> str:
+        host_root = self.get_host_root(host)
+        return os.path.join(host_root, remote_path) if host_root else remote_path
+
+    async def open(self, host: Host, command: str) -> asyncio.subprocess.Process:
+        env = dict(os.environ, SILK_HOST_NAME=host.name, SILK_HOST_ADDRESS=host.address)
+        return await create_process("/bin/sh", "-c", command, env=env, cwd=self.get_host_root(host))
+
+    async def put(self, host: Host, local_path: str, remote_path: str) -> asyncio.subprocess.Process:
+        return await create_process("cp", local_path, self.get_host_path(host, remote_path))
+
+    def get_relay_command(self, source: Host, target: Host, remote_path: str) -> str:
+        return "cp {0} {1}".format(shlex.quote(self.get_host_path(source, remote_path)),
+                                   shlex.quote(self.get_host_path(target, remote_path)))
+
+
+class SSHTransport(Transport):
+    def __init__(self, ssh_options: Sequence[str] = None, ssh_binary: str = "ssh", pool: ConnectionPool = None,
+                 scp_binary: str = "scp", relay_options: Sequence[str] = None):
+        self.ssh_binary = ssh_binary
+        self.scp_binary = scp_binary
+        self.ssh_options = list(ssh_options or list())
+        # 服务器之间互相复制文件时使用的 scp 参数, 需要服务器之间已经互信 (或者开启 agent forwarding)
+        self.relay_options = list(relay_options or ["-o", "BatchMode=yes", "-o", "StrictHostKeyChecking=accept-new"])
+        self.pool = pool
+
+    def get_ssh_args(self, host: Host) -> Sequence[str]:
+        if self.pool:
+            return self.pool.get_ssh_args(host)
+        return [self.ssh_binary, "-o", "BatchMode=yes"] + self.ssh_options + [host.full_address]
+
+    async def __release_session(self, host: Host, process: asyncio.subprocess.Process):
+        try:
+            await process.wait()
+        finally:
+            self.pool.release_session(host)
+
+    def get_scp_args(self, host: Host) -> Sequence[str]:
+        if self.pool:
+            return [self.pool.scp_binary, "-q"] + list(self.pool.get_ssh_options(host))
+        return [self.scp_binary, "-q", "-o", "BatchMode=yes"] + self.ssh_options
+
+    async def open(self, host: Host, command: str) -> asyncio.subprocess.Process:
+        return await self.__open_process(host, list(self.get_ssh_args(host)) + [command])
+
+    async def put(self, host: Host, local_path: str, remote_path: str) -> asyncio.subprocess.Process:
+        args = list(self.get_scp_args(host)) + [local_path, "{0}:{1}".format(host.full_address, remote_path)]
+        return await self.__open_process(host, args)
+
+    def get_relay_command(self, source: Host, target: Host, remote_path: str) -> str:
+        args = [self.scp_binary, "-q"] + self.relay_options
+        args += [remote_path, "{0}:{1}".format(target.full_address, remote_path)]
+        return " ".join(shlex.quote(arg) for arg in args)
+
+    async def __open_process(self, host: Host, args: Sequence[str]) -> asyncio.subprocess.Process:
+        if self.pool:
+            await self.pool.acquire_session_async(host)
+        try:
+            process = await create_process(*args)
+        except BaseException:
+            if self.pool:
+                self.pool.release_session(host)
+            raise
+        if self.pool:
+            asyncio.ensure_future(self.__release_session(host, process))
+        return process
+
+
+def kill_process(process: asyncio.subprocess.Process):
+    # 连同子进程一起杀掉, 否则子进程还占着 stdout/stderr, 等待进程结束会一直卡住
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        process.kill()
+
+
+class AsyncExecutor:
+    read_size = 64 * 1024
+
+    def __init__(self, transport: Transport = None, concurrency: int = 64,
+                 timeout: Union[float, Mapping[str, float], Callable[[Host], float]] = None,
+                 sinks: Sequence[OutputSink] = None, max_capture: int = None, max_line_length: int = 1024 * 1024):
+        if concurrency < 1:
+            raise ValueError("concurrency 必须大于 0, 实际收到 {0}".format(concurrency))
+        if max_line_length < 4:
+            raise ValueError("max_line_length 不能小于 4, 实际收到 {0}".format(max_line_length))
+        self.transport = transport or SSHTransport()
+        self.concurrency = concurrency
+        # timeout 可以是所有服务器共用的秒数, 也可以按服务器指定: {full_address 或 name: 秒数} 或者 host -> 秒数 的函数
+        self.timeout = timeout
+        # 输出按行推给 sinks; HostResult 中每个输出流最多保留最后 max_capture 个字符, 控制节点内存不随服务器数量增长
+        self.sinks = list(sinks or list())
+        self.max_capture = max_capture
+        # 没有换行的超长输出按 max_line_length 字节分段推给 sinks
+        self.max_line_length = max_line_length
+
+    def get_timeout(self, host: Host) -> float:
+        if callable(self.timeout):
+            return self.timeout(host)
+        if isinstance(self.timeout, Mapping):
+            return self.timeout.get(host.full_address, self.timeout.get(host.name, None))
+        return self.timeout
+
+    def __write_line(self, host: Host, stream_name: str, line: bytes):
+        text = line.decode(errors="replace")
+        for sink in self.sinks:
+            sink.write(host, stream_name, text)
+
+    def __get_cut(self, data: bytes) -> int:
+        # 在 max_line_length 之内找一个 utf-8 字符的边界, 避免把一个字符切成两段
+        cut = self.max_line_length
+        while cut > 0 and data[cut] & 0xC0 == 0x80:
+            cut -= 1
+        return cut or self.max_line_length
+
+    def __write_long_line(self, host: Host, stream_name: str, line: bytes, final: bool = True) -> bytes:
+        # 超过 max_line_length 的行分段推给 sinks; final 为 False 时返回不超过 max_line_length 的剩余部分,
+        # 等读到换行或者更多内容时再处理, 这样长度正好是 max_line_length 整数倍的行不会多出一个空行
+        while len(line) > self.max_line_length:
+            cut = self.__get_cut(line)
+            self.__write_line(host, stream_name, line[:cut])
+            line = line[cut:]
+        if final:
+            self.__write_line(host, stream_name, line)
+            return b""
+        return line
+
+    async def __pump(self, host: Host, stream_name: str, stream: asyncio.StreamReader, buffer: BoundedBuffer):
+        # 只在新读到的 chunk 里查找换行, 没有换行的部分最多累积 max_line_length 字节
+        pending, pending_size = list(), 0
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            chunk = await stream.read(self.read_size)
+            if not chunk:
+                buffer.append(decoder.decode(b"", final=True))
+                break
+            buffer.append(decoder.decode(chunk))
+            if not self.sinks:
+                continue
+            start = 0
+            end = chunk.find(b"\n")
+            while end >= 0:
+                pending.append(chunk[start:end])
+                self.__write_long_line(host, stream_name, b"".join(pending))
+                pending, pending_size = list(), 0
+                start = end + 1
+                end = chunk.find(b"\n", start)
+            if start < len(chunk):
+                pending.append(chunk[start:])
+                pending_size += len(chunk) - start
+            if pending_size > self.max_line_length:
+                rest = self.__write_long_line(host, stream_name, b"".join(pending), final=False)
+                pending, pending_size = [rest] if rest else list(), len(rest)
+        if pending and self.sinks:
+            self.__write_long_line(host, stream_name, b"".join(pending))
+
+    async def __communicate(self, host: Host, process: asyncio.subprocess.Process, result: HostResult):
+        stdout, stderr = BoundedBuffer(self.max_capture), BoundedBuffer(self.max_capture)
+        try:
+            await asyncio.gather(self.__pump(host, "stdout", process.stdout, stdout),
+                                 self.__pump(host, "stderr", process.stderr, stderr))
+            await process.wait()
+        finally:
+            result.stdout = stdout.getvalue()
+            result.stderr = stderr.getvalue()
+            result.truncated = stdout.truncated or stderr.truncated
+
+    async def __run_on_host(self, host: Host, command: str, semaphore: asyncio.Semaphore) -> HostResult:
+        result = HostResult(host, command)
+        async with semaphore:
+            start = asyncio.get_event_loop().time()
+            process = None
+            try:
+                timeout = self.get_timeout(host)
+                process = await self.transport.open(host, command)
+                await asyncio.wait_for(self.__communicate(host, process, result), timeout)
+                result.exit_code = process.returncode
+            except asyncio.TimeoutError:
+                result.error = TimeoutError("{0} 执行超时 ({1}s): {2}".format(host.name, timeout, command))
+            except Exception as e:
+                result.error = e
+            finally:
+                if process is not None and process.returncode is None:
+                    kill_process(process)
+                    await process.wait()
+            result.duration = asyncio.get_event_loop().time() - start
+        profiler = get_active_profiler()
+        if profiler is not None:
+            exit_code = result.exit_code if result.error is None else repr(result.error)
+            profiler.record("async", command, result.duration, host=host.full_address, exit_code=exit_code,
+                            size=len(result.stdout) + len(result.stderr))
+        for sink in self.sinks:
+            sink.finish(result)
+        return result
+
+    async def run_iter(self, hosts: Iterable[Host], command: str) -> AsyncIterator[HostResult]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        futures = [asyncio.ensure_future(self.__run_on_host(host, command, semaphore)) for host in hosts]
+        try:
+            for future in asyncio.as_completed(futures):
+                yield await future
+        finally:
+            for future in futures:
+                future.cancel()
+
+    async def run_async(self, hosts: Iterable[Host], command: str,
+                        on_result: Callable[[HostResult], None] = None) -> Dict[str, HostResult]:
+        # Environment 中服务器名称可能重复, 所以按 full_address 返回结果
+        results = dict()
+        async for result in self.run_iter(hosts, command):
+            results[result.host.full_address] = result
+            if on_result:
+                on_result(result)
+        return results
+
+    def run(self, hosts: Iterable[Host], command: str, on_result: Callable[[HostResult], None] = None) -> Dict[str, HostResult]:
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.run_async(hosts, command, on_result))
+        finally:
+            loop.run_until_complete(self.transport.close())
+            loop.close()
+            for sink in self.sinks:
+                sink.close()
+
+
+__all__ = ["HostResult", "Transport", "LocalTransport", "SSHTransport", "AsyncExecutor"]
@@ -0,0 +1,120 @@
+import shlex
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Tuple
+from typing import Optional
+from typing import Sequence
+
+from fabric.api import run
+from fabric.api import sudo
+
+from silk.fabric_tools.probe_cache import seed_probe
+
+# 每条结果前面都带上标记, 这样 motd 或者 shell 启动脚本打印的内容不会影响解析
+result_marker = "__silk_probe__"
+
+
+def quote_path(path: str) -> str:
+    # 和 fabric 的 exists 一样支持 ~ 开头的路径
+    if path == "~":
+        return "\"$HOME\""
+    if path.startswith("~/"):
+        return "\"$HOME\"/{0}".format(shlex.quote(path[2:]))
+    return shlex.quote(path)
+
+
+def build_exists_script(paths: Sequence[str]) -> str:
+    # 结果会写入 exists 的探测缓存, 所以判断方式必须和 fabric 的 exists 完全一致:
+    # stat "$(echo 路径)" 会展开变量和通配符, 悬空的软链接也算存在
+    lines = ["if stat \"$(echo {0})\" >/dev/null 2>&1; then echo '{1} {2} 1'; else echo '{1} {2} 0'; fi".format(
+        path, result_marker, index) for index, path in enumerate(paths)]
+    return "\n".join(lines)
+
+
+def build_contains_script(checks: Sequence[Tuple[str, str]], exact: bool = False, case_sensitive: bool = True) -> str:
+    options = "-q -F" + (" -x" if exact else "") + ("" if case_sensitive else " -i")
+    lines = ["if grep {0} -e {1} {2} 2>/dev/null; then echo '{3} {4} 1'; else echo '{3} {4} 0'; fi".format(
+        options, shlex.quote(text), quote_path(filename), result_marker, index)
+        for index, (filename, text) in enumerate(checks)]
+    return "\n".join(lines)
+
+
+def build_stat_script(paths: Sequence[str]) -> str:
+    # GNU stat, 输出: 类型|大小|权限|属主|属组|修改时间
+    lines = ["printf '{0} {1} '; stat -c '%F|%s|%a|%U|%G|%Y' {2} 2>/dev/null || echo".format(
+        result_marker, index, quote_path(path)) for index, path in enumerate(paths)]
+    return "\n".join(lines)
+
+
+def parse_results(count: int, output: str) -> List[Optional[str]]:
+    results = [None] * count
+    for line in output.splitlines():
+        marker, _, rest = line.strip().partition(" ")
+        if marker != result_marker:
+            continue
+        index, _, value = rest.partition(" ")
+        if index.isdigit() and int(index) < count:
+            results[int(index)] = value
+    return results
+
+
+def parse_exists_output(paths: Sequence[str], output: str) -> Dict[str, bool]:
+    return {path: value == "1" for path, value in zip(paths, parse_results(len(paths), output))}
+
+
+def parse_contains_output(checks: Sequence[Tuple[str, str]], output: str) -> Dict[Tuple[str, str], bool]:
+    return {tuple(check): value == "1" for check, value in zip(checks, parse_results(len(checks), output))}
+
+
+def parse_stat_output(paths: Sequence[str], output: str) -> Dict[str, Optional[Dict[str, Any]]]:
+    stats = dict()
+    for path, value in zip(paths, parse_results(len(paths), output)):
+        fields = (value or "").split("|")
+        if len(fields) != 6:
+            stats[path] = None
+            continue
+        file_type, size, mode, owner, group, mtime = fields
+        stats[path] = {"type": file_type, "size": int(size), "mode": int(mode, 8), "owner": owner, "group": group,
+                       "mtime": int(mtime), "is_link": file_type == "symbolic link"}
+    return stats
+
+
+def run_script(script: str, use_sudo: bool = False) -> str:
+    # 直接调用 fabric 的 run/sudo: 只读的探测不应该让探测缓存失效
+    func = sudo if use_sudo else run
+    output = func(script, pty=False, combine_stderr=False, quiet=True)
+    if output.failed:
+        raise Exception("批量探测失败: {0}".format(output.stderr))
+    return output
+
+
+def exists_many(paths: Sequence[str], use_sudo: bool = False) -> Dict[str, bool]:
+    paths = list(paths)
+    if not paths:
+        return dict()
+    results = parse_exists_output(paths, run_script(build_exists_script(paths), use_sudo))
+    kwargs = {"use_sudo": True} if use_sudo else dict()
+    for path, result in results.items():
+        seed_probe("exists", (path,), kwargs, result)
+    return results
+
+
+def contains_many(checks: Sequence[Tuple[str, str]], exact: bool = False, use_sudo: bool = False,
+                  case_sensitive: bool = True) -> Dict[Tuple[str, str], bool]:
+    # checks 是 [(文件, 文本)], 文本按普通字符串匹配, 不是正则
+    checks = [tuple(check) for check in checks]
+    if not checks:
+        return dict()
+    return parse_contains_output(checks, run_script(build_contains_script(checks, exact, case_sensitive), use_sudo))
+
+
+def stat_many(paths: Sequence[str], use_sudo: bool = False) -> Dict[str, Optional[Dict[str, Any]]]:
+    paths = list(paths)
+    if not paths:
+        return dict()
+    # 这里按字面路径 stat, 而 fabric 的 is_link 会展开路径, 两者结果可能不同, 所以不写入 is_link 的探测缓存
+    return parse_stat_output(paths, run_script(build_stat_script(paths), use_sudo))
+
+
+__all__ = ["exists_many", "contains_many", "stat_many"]
@@ -0,0 +1,175 @@
+import os
+import time
+import shutil
+import asyncio
+import hashlib
+import weakref
+import tempfile
+import threading
+import subprocess
+from typing import Dict
+from typing import Sequence
+from contextlib import contextmanager
+
+
+def get_control_path(control_dir: str, full_address: str) -> str:
+    return os.path.join(control_dir, hashlib.sha1(full_address.encode()).hexdigest()[:16])
+
+
+def close_masters(ssh_binary: str, control_dir: str, last_used: Dict[str, float], lock: threading.Lock,
+                  remove_control_dir: bool):
+    # 不能引用 ConnectionPool 本身, 否则 weakref.finalize 会让连接池一直存活到进程退出
+    with lock:
+        addresses = list(last_used)
+        last_used.clear()
+    for address in addresses:
+        control_path = get_control_path(control_dir, address)
+        if os.path.exists(control_path):
+            subprocess.call([ssh_binary, "-o", "ControlPath={0}".format(control_path), "-O", "exit", address],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if remove_control_dir:
+        shutil.rmtree(control_dir, ignore_errors=True)
+
+
+class ConnectionPool:
+    # 基于 OpenSSH ControlMaster 的连接池: 每台服务器只握手一次, 之后的 ssh/scp 都复用这条连接
+    def __init__(self, control_dir: str = None, idle_timeout: int = 300, max_sessions_per_host: int = 8,
+                 ssh_binary: str = "ssh", scp_binary: str = "scp", ssh_options: Sequence[str] = None):
+        if max_sessions_per_host < 1:
+            raise ValueError("max_sessions_per_host 必须大于 0, 实际收到 {0}".format(max_sessions_per_host))
+        # unix socket 路径长度有限制, 所以默认放在很短的临时目录里, 关闭连接池时删除
+        self.__owns_control_dir = control_dir is None
+        self.control_dir = control_dir or tempfile.mkdtemp(prefix="silk-ssh-")
+        self.idle_timeout = idle_timeout
+        self.max_sessions_per_host = max_sessions_per_host
+        self.ssh_binary = ssh_binary
+        self.scp_binary = scp_binary
+        self.ssh_options = list(ssh_options or list())
+        self.__last_used = dict()
+        self.__sessions = dict()
+        self.__lock = threading.Lock()
+        # 会话数达到上限时线程在 condition 上等待, 协程在各自事件循环的 future 上等待, 释放会话时唤醒它们
+        self.__condition = threading.Condition(self.__lock)
+        self.__async_waiters = dict()
+        self.__finalizer = None
+        self.__open()
+
+    def __open(self):
+        # 连接池被回收或者进程退出时自动关闭所有 master 连接
+        os.makedirs(self.control_dir, exist_ok=True)
+        self.__finalizer = weakref.finalize(self, close_masters, self.ssh_binary, self.control_dir, self.__last_used,
+                                            self.__lock, self.__owns_control_dir)
+
+    def get_control_path(self, host) -> str:
+        return get_control_path(self.control_dir, host.full_address)
+
+    def get_ssh_options(self, host) -> Sequence[str]:
+        return ["-o", "ControlMaster=auto",
+                "-o", "ControlPath={0}".format(self.get_control_path(host)),
+                "-o", "ControlPersist={0}".format(self.idle_timeout),
+                "-o", "BatchMode=yes"] + self.ssh_options
+
+    def get_ssh_args(self, host) -> Sequence[str]:
+        return [self.ssh_binary] + list(self.get_ssh_options(host)) + [host.full_address]
+
+    def __try_acquire_session(self, host) -> bool:
+        # 调用方需要持有 self.__lock
+        if not self.__finalizer.alive:
+            self.__open()  # close_all 之后再次使用
+        sessions = self.__sessions.get(host.full_address, 0)
+        if sessions >= self.max_sessions_per_host:
+            return False
+        self.__sessions[host.full_address] = sessions + 1
+        self.__last_used[host.full_address] = time.time()
+        return True
+
+    @staticmethod
+    def __wake(waiter: asyncio.Future):
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def release_session(self, host):
+        with self.__condition:
+            self.__sessions[host.full_address] = max(self.__sessions.get(host.full_address, 0) - 1, 0)
+            self.__last_used[host.full_address] = time.time()
+            self.__condition.notify_all()
+            for loop, waiter in self.__async_waiters.pop(host.full_address, list()):
+                loop.call_soon_threadsafe(self.__wake, waiter)
+
+    def acquire_session(self, host):
+        with self.__condition:
+            while not self.__try_acquire_session(host):
+                self.__condition.wait()
+
+    async def acquire_session_async(self, host):
+        loop = asyncio.get_event_loop()
+        while True:
+            with self.__lock:
+                if self.__try_acquire_session(host):
+                    return
+                waiter = loop.create_future()
+                waiters = self.__async_waiters.setdefault(host.full_address, list())
+                waiters.append((loop, waiter))
+            try:
+                await waiter
+            finally:
+                with self.__lock:
+                    if (loop, waiter) in waiters:
+                        waiters.remove((loop, waiter))
+
+    @contextmanager
+    def session(self, host):
+        self.acquire_session(host)
+        try:
+            yield self.get_ssh_args(host)
+        finally:
+            self.release_session(host)
+
+    def active_sessions(self) -> Dict[str, int]:
+        with self.__lock:
+            return {address: count for address, count in self.__sessions.items() if count}
+
+    def run(self, host, command: str) -> subprocess.CompletedProcess:
+        with self.session(host) as ssh_args:
+            return subprocess.run(list(ssh_args) + [command], stdin=subprocess.DEVNULL,
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def put(self, host, local_path: str, remote_path: str) -> subprocess.CompletedProcess:
+        with self.session(host):
+            args = [self.scp_binary, "-q"] + list(self.get_ssh_options(host))
+            args += [local_path, "{0}:{1}".format(host.full_address, remote_path)]
+            return subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def get(self, host, remote_path: str, local_path: str) -> subprocess.CompletedProcess:
+        with self.session(host):
+            args = [self.scp_binary, "-q"] + list(self.get_ssh_options(host))
+            args += ["{0}:{1}".format(host.full_address, remote_path), local_path]
+            return subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def __exit_master(self, full_address: str):
+        control_path = get_control_path(self.control_dir, full_address)
+        if os.path.exists(control_path):
+            subprocess.call([self.ssh_binary, "-o", "ControlPath={0}".format(control_path), "-O", "exit", full_address],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def evict_idle(self, idle_timeout: float = None) -> Sequence[str]:
+        idle_timeout = self.idle_timeout if idle_timeout is None else idle_timeout
+        with self.__lock:
+            now = time.time()
+            evicted = [address for address, last_used in self.__last_used.items()
+                       if not self.__sessions.get(address) and now - last_used >= idle_timeout]
+            for address in evicted:
+                self.__last_used.pop(address)
+        for address in evicted:
+            self.__exit_master(address)
+        return evicted
+
+    def close_all(self):
+        # 关闭所有 master 连接并删除自己创建的 control 目录, 之后再使用连接池会重新创建
+        self.__finalizer()
+
+    def __repr__(self):
+        return "ConnectionPool(\"{0}\")".format(self.control_dir)
+
+
+__all__ = ["ConnectionPool"]
@@ -0,0 +1,154 @@
+import shlex
+import asyncio
+import hashlib
+from typing import Dict
+from typing import List
+from typing import Tuple
+from typing import Optional
+from typing import Sequence
+from collections import deque
+
+from silk.fabric_tools.fabric_context import Host
+from silk.fabric_tools.async_executor import HostResult
+from silk.fabric_tools.async_executor import Transport
+from silk.fabric_tools.async_executor import SSHTransport
+from silk.fabric_tools.async_executor import kill_process
+
+
+def plan_fanout(hosts: Sequence[Host], seeds: int = 1, fanout: int = 3) -> List[List[Tuple[Optional[Host], Host]]]:
+    # 控制节点只上传给 seeds 台服务器, 之后每一轮里每台已经拿到文件的服务器再转发给 fanout 台,
+    # 总轮数约为 log(n / seeds) / log(fanout + 1), 而不是和服务器数量成正比
+    if seeds < 1 or fanout < 1:
+        raise ValueError("seeds 和 fanout 必须大于 0, 实际收到 {0} 和 {1}".format(seeds, fanout))
+    pending = deque(hosts)
+    first_round = [(None, pending.popleft()) for _ in range(min(seeds, len(pending)))]
+    rounds = [first_round] if first_round else list()
+    holders = [target for _, target in first_round]
+    while pending:
+        current_round = list()
+        for source in holders:
+            for _ in range(fanout):
+                if not pending:
+                    break
+                current_round.append((source, pending.popleft()))
+        holders += [target for _, target in current_round]
+        rounds.append(current_round)
+    return rounds
+
+
+def get_file_checksum(file_path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class FanoutDistributor:
+    # concurrency 限制同时进行的传输数量, max_uploads 单独限制控制节点同时上传的数量:
+    # 转发大量失败时所有目标都会回退为控制节点上传, 不加限制会占满控制节点的带宽和 ssh 连接
+    def __init__(self, transport: Transport = None, seeds: int = 1, fanout: int = 3, timeout: float = None,
+                 max_uploads: int = 4, concurrency: int = 64):
+        plan_fanout(list(), seeds, fanout)  # 提前检查参数
+        if max_uploads < 1 or concurrency < 1:
+            raise ValueError("max_uploads 和 concurrency 必须大于 0, 实际收到 {0} 和 {1}".format(max_uploads, concurrency))
+        self.transport = transport or SSHTransport()
+        self.seeds = seeds
+        self.fanout = fanout
+        self.timeout = timeout
+        self.max_uploads = max_uploads
+        self.concurrency = concurrency
+        self.rounds = list()
+
+    async def __communicate(self, process: asyncio.subprocess.Process) -> Tuple[int, str, str]:
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), self.timeout)
+        finally:
+            if process.returncode is None:
+                kill_process(process)
+                await process.wait()
+        return process.returncode, stdout.decode(errors="replace"), stderr.decode(errors="replace")
+
+    async def __copy(self, source: Optional[Host], target: Host, local_path: str, remote_path: str,
+                     checksum: str, upload_semaphore: asyncio.Semaphore) -> Tuple[int, str]:
+        if source is None:
+            async with upload_semaphore:
+                process = await self.transport.put(target, local_path, remote_path)
+                exit_code, _, stderr = await self.__communicate(process)
+        else:
+            process = await self.transport.open(source, self.transport.get_relay_command(source, target, remote_path))
+            exit_code, _, stderr = await self.__communicate(process)
+        if exit_code != 0:
+            return exit_code, stderr
+
+        process = await self.transport.open(target, "sha256sum {0}".format(shlex.quote(remote_path)))
+        exit_code, stdout, stderr = await self.__communicate(process)
+        if exit_code != 0:
+            return exit_code, stderr
+        if stdout.split(" ")[0].strip() != checksum:
+            return 1, "{0} 上的 {1} 校验失败".format(target.name, remote_path)
+        return 0, ""
+
+    async def __transfer(self, source: Optional[Host], target: Host, local_path: str, remote_path: str,
+                         checksum: str, semaphore: asyncio.Semaphore, upload_semaphore: asyncio.Semaphore) -> HostResult:
+        async with semaphore:
+            return await self.__transfer_locked(source, target, local_path, remote_path, checksum, upload_semaphore)
+
+    async def __transfer_locked(self, source: Optional[Host], target: Host, local_path: str, remote_path: str,
+                                checksum: str, upload_semaphore: asyncio.Semaphore) -> HostResult:
+        result = HostResult(target, "put {0}".format(remote_path) if source is None else "relay from {0}".format(source.name))
+        start = asyncio.get_event_loop().time()
+        try:
+            result.exit_code, result.stderr = await self.__copy(source, target, local_path, remote_path, checksum,
+                                                                upload_semaphore)
+            if result.exit_code != 0 and source is not None:
+                # 转发失败时 (比如服务器之间不通) 由控制节点直接上传
+                result.command = "put {0}".format(remote_path)
+                result.exit_code, result.stderr = await self.__copy(None, target, local_path, remote_path, checksum,
+                                                                    upload_semaphore)
+        except asyncio.TimeoutError:
+            result.error = TimeoutError("{0} 传输超时 ({1}s): {2}".format(target.name, self.timeout, remote_path))
+        except Exception as e:
+            result.error = e
+        result.duration = asyncio.get_event_loop().time() - start
+        return result
+
+    async def distribute_async(self, hosts: Sequence[Host], local_path: str, remote_path: str) -> Dict[str, HostResult]:
+        checksum = get_file_checksum(local_path)
+        self.rounds = plan_fanout(hosts, self.seeds, self.fanout)
+        # Environment 中服务器名称可能重复, 所以结果和已经拿到文件的服务器都按 full_address 记录
+        results, holders = dict(), set()
+        semaphore, upload_semaphore = asyncio.Semaphore(self.concurrency), asyncio.Semaphore(self.max_uploads)
+        for current_round in self.rounds:
+            # 源服务器自己没有拿到文件时, 改由控制节点上传
+            transfers = [(source if source is None or source.full_address in holders else None, target)
+                         for source, target in current_round]
+            round_results = await asyncio.gather(*[self.__transfer(source, target, local_path, remote_path, checksum,
+                                                                   semaphore, upload_semaphore)
+                                                   for source, target in transfers])
+            for result in round_results:
+                results[result.host.full_address] = result
+                if result.succeeded:
+                    holders.add(result.host.full_address)
+        return results
+
+    def distribute(self, hosts: Sequence[Host], local_path: str, remote_path: str) -> Dict[str, HostResult]:
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.distribute_async(hosts, local_path, remote_path))
+        finally:
+            loop.run_until_complete(self.transport.close())
+            loop.close()
+
+    def __repr__(self):
+        return "FanoutDistributor({0}, {1})".format(self.seeds, self.fanout)
+
+
+def distribute_file(hosts: Sequence[Host], local_path: str, remote_path: str, transport: Transport = None,
+                    seeds: int = 1, fanout: int = 3, timeout: float = None, max_uploads: int = 4,
+                    concurrency: int = 64) -> Dict[str, HostResult]:
+    distributor = FanoutDistributor(transport, seeds, fanout, timeout, max_uploads, concurrency)
+    return distributor.distribute(hosts, local_path, remote_path)
+
+
+__all__ = ["plan_fanout", "FanoutDistributor", "distribute_file"]
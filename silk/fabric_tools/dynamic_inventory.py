@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import marshal
+import hashlib
+import threading
+import subprocess
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Type
+
+import requests
+
+from silk.fabric_tools.fabric_context import Environment
+from silk.fabric_tools.inventory import InventoryLoader
+from silk.file_tools import generate_random_str
+
+
+class InventorySource:
+    # 动态 inventory 的插件接口: fetch 返回和 inventory 文件一样的结构, 即 {"environments": {...}}
+    def get_cache_key(self) -> str:
+        raise NotImplementedError
+
+    def fetch(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class CommandSource(InventorySource):
+    def __init__(self, command: str, timeout: float = 60):
+        self.command = command
+        self.timeout = timeout
+
+    def get_cache_key(self) -> str:
+        return "cmd:{0}".format(self.command)
+
+    def fetch(self) -> Dict[str, Any]:
+        result = subprocess.run(self.command, shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, timeout=self.timeout)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, self.command, result.stdout, result.stderr)
+        return json.loads(result.stdout.decode())
+
+    def __repr__(self):
+        return "CommandSource(\"{0}\")".format(self.command)
+
+
+class FileSource(InventorySource):
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    def get_cache_key(self) -> str:
+        return "file:{0}".format(os.path.abspath(self.file_path))
+
+    def fetch(self) -> Dict[str, Any]:
+        return {"environments": InventoryLoader().parse(self.file_path)}
+
+    def __repr__(self):
+        return "FileSource(\"{0}\")".format(self.file_path)
+
+
+class HttpSource(InventorySource):
+    def __init__(self, url: str, timeout: float = 10, headers: Dict[str, str] = None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = dict(headers or dict())
+
+    def get_cache_key(self) -> str:
+        return "http:{0}".format(self.url)
+
+    def fetch(self) -> Dict[str, Any]:
+        response = requests.get(self.url, headers=self.headers, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def __repr__(self):
+        return "HttpSource(\"{0}\")".format(self.url)
+
+
+inventory_sources = {"cmd": CommandSource, "file": FileSource, "http": HttpSource, "https": HttpSource}
+
+
+def register_source(scheme: str, source_class: Type[InventorySource]):
+    inventory_sources[scheme] = source_class
+
+
+def create_source(spec: str) -> InventorySource:
+    # "cmd:./ec2.py --list", "file:/etc/silk/hosts.yaml", "https://cmdb/api/inventory", 没有前缀的当作文件
+    scheme, _, value = spec.partition(":")
+    if scheme in ("http", "https"):
+        return inventory_sources[scheme](spec)
+    if value and scheme in inventory_sources:
+        return inventory_sources[scheme](value)
+    return FileSource(spec)
+
+
+class DynamicInventory:
+    # 缓存没有过期时直接使用; 过期之后先返回旧数据, 同时在后台刷新; 超过 max_stale 或者没有缓存时才阻塞等待
+    cache_version = 1
+
+    def __init__(self, source: InventorySource, ttl: float = 300, max_stale: float = None, cache_dir: str = None):
+        self.source = source
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".cache", "silk", "dynamic_inventory")
+        self.last_error = None
+        self.__cache = None
+        self.__lock = threading.Lock()
+        self.__refresh_thread = None
+
+    def get_cache_path(self) -> str:
+        cache_name = hashlib.sha1(self.source.get_cache_key().encode()).hexdigest()
+        return os.path.join(self.cache_dir, "{0}.marshal".format(cache_name))
+
+    def __load_cache(self) -> Dict[str, Any]:
+        try:
+            with open(self.get_cache_path(), "rb") as f:
+                cache = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(cache, dict) or cache.get("version") != self.cache_version:
+            return None
+        return cache
+
+    def __dump_cache(self, cache: Dict[str, Any]):
+        cache_path = self.get_cache_path()
+        tmp_path = "{0}.{1}.tmp".format(cache_path, generate_random_str(8))
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                marshal.dump(cache, f)
+            os.replace(tmp_path, cache_path)
+        except (OSError, ValueError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def refresh(self) -> Dict[str, Dict[str, Any]]:
+        data = self.source.fetch()
+        environments = InventoryLoader.normalize(data.get("environments", dict()))
+        cache = {"version": self.cache_version, "fetched_at": time.time(), "environments": environments}
+        self.__dump_cache(cache)
+        with self.__lock:
+            self.__cache = cache
+            self.last_error = None
+        return environments
+
+    def __refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            # 后台刷新失败时继续使用旧数据, 错误留给调用方查看
+            self.last_error = e
+
+    def refresh_async(self) -> threading.Thread:
+        with self.__lock:
+            if self.__refresh_thread is None or not self.__refresh_thread.is_alive():
+                self.__refresh_thread = threading.Thread(target=self.__refresh_in_background, daemon=True)
+                self.__refresh_thread.start()
+            return self.__refresh_thread
+
+    def wait_for_refresh(self, timeout: float = None):
+        thread = self.__refresh_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def load_data(self) -> Dict[str, Dict[str, Any]]:
+        with self.__lock:
+            cache = self.__cache
+        if cache is None:
+            cache = self.__load_cache()
+            with self.__lock:
+                self.__cache = self.__cache or cache
+        if cache is None:
+            return self.refresh()
+
+        age = time.time() - cache["fetched_at"]
+        if age < self.ttl:
+            return cache["environments"]
+        if self.max_stale is not None and age >= self.max_stale:
+            return self.refresh()
+        self.refresh_async()
+        return cache["environments"]
+
+    def load(self) -> List[Environment]:
+        # 可以重复调用: 已经存在的 environment 原地更新为最新的数据, 之前拿到的 Environment 对象仍然有效
+        environments = list()
+        for environment_name, environment in self.load_data().items():
+            environments.append(Environment.load_records(environment_name, environment["hosts"], **environment["options"]))
+        return environments
+
+    def __repr__(self):
+        return "DynamicInventory({0!r})".format(self.source)
+
+
+__all__ = ["InventorySource", "CommandSource", "FileSource", "HttpSource", "register_source", "create_source",
+           "DynamicInventory"]
@@ -5,6 +5,16 @@ from fabric.api import (cd, hide, settings, show, path, prefix, lcd,
                         run, sudo, local, reboot, open_shell, output,
                         abort, warn, puts, fastprint, execute)
 
+from .probe_cache import invalidates_probes
+from .profiler import profiled
+
+put = invalidates_probes(profiled("put")(put))
+get = profiled("get")(get)
+run = invalidates_probes(profiled("run")(run))
+sudo = invalidates_probes(profiled("sudo")(sudo))
+reboot = invalidates_probes(reboot)
+open_shell = invalidates_probes(open_shell)
+
 __all__ = [
     "cd",
     "hide",
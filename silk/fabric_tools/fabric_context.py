@@ -1,4 +1,9 @@
 import os
+import sys
+import heapq
+import threading
+from typing import Set
+from typing import Iterable
 from typing import Sequence
 from functools import wraps
 
@@ -7,34 +12,83 @@ from silk.fabric_tools import hosts
 from silk.fabric_tools import roles
 from silk.fabric_tools import execute
 from silk.fabric_tools import parallel
+from silk.fabric_tools.connection_pool import ConnectionPool
+from silk.fabric_tools.rolling_scheduler import RollingScheduler
+from silk.fabric_tools.host_selector import select_hosts
+from silk.fabric_tools.probe_cache import clear_probe_cache
+from silk.fabric_tools.profiler import profiled_task
 
 
 class Host:
+    # 服务器数量可能上万, 所以用 __slots__ 并 intern 字符串, role 关系用 bitset 保存
+    __slots__ = ("name", "user", "address", "full_address", "role_bits")
+
     def __init__(self, name: str, address: str, user="deploy"):
-        self.name = name
-        self.user = user
-        self.address = address
-        self.full_address = "{0}@{1}".format(self.user, self.address)
-        self.roles = set()
+        self.name = sys.intern(name)
+        self.user = sys.intern(user)
+        self.address = sys.intern(address)
+        self.full_address = sys.intern("{0}@{1}".format(self.user, self.address))
+        self.role_bits = 0
+
+    @property
+    def roles(self) -> Set["Role"]:
+        roles_, bits = set(), self.role_bits
+        while bits:
+            lowest_bit = bits & -bits
+            role = Role.get_role_by_index(lowest_bit.bit_length() - 1)
+            if role is not None:
+                roles_.add(role)
+            bits ^= lowest_bit
+        return roles_
 
     def add_role(self, role: "Role"):
-        self.roles.add(role)
+        self.role_bits |= role.bit
         if not role.has_host(self):
             role.add_host(self)
 
     def has_role(self, role: "Role"):
-        return role in self.roles
+        return bool(self.role_bits & role.bit)
 
     def __repr__(self):
         return "Host(\"{0}\", \"{1}\")".format(self.name, self.address)
 
 
 class Role:
+    __slots__ = ("name", "hosts", "index", "bit")
+    # 每个 role 占用 Host.role_bits 中的一位, 用 release 释放的位会分配给之后创建的 role,
+    # 所以 role_bits 的宽度只取决于同时存在的 role 数量, 不会随着 inventory 的重新加载一直变宽
+    __roles_by_index = dict()
+    __free_indexes = list()
+    __lock = threading.Lock()
+
     def __init__(self, name, hosts: Sequence["Host"]):
-        self.name = name
+        self.name = sys.intern(name)
+        with Role.__lock:
+            if Role.__free_indexes:
+                self.index = heapq.heappop(Role.__free_indexes)
+            else:
+                self.index = len(Role.__roles_by_index)
+            Role.__roles_by_index[self.index] = self
+        self.bit = 1 << self.index
         self.hosts = set() if not hosts else set(hosts)
         for host in self.hosts:
-            host.add_role(self)
+            host.role_bits |= self.bit
+
+    def release(self):
+        # 从所有服务器上移除这个 role, 之后这个 role 不能再使用
+        with Role.__lock:
+            if Role.__roles_by_index.get(self.index, None) is not self:
+                return
+            for host in self.hosts:
+                host.role_bits &= ~self.bit
+            del Role.__roles_by_index[self.index]
+            heapq.heappush(Role.__free_indexes, self.index)
+        self.hosts = set()
+        self.index, self.bit = None, 0
+
+    @staticmethod
+    def get_role_by_index(index: int) -> "Role":
+        return Role.__roles_by_index.get(index, None)
 
     def add_host(self, host: "Host"):
         self.hosts.add(host)
@@ -52,17 +106,81 @@ class Environment:
     created_environments = dict()
 
     def __init__(self, name, roles, **options):
+        if Environment.created_environments.get(name, None):
+            raise Exception("Environment(\"{0}\") 已经存在".format(name))
         self.name = name
         self.roles = set(roles)
         self.options = options
+        self.__connection_pool = None
         self.hosts = set()
+        # 服务器很多时每个任务都要查找当前服务器和 role, 所以提前建好索引
+        self.__hosts_by_name = dict()
+        self.__hosts_by_address = dict()
+        self.__roles_by_name = dict()
+        self.__roles_cache = dict()
         for role in self.roles:
-            for host in role.hosts:
-                self.hosts.add(host)
+            self.__index_role(role)
+        Environment.created_environments[name] = self
+
+    @staticmethod
+    def __create_hosts(records: Iterable[dict]) -> list:
+        # records 形如 {"name": "web-01", "address": "10.0.0.1", "user": "deploy", "roles": ["web"]}
+        return [(Host(record["name"], record["address"], user=record.get("user", None) or "deploy"),
+                 list(record.get("roles", list()))) for record in records]
+
+    @staticmethod
+    def __assign_roles(hosts_: list, existing_roles: dict) -> dict:
+        # 同名的 role 沿用 existing_roles 中的对象, 保留它占用的位
+        roles_ = dict()
+        for host, role_names in hosts_:
+            for role_name in role_names:
+                role = roles_.get(role_name, None)
+                if role is None:
+                    role = existing_roles.get(role_name, None) or Role(role_name, list())
+                    roles_[role_name] = role
+                role.hosts.add(host)
+                host.role_bits |= role.bit
+        return roles_
 
+    @staticmethod
+    def from_records(name: str, records: Iterable[dict], **options) -> "Environment":
+        # 批量创建
         if Environment.created_environments.get(name, None):
-            raise Exception("{0} 已经存在".format(self))
-        Environment.created_environments[name] = self
+            raise Exception("Environment(\"{0}\") 已经存在".format(name))
+        roles_ = Environment.__assign_roles(Environment.__create_hosts(records), dict())
+        return Environment(name, roles_.values(), **options)
+
+    def update_from_records(self, records: Iterable[dict], **options):
+        # 用新的 inventory 数据原地替换服务器和 role, 已经拿到这个 environment 的调用方和连接池不受影响;
+        # 新数据中不再存在的 role 会被释放
+        hosts_ = Environment.__create_hosts(records)  # 数据有问题时在修改任何 role 之前失败
+        old_roles = dict(self.__roles_by_name)
+        for role in old_roles.values():
+            for host in role.hosts:
+                host.role_bits &= ~role.bit
+            role.hosts = set()
+        roles_ = Environment.__assign_roles(hosts_, old_roles)
+        for role_name, role in old_roles.items():
+            if role_name not in roles_:
+                role.release()
+
+        self.roles, self.hosts = set(), set()
+        self.__hosts_by_name.clear()
+        self.__hosts_by_address.clear()
+        self.__roles_by_name.clear()
+        for role in roles_.values():
+            self.__index_role(role)
+        self.__roles_cache.clear()
+        self.options = options
+
+    @staticmethod
+    def load_records(name: str, records: Iterable[dict], **options) -> "Environment":
+        # 不存在时创建, 已经存在时原地更新, 用于重复加载 inventory
+        environment = Environment.get_environment(name)
+        if environment is None:
+            return Environment.from_records(name, records, **options)
+        environment.update_from_records(records, **options)
+        return environment
 
     @staticmethod
     def get_environment(name) -> "Environment":
@@ -77,6 +195,62 @@ class Environment:
         env.roledefs = roledefs
         return roledefs
 
+    @property
+    def connection_pool(self) -> ConnectionPool:
+        # 同一个 environment 下的所有任务共享 ssh 连接, 每台服务器只需要握手一次
+        if self.__connection_pool is None:
+            self.__connection_pool = ConnectionPool(idle_timeout=self.options.get("ssh_idle_timeout", 300),
+                                                    max_sessions_per_host=self.options.get("ssh_max_sessions", 8))
+        return self.__connection_pool
+
+    def __index_host(self, host: Host):
+        self.hosts.add(host)
+        hosts = self.__hosts_by_name.setdefault(host.name, list())
+        if host not in hosts:
+            hosts.append(host)
+        self.__hosts_by_address.setdefault(host.full_address, host)
+
+    def __index_role(self, role: Role):
+        self.roles.add(role)
+        self.__roles_by_name[role.name] = role
+        for host in role.hosts:
+            self.__index_host(host)
+        self.__roles_cache.clear()
+
+    def add_role(self, role: Role):
+        self.__index_role(role)
+
+    def add_host(self, host: Host, role_names: Sequence[str]):
+        # 要通过 environment 添加服务器, 直接调用 Role.add_host 不会更新索引
+        for role_name in role_names:
+            role = self.__roles_by_name.get(role_name, None)
+            if not role:
+                raise Exception("{0} 中没有 role {1}".format(self, role_name))
+            role.add_host(host)
+        self.__index_host(host)
+
+    def get_host(self, full_address: str) -> "Host":
+        return self.__hosts_by_address.get(full_address, None)
+
+    def get_hosts(self, name: str) -> Sequence["Host"]:
+        if name == "all":
+            return list(self.hosts)
+        return list(self.__hosts_by_name.get(name, list()))
+
+    def get_host_names(self) -> Sequence[str]:
+        return list(self.__hosts_by_name)
+
+    def get_role(self, name: str) -> "Role":
+        return self.__roles_by_name.get(name, None)
+
+    def get_roles(self, names: Sequence[str]) -> Sequence["Role"]:
+        names = tuple(names)
+        roles_ = self.__roles_cache.get(names, None)
+        if roles_ is None:
+            roles_ = [self.__roles_by_name[name] for name in names if name in self.__roles_by_name]
+            self.__roles_cache[names] = roles_
+        return list(roles_)
+
     def are_all_roles(self, roles):
         return set(roles) == set(self.roles)
 
@@ -96,8 +270,11 @@ class Environment:
 def run_per_host(*args, inputs: Sequence[str] = None, prompts: dict = None, run_parallel: bool = True):
     def task_runner_decorator(inputs_, prompts_):
         def task_runner_wrapper(task_func):
+            profiled_task_func = profiled_task(task_func)  # 没有开启 profiling 时不做任何记录
+
             @wraps(task_func)
             def task_runner(*args_, **kwargs_):
+                clear_probe_cache()  # 探测结果只在一次任务中有效
                 if isinstance(prompts_, dict):
                     env.prompts.update(prompts)
 
@@ -115,12 +292,10 @@ def run_per_host(*args, inputs: Sequence[str] = None, prompts: dict = None, run_
                 Environment.finalize_environment(environment_name)
                 env.environment_name = environment_name
 
-                hosts_ = []
-                for host in environment.hosts:
-                    if host_name in [host.name, "all"]:
-                        hosts_.append(host.full_address)
+                # host_name 可以是选择表达式, 比如 "role:web & !web-01/50%", 参考 host_selector
+                hosts_ = [host.full_address for host in select_hosts(environment, host_name)]
 
-                hosted_task_func = hosts(*hosts_)(task_func)
+                hosted_task_func = hosts(*hosts_)(profiled_task_func)
 
                 if run_parallel:
                     paralleled_task_func = parallel(hosted_task_func)
@@ -144,11 +319,27 @@ def run_per_host(*args, inputs: Sequence[str] = None, prompts: dict = None, run_
         raise TypeError("@run_per_host() 只接受 1 个 positional argument, 实际收到 {0} 个".format(len(args)))
 
 
-def run_per_role(*args, inputs=None, prompts=None, run_parallel: bool = True):
+def execute_on_roles(task_func, role_names: Sequence[str], args: Sequence = None, kwargs: dict = None,
+                     run_parallel: bool = True):
+    # run_per_role 和 TaskGraph 共用的执行逻辑, 调用前需要设置好 env.environment_name 和 env.roledefs;
+    # parallel 模式会 fork 子进程, 所以只能在主线程里调用
+    clear_probe_cache()  # 探测结果只在一次任务中有效
+    task_func = profiled_task(task_func)  # 没有开启 profiling 时不做任何记录
+    if role_names:
+        task_func = roles(*role_names)(task_func)
+    if run_parallel:
+        task_func = parallel(task_func)
+    return execute(task_func, *(args or list()), **(kwargs or dict()))
+
+
+def run_per_role(*args, inputs=None, prompts=None, run_parallel: bool = True, scheduler: RollingScheduler = None):
     def task_runner_decorator(inputs_, prompts_):
         def task_runner_wrapper(task_func):
+            profiled_task_func = profiled_task(task_func)  # 没有开启 profiling 时不做任何记录
+
             @wraps(task_func)
             def task_runner(*args_, **kwargs_):
+                clear_probe_cache()  # 探测结果只在一次任务中有效
                 if isinstance(prompts_, dict):
                     env.prompts.update(prompts)
 
@@ -171,13 +362,21 @@ def run_per_role(*args, inputs=None, prompts=None, run_parallel: bool = True):
                     if role_name in [role.name, "all"]:
                         roles_.append(role.name)
 
-                roled_task_func = roles(*roles_)(task_func)
+                if scheduler:
+                    # 按 batch 滚动发布: 每个 batch 只在其中的服务器上执行, env.roles 保持不变
+                    hosts_ = sorted({host.full_address for role in environment.roles if role.name in roles_ for host in role.hosts})
 
-                if run_parallel:
-                    paralleled_task_func = parallel(roled_task_func)
-                    return execute(paralleled_task_func, *args_, **kwargs_)
-                else:
-                    return execute(roled_task_func, *args_, **kwargs_)
+                    def run_batch(batch):
+                        batch_hosts = set(batch)
+                        excluded_hosts = [host for host in hosts_ if host not in batch_hosts]
+                        batch_task_func = roles(*roles_)(scheduler.catch_failures(profiled_task_func))
+                        if run_parallel:
+                            batch_task_func = parallel(pool_size=scheduler.get_window(len(batch)))(batch_task_func)
+                        return execute(batch_task_func, *args_, exclude_hosts=excluded_hosts, **kwargs_)
+
+                    return scheduler.run(hosts_, run_batch)
+
+                return execute_on_roles(task_func, roles_, args_, kwargs_, run_parallel=run_parallel)
 
             return task_runner
 
@@ -206,32 +405,31 @@ def get_current_environment(self) -> "Environment":
 env.__class__.environment = property(get_current_environment)
 
 
+unknown_hosts = dict()  # 不在任何 environment 中的服务器, 按 host_string 缓存
+
+
 def get_current_host(self) -> "Host":
     if not env.environment:
-        return Host(env.host_string, env.host_string)
+        host = unknown_hosts.get(env.host_string, None)
+        if host is None:
+            host = unknown_hosts[env.host_string] = Host(env.host_string, env.host_string)
+        return host
 
-    for host in env.environment.hosts:
-        if host.full_address == env.host_string:
-            return host
+    return env.environment.get_host(env.host_string)
 
 
 env.__class__.host = property(get_current_host)
 
 
 def get_current_roles(self) -> Sequence["Role"]:
-    roles_ = list()
-    for role_name in env.effective_roles:
-        for role in env.environment.roles:
-            if role_name == role.name:
-                roles_.append(role)
-    return roles_
+    return env.environment.get_roles(env.effective_roles)
 
 
 env.__class__.roles = property(get_current_roles)
 
 
 def check_current_roles_are_all(self) -> bool:
-    roles_ = env.roles
+    roles_ = set(env.roles)
     for role in env.environment.roles:
         if role not in roles_:
             return False
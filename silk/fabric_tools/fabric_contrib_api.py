@@ -2,6 +2,23 @@ from fabric.contrib.project import rsync_project, upload_project
 from fabric.contrib.console import confirm
 from fabric.contrib.files import exists, is_link, first, upload_template, sed, uncomment, comment, contains, append
 
+from .probe_cache import cached_probe, invalidates_probes
+from .batch_probes import exists_many, contains_many, stat_many
+
+# 只读的探测在同一次任务中按服务器缓存, 修改文件的操作会让这台服务器的缓存失效
+exists = cached_probe(exists)
+is_link = cached_probe(is_link)
+first = cached_probe(first)
+contains = cached_probe(contains)
+
+rsync_project = invalidates_probes(rsync_project)
+upload_project = invalidates_probes(upload_project)
+upload_template = invalidates_probes(upload_template)
+sed = invalidates_probes(sed)
+uncomment = invalidates_probes(uncomment)
+comment = invalidates_probes(comment)
+append = invalidates_probes(append)
+
 __all__ = ["rsync_project",
            "upload_project",
            "confirm",
@@ -13,4 +30,7 @@ __all__ = ["rsync_project",
            "uncomment",
            "comment",
            "contains",
-           "append"]
+           "append",
+           "exists_many",
+           "contains_many",
+           "stat_many"]
@@ -0,0 +1,252 @@
+import re
+import math
+import fnmatch
+from typing import Set
+from typing import List
+from typing import Tuple
+from functools import lru_cache
+
+
+# 选择表达式:
+#   all                 所有服务器
+#   web-01              服务器名称
+#   web-0[1-4]*         glob
+#   re:'^web-\d+$'      正则, 含有运算符的部分要用引号括起来
+#   role:web            role 中的服务器, role 名称也可以是 glob
+#   a & b, a | b, !a    交集, 并集, 补集, 可以用括号分组
+#   expr/25%, expr/10   对整个结果按名称排序后取前 25% 或前 10 台
+# fab 会用逗号分割任务参数, 所以表达式里不能出现逗号
+class HostSelector:
+    def select(self, environment: "Environment") -> Set["Host"]:
+        raise NotImplementedError
+
+
+class AllSelector(HostSelector):
+    def select(self, environment: "Environment") -> Set["Host"]:
+        return set(environment.hosts)
+
+    def __repr__(self):
+        return "all"
+
+
+class NameSelector(HostSelector):
+    def __init__(self, name: str):
+        self.name = name
+
+    def select(self, environment: "Environment") -> Set["Host"]:
+        return set(environment.get_hosts(self.name))
+
+    def __repr__(self):
+        return self.name
+
+
+class PatternSelector(HostSelector):
+    def __init__(self, pattern: str, is_regex: bool = False):
+        self.pattern = pattern
+        self.is_regex = is_regex
+        try:
+            self.regex = re.compile(pattern if is_regex else fnmatch.translate(pattern))
+        except re.error as e:
+            raise ValueError("无效的正则表达式 {0}: {1}".format(pattern, e))
+
+    def select(self, environment: "Environment") -> Set["Host"]:
+        # 同名的服务器只需要匹配一次
+        hosts = set()
+        for name in environment.get_host_names():
+            if self.regex.search(name) if self.is_regex else self.regex.match(name):
+                hosts.update(environment.get_hosts(name))
+        return hosts
+
+    def __repr__(self):
+        return "re:{0}".format(self.pattern) if self.is_regex else self.pattern
+
+
+class RoleSelector(HostSelector):
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+
+    def select(self, environment: "Environment") -> Set["Host"]:
+        if not is_glob(self.pattern):
+            role = environment.get_role(self.pattern)
+            return set(role.hosts) if role else set()
+        hosts = set()
+        for role in environment.roles:
+            if fnmatch.fnmatchcase(role.name, self.pattern):
+                hosts.update(role.hosts)
+        return hosts
+
+    def __repr__(self):
+        return "role:{0}".format(self.pattern)
+
+
+class NotSelector(HostSelector):
+    def __init__(self, selector: HostSelector):
+        self.selector = selector
+
+    def select(self, environment: "Environment") -> Set["Host"]:
+        return set(environment.hosts) - self.selector.select(environment)
+
+    def __repr__(self):
+        return "!{0!r}".format(self.selector)
+
+
+class AndSelector(HostSelector):
+    def __init__(self, selectors: List[HostSelector]):
+        self.selectors = selectors
+
+    def select(self, environment: "Environment") -> Set["Host"]:
+        hosts = self.selectors[0].select(environment)
+        for selector in self.selectors[1:]:
+            if not hosts:
+                break
+            hosts &= selector.select(environment)
+        return hosts
+
+    def __repr__(self):
+        return "({0})".format(" & ".join(repr(selector) for selector in self.selectors))
+
+
+class OrSelector(HostSelector):
+    def __init__(self, selectors: List[HostSelector]):
+        self.selectors = selectors
+
+    def select(self, environment: "Environment") -> Set["Host"]:
+        hosts = set()
+        for selector in self.selectors:
+            hosts |= selector.select(environment)
+        return hosts
+
+    def __repr__(self):
+        return "({0})".format(" | ".join(repr(selector) for selector in self.selectors))
+
+
+class SliceSelector(HostSelector):
+    def __init__(self, selector: HostSelector, count: int, is_percent: bool = False):
+        self.selector = selector
+        self.count = count
+        self.is_percent = is_percent
+
+    def select(self, environment: "Environment") -> Set["Host"]:
+        # 先排序再切片, 保证同样的表达式每次选中同样的服务器
+        hosts = sorted(self.selector.select(environment), key=lambda host: (host.name, host.full_address))
+        count = int(math.ceil(len(hosts) * self.count / 100)) if self.is_percent else self.count
+        return set(hosts[:count])
+
+    def __repr__(self):
+        return "{0!r}/{1}{2}".format(self.selector, self.count, "%" if self.is_percent else "")
+
+
+operators = "&|!()/"
+
+
+def is_glob(pattern: str) -> bool:
+    return any(char in pattern for char in "*?[")
+
+
+def tokenize(expression: str) -> List[Tuple[str, str]]:
+    tokens, index = list(), 0
+    while index < len(expression):
+        char = expression[index]
+        if char.isspace():
+            index += 1
+        elif char in operators:
+            tokens.append(("op", char))
+            index += 1
+        else:
+            atom = ""
+            while index < len(expression) and not expression[index].isspace() and expression[index] not in operators:
+                if expression[index] in "'\"":
+                    end = expression.find(expression[index], index + 1)
+                    if end < 0:
+                        raise ValueError("表达式 {0} 中的引号没有闭合".format(expression))
+                    atom += expression[index + 1:end]
+                    index = end + 1
+                else:
+                    atom += expression[index]
+                    index += 1
+            tokens.append(("atom", atom))
+    return tokens
+
+
+class SelectorParser:
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.position = 0
+
+    def peek(self) -> Tuple[str, str]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self) -> Tuple[str, str]:
+        token = self.peek()
+        if token[0] is None:
+            raise ValueError("表达式 {0} 不完整".format(self.expression))
+        self.position += 1
+        return token
+
+    def parse(self) -> HostSelector:
+        if not self.tokens:
+            raise ValueError("表达式不能为空")
+        selector = self.parse_or()
+        if self.peek() == ("op", "/"):
+            self.take()
+            kind, value = self.take()
+            match = re.match(r"^(\d+)(%?)$", value) if kind == "atom" else None
+            if not match or (match.group(2) and not 0 < int(match.group(1)) <= 100):
+                raise ValueError("表达式 {0} 中的切片 {1} 无效, 应该是 N 或者 N%".format(self.expression, value))
+            selector = SliceSelector(selector, int(match.group(1)), bool(match.group(2)))
+        if self.peek()[0] is not None:
+            raise ValueError("表达式 {0} 在 {1} 处有多余的内容".format(self.expression, self.peek()[1]))
+        return selector
+
+    def parse_or(self) -> HostSelector:
+        selectors = [self.parse_and()]
+        while self.peek() == ("op", "|"):
+            self.take()
+            selectors.append(self.parse_and())
+        return selectors[0] if len(selectors) == 1 else OrSelector(selectors)
+
+    def parse_and(self) -> HostSelector:
+        selectors = [self.parse_not()]
+        while self.peek() == ("op", "&"):
+            self.take()
+            selectors.append(self.parse_not())
+        return selectors[0] if len(selectors) == 1 else AndSelector(selectors)
+
+    def parse_not(self) -> HostSelector:
+        if self.peek() == ("op", "!"):
+            self.take()
+            return NotSelector(self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self) -> HostSelector:
+        kind, value = self.take()
+        if (kind, value) == ("op", "("):
+            selector = self.parse_or()
+            if self.take() != ("op", ")"):
+                raise ValueError("表达式 {0} 中的括号没有闭合".format(self.expression))
+            return selector
+        if kind != "atom":
+            raise ValueError("表达式 {0} 中的 {1} 位置不正确".format(self.expression, value))
+        if value == "all":
+            return AllSelector()
+        if value.startswith("role:"):
+            return RoleSelector(value[len("role:"):])
+        if value.startswith("re:"):
+            return PatternSelector(value[len("re:"):], is_regex=True)
+        if is_glob(value):
+            return PatternSelector(value)
+        return NameSelector(value)
+
+
+@lru_cache(maxsize=256)
+def compile_selector(expression: str) -> HostSelector:
+    return SelectorParser(expression).parse()
+
+
+def select_hosts(environment: "Environment", expression: str) -> List["Host"]:
+    hosts = compile_selector(expression).select(environment)
+    return sorted(hosts, key=lambda host: (host.name, host.full_address))
+
+
+__all__ = ["HostSelector", "compile_selector", "select_hosts"]
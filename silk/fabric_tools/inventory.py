@@ -0,0 +1,176 @@
+import os
+import json
+import shlex
+import marshal
+import hashlib
+from typing import Any
+from typing import Dict
+from typing import List
+
+from silk.fabric_tools.fabric_context import Environment
+from silk.file_tools import generate_random_str
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+# inventory 文件解析之后的结构, 三种格式都会转换成这个结构:
+# {"prod": {"options": {...}, "hosts": [{"name": "web-01", "address": "10.0.0.1", "user": "deploy", "roles": ["web"]}]}}
+#
+# yaml/json 文件:
+#   environments:
+#     prod:
+#       options: {ssh_max_sessions: 4}
+#       hosts:
+#         - {name: web-01, address: 10.0.0.1, roles: [web]}
+#
+# ini 文件, [环境] 中是选项, [环境:role] 中每行是一台服务器:
+#   [prod]
+#   ssh_max_sessions = 4
+#   [prod:web]
+#   web-01 address=10.0.0.1 user=deploy
+class InventoryLoader:
+    cache_version = 1
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".cache", "silk", "inventory")
+
+    def get_cache_path(self, file_path: str) -> str:
+        cache_name = hashlib.sha1(os.path.abspath(file_path).encode()).hexdigest()
+        return os.path.join(self.cache_dir, "{0}.marshal".format(cache_name))
+
+    @staticmethod
+    def get_file_hash(file_path: str) -> str:
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    @staticmethod
+    def parse_yaml(content: str) -> Dict[str, Any]:
+        if yaml is None:
+            raise ImportError("读取 yaml 格式的 inventory 需要先安装 pyyaml")
+        return yaml.safe_load(content) or dict()
+
+    @staticmethod
+    def parse_json(content: str) -> Dict[str, Any]:
+        return json.loads(content)
+
+    @staticmethod
+    def parse_ini_value(value: str) -> Any:
+        # ini 中的数字和布尔值按 json 解析, 其他的保持字符串
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+
+    @staticmethod
+    def parse_ini(content: str) -> Dict[str, Any]:
+        environments, section = dict(), None
+        for line_number, line in enumerate(content.splitlines(), 1):
+            line = line.strip()
+            if not line or line.startswith(("#", ";")):
+                continue
+            if line.startswith("[") and line.endswith("]"):
+                section = line[1:-1].strip()
+                environment_name = section.split(":", 1)[0]
+                environments.setdefault(environment_name, {"options": dict(), "hosts": list()})
+            elif section is None:
+                raise ValueError("inventory 第 {0} 行不在任何 section 中: {1}".format(line_number, line))
+            elif ":" not in section:
+                key, _, value = line.partition("=")
+                environments[section]["options"][key.strip()] = InventoryLoader.parse_ini_value(value.strip())
+            else:
+                environment_name, role_name = section.split(":", 1)
+                name, *fields = shlex.split(line)
+                host = {"name": name, "roles": [role_name]}
+                for field in fields:
+                    key, _, value = field.partition("=")
+                    host[key] = value
+                if "address" not in host:
+                    raise ValueError("inventory 第 {0} 行缺少 address: {1}".format(line_number, line))
+                environments[environment_name]["hosts"].append(host)
+        return {"environments": environments}
+
+    def parse(self, file_path: str) -> Dict[str, Dict[str, Any]]:
+        extension = os.path.splitext(file_path)[1].lower()
+        parsers = {".yaml": self.parse_yaml, ".yml": self.parse_yaml, ".json": self.parse_json, ".ini": self.parse_ini}
+        if extension not in parsers:
+            raise ValueError("不支持的 inventory 格式 {0}".format(file_path))
+        with open(file_path, "r") as f:
+            data = parsers[extension](f.read())
+        return self.normalize(data.get("environments", dict()))
+
+    @staticmethod
+    def normalize(environments: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        # 同一台服务器可能出现在多个 role 中, 合并成一条记录, 只保留 marshal 支持的基础类型
+        normalized = dict()
+        for environment_name, environment in environments.items():
+            hosts = dict()
+            for host in environment.get("hosts", list()):
+                key = (host["name"], host.get("user", None) or "deploy", str(host["address"]))
+                record = hosts.setdefault(key, {"name": key[0], "address": key[2], "user": key[1], "roles": list()})
+                for role_name in host.get("roles", list()):
+                    if role_name not in record["roles"]:
+                        record["roles"].append(role_name)
+            normalized[environment_name] = {"options": dict(environment.get("options", None) or dict()),
+                                            "hosts": list(hosts.values())}
+        return normalized
+
+    def __load_cache(self, file_path: str, stat: os.stat_result) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.get_cache_path(file_path), "rb") as f:
+                cache = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(cache, dict) or cache.get("version") != self.cache_version:
+            return None
+        if cache["mtime"] == stat.st_mtime_ns and cache["size"] == stat.st_size:
+            return cache["environments"]
+        # mtime 变了但内容没变 (比如重新 checkout), 仍然可以用缓存
+        if cache["size"] == stat.st_size and cache["sha256"] == self.get_file_hash(file_path):
+            self.__dump_cache(file_path, stat, cache["sha256"], cache["environments"])
+            return cache["environments"]
+        return None
+
+    def __dump_cache(self, file_path: str, stat: os.stat_result, sha256: str, environments: Dict[str, Dict[str, Any]]):
+        cache_path = self.get_cache_path(file_path)
+        tmp_path = "{0}.{1}.tmp".format(cache_path, generate_random_str(8))
+        cache = {"version": self.cache_version, "mtime": stat.st_mtime_ns, "size": stat.st_size,
+                 "sha256": sha256, "environments": environments}
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                marshal.dump(cache, f)
+            os.replace(tmp_path, cache_path)
+        except (OSError, ValueError):
+            # 缓存写不进去不影响使用, 下次重新解析即可
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def load_data(self, file_path: str) -> Dict[str, Dict[str, Any]]:
+        stat = os.stat(file_path)
+        environments = self.__load_cache(file_path, stat)
+        if environments is None:
+            environments = self.parse(file_path)
+            self.__dump_cache(file_path, stat, self.get_file_hash(file_path), environments)
+        return environments
+
+    def load(self, file_path: str) -> List[Environment]:
+        environments = list()
+        for environment_name, environment in self.load_data(file_path).items():
+            environments.append(Environment.from_records(environment_name, environment["hosts"], **environment["options"]))
+        return environments
+
+    def __repr__(self):
+        return "InventoryLoader(\"{0}\")".format(self.cache_dir)
+
+
+def load_inventory(file_path: str, cache_dir: str = None) -> List[Environment]:
+    return InventoryLoader(cache_dir).load(file_path)
+
+
+__all__ = ["InventoryLoader", "load_inventory"]
@@ -0,0 +1,116 @@
+import os
+import sys
+import threading
+from typing import IO
+from typing import Dict
+from typing import List
+from collections import deque
+
+
+class OutputSink:
+    # AsyncExecutor 每读到一行输出就调用一次 write, 某台服务器执行结束后调用 finish
+    def write(self, host, stream: str, line: str):
+        raise NotImplementedError
+
+    def finish(self, result):
+        pass
+
+    def close(self):
+        pass
+
+
+class ConsoleSink(OutputSink):
+    def __init__(self, output: IO = None, prefix_format: str = "[{host}] ", show_stderr: bool = True):
+        self.output = output
+        self.prefix_format = prefix_format
+        self.show_stderr = show_stderr
+        self.__lock = threading.Lock()
+
+    def write(self, host, stream: str, line: str):
+        if stream == "stderr" and not self.show_stderr:
+            return
+        output = self.output or (sys.stderr if stream == "stderr" else sys.stdout)
+        with self.__lock:
+            output.write("{0}{1}\n".format(self.prefix_format.format(host=host.name, stream=stream), line))
+            output.flush()
+
+
+class FileSink(OutputSink):
+    # 每台服务器一个日志文件, 服务器执行结束后立即关闭, 同时打开的文件数不超过并发数
+    # 服务器名称可能重复, 文件名中带上 full_address, 打开的文件也按 full_address 区分
+    def __init__(self, dir_path: str, file_format: str = "{host}-{address}.log"):
+        self.dir_path = dir_path
+        self.file_format = file_format
+        self.__files = dict()
+        os.makedirs(dir_path, exist_ok=True)
+
+    def get_file_path(self, host) -> str:
+        return os.path.join(self.dir_path, self.file_format.format(host=host.name, address=host.full_address))
+
+    def write(self, host, stream: str, line: str):
+        f = self.__files.get(host.full_address, None)
+        if f is None:
+            f = self.__files[host.full_address] = open(self.get_file_path(host), "a")
+        f.write("{0}\n".format(line) if stream == "stdout" else "[stderr] {0}\n".format(line))
+
+    def finish(self, result):
+        f = self.__files.pop(result.host.full_address, None)
+        if f is not None:
+            f.close()
+
+    def close(self):
+        for f in self.__files.values():
+            f.close()
+        self.__files.clear()
+
+
+class RingBufferSink(OutputSink):
+    # 每台服务器只保留最后 max_lines 行, 按 full_address 区分同名的服务器
+    def __init__(self, max_lines: int = 100):
+        if max_lines < 1:
+            raise ValueError("max_lines 必须大于 0, 实际收到 {0}".format(max_lines))
+        self.max_lines = max_lines
+        self.buffers = dict()
+
+    def write(self, host, stream: str, line: str):
+        buffer = self.buffers.get(host.full_address, None)
+        if buffer is None:
+            buffer = self.buffers[host.full_address] = deque(maxlen=self.max_lines)
+        buffer.append((stream, line))
+
+    def get_lines(self, host_string: str, stream: str = None) -> List[str]:
+        return [line for stream_, line in self.buffers.get(host_string, list()) if stream in (None, stream_)]
+
+    def get_all_lines(self) -> Dict[str, List[str]]:
+        return {host_string: self.get_lines(host_string) for host_string in self.buffers}
+
+
+class BoundedBuffer:
+    # 只保留最后 max_size 个字符的输出, max_size 为 None 时不限制
+    def __init__(self, max_size: int = None):
+        self.max_size = max_size
+        self.size = 0
+        self.truncated = False
+        self.__chunks = deque()
+
+    def append(self, text: str):
+        self.__chunks.append(text)
+        self.size += len(text)
+        if self.max_size is None:
+            return
+        while self.size > self.max_size and self.__chunks:
+            overflow = self.size - self.max_size
+            first = self.__chunks[0]
+            if len(first) <= overflow:
+                self.__chunks.popleft()
+                self.size -= len(first)
+            else:
+                self.__chunks[0] = first[overflow:]
+                self.size -= overflow
+            self.truncated = True
+
+    def getvalue(self) -> str:
+        return "".join(self.__chunks)
+
+
+__all__ = ["OutputSink", "ConsoleSink", "FileSink", "RingBufferSink"]
@@ -0,0 +1,64 @@
+from typing import Any
+from typing import Callable
+from functools import wraps
+
+from fabric.api import env
+
+# {host_string: {(cwd, 函数名, args, kwargs): 结果}}
+# 只缓存 exists/contains 这类只读的探测, 任何可能修改服务器的操作都会清空这台服务器的缓存
+probe_results = dict()
+
+
+def is_probe_cache_enabled() -> bool:
+    return env.get("silk_probe_cache", True)
+
+
+def clear_probe_cache(host_string: str = None):
+    if host_string is None:
+        probe_results.clear()
+    else:
+        probe_results.pop(host_string, None)
+
+
+def get_probe_key(probe_name: str, args: tuple, kwargs: dict) -> tuple:
+    return env.get("cwd", ""), probe_name, args, tuple(sorted(kwargs.items()))
+
+
+def seed_probe(probe_name: str, args: tuple, kwargs: dict, result: Any):
+    # 批量探测的结果直接写进缓存, 之后相同参数的单个探测不再访问服务器
+    if is_probe_cache_enabled():
+        probe_results.setdefault(env.host_string, dict())[get_probe_key(probe_name, args, kwargs)] = result
+
+
+def cached_probe(probe_func: Callable) -> Callable:
+    @wraps(probe_func)
+    def wrapper(*args, **kwargs):
+        if not is_probe_cache_enabled():
+            return probe_func(*args, **kwargs)
+        key = get_probe_key(probe_func.__name__, args, kwargs)
+        host_cache = probe_results.setdefault(env.host_string, dict())
+        try:
+            return host_cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # 参数不能作为 key 时不缓存
+            return probe_func(*args, **kwargs)
+        result = host_cache[key] = probe_func(*args, **kwargs)
+        return result
+
+    return wrapper
+
+
+def invalidates_probes(mutating_func: Callable) -> Callable:
+    @wraps(mutating_func)
+    def wrapper(*args, **kwargs):
+        try:
+            return mutating_func(*args, **kwargs)
+        finally:
+            clear_probe_cache(env.host_string)
+
+    return wrapper
+
+
+__all__ = ["clear_probe_cache", "seed_probe", "cached_probe", "invalidates_probes"]
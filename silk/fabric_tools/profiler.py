@@ -0,0 +1,195 @@
+import os
+import json
+import math
+import time
+import tempfile
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Callable
+from typing import Sequence
+from functools import wraps
+from contextlib import contextmanager
+
+from fabric.api import env
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    # nearest-rank
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(int(math.ceil(len(values) * percent / 100)) - 1, 0)]
+
+
+class Profiler:
+    # 事件以 json lines 的形式追加写入文件, parallel 模式下 fork 出来的子进程也写同一个文件,
+    # 每个事件只调用一次 write, O_APPEND 保证不同进程写入的行不会交错
+    def __init__(self, event_file: str = None):
+        if event_file is None:
+            fd, event_file = tempfile.mkstemp(prefix="silk-profile-", suffix=".jsonl")
+            os.close(fd)
+        self.event_file = event_file
+
+    def record(self, kind: str, name: str, duration: float, host: str = None, exit_code: Any = None,
+               size: int = None, **extra):
+        event = {"time": time.time() - duration, "pid": os.getpid(), "kind": kind, "name": name,
+                 "host": host if host is not None else env.host_string, "duration": duration,
+                 "exit_code": exit_code, "bytes": size}
+        event.update(extra)
+        fd = os.open(self.event_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(event, default=str) + "\n").encode())
+        finally:
+            os.close(fd)
+
+    @contextmanager
+    def timed(self, kind: str, name: str, **extra):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(kind, name, time.time() - start, **extra)
+
+    def load_events(self) -> List[Dict[str, Any]]:
+        events = list()
+        if not os.path.exists(self.event_file):
+            return events
+        with open(self.event_file, "r") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue
+        return events
+
+    def summary(self, slowest: int = 5) -> Dict[str, Any]:
+        events = self.load_events()
+        kinds, hosts = dict(), dict()
+        for event in events:
+            kinds.setdefault(event["kind"], list()).append(event)
+            if event["kind"] == "task" and event["host"]:
+                hosts[event["host"]] = hosts.get(event["host"], 0.0) + event["duration"]
+
+        summary = {"events": len(events), "kinds": dict(), "slowest_hosts": list()}
+        for kind, kind_events in sorted(kinds.items()):
+            durations = [event["duration"] for event in kind_events]
+            summary["kinds"][kind] = {
+                "count": len(kind_events),
+                "total": sum(durations),
+                "p50": percentile(durations, 50),
+                "p95": percentile(durations, 95),
+                "max": max(durations),
+                "failed": len([event for event in kind_events if event["exit_code"] not in (None, 0)]),
+                "bytes": sum(event["bytes"] or 0 for event in kind_events),
+            }
+        # 没有 task 事件 (比如只用了 AsyncExecutor) 时按所有事件统计每台服务器的耗时
+        if not hosts:
+            for event in events:
+                if event["host"]:
+                    hosts[event["host"]] = hosts.get(event["host"], 0.0) + event["duration"]
+        summary["slowest_hosts"] = sorted(hosts.items(), key=lambda item: -item[1])[:slowest]
+        return summary
+
+    def format_summary(self, slowest: int = 5) -> str:
+        summary = self.summary(slowest)
+        lines = ["{0:<8} {1:>6} {2:>9} {3:>9} {4:>9} {5:>6} {6:>12}".format(
+            "kind", "count", "p50", "p95", "max", "failed", "bytes")]
+        for kind, stats in summary["kinds"].items():
+            lines.append("{0:<8} {1:>6} {2:>8.3f}s {3:>8.3f}s {4:>8.3f}s {5:>6} {6:>12}".format(
+                kind, stats["count"], stats["p50"], stats["p95"], stats["max"], stats["failed"], stats["bytes"]))
+        if summary["slowest_hosts"]:
+            lines.append("slowest hosts:")
+            lines.extend("  {0}: {1:.3f}s".format(host, duration) for host, duration in summary["slowest_hosts"])
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "Profiler(\"{0}\")".format(self.event_file)
+
+
+active_profiler = None
+
+
+def enable_profiling(event_file: str = None) -> Profiler:
+    # 需要在 execute 之前开启, 这样 fork 出来的子进程才会继承
+    global active_profiler
+    active_profiler = Profiler(event_file)
+    return active_profiler
+
+
+def disable_profiling() -> Profiler:
+    global active_profiler
+    profiler, active_profiler = active_profiler, None
+    return profiler
+
+
+def get_active_profiler() -> Profiler:
+    return active_profiler
+
+
+def get_transferred_size(kind: str, args: tuple, kwargs: dict, result: Any) -> int:
+    # put 统计本地文件大小, get 统计下载到本地的文件大小
+    if kind == "put":
+        local_path = kwargs.get("local_path", args[0] if args else None)
+        if isinstance(local_path, str) and os.path.isfile(local_path):
+            return os.path.getsize(local_path)
+    elif kind == "get":
+        try:
+            return sum(os.path.getsize(path) for path in result if os.path.isfile(path))
+        except TypeError:
+            pass
+    return None
+
+
+def get_exit_code(result: Any) -> Any:
+    if hasattr(result, "return_code"):
+        return result.return_code
+    if getattr(result, "failed", None):
+        return 1
+    return 0
+
+
+def profiled(kind: str) -> Callable:
+    def profiled_wrapper(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = active_profiler
+            if profiler is None:
+                return func(*args, **kwargs)
+            name = str(kwargs.get("command", args[0] if args else func.__name__))
+            start = time.time()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                profiler.record(kind, name, time.time() - start, exit_code=repr(e))
+                raise
+            profiler.record(kind, name, time.time() - start, exit_code=get_exit_code(result),
+                            size=get_transferred_size(kind, args, kwargs, result))
+            return result
+
+        return wrapper
+
+    return profiled_wrapper
+
+
+def profiled_task(task_func: Callable) -> Callable:
+    # 记录任务在每台服务器上的总耗时, 用在 run_per_host 和 run_per_role 里
+    @wraps(task_func)
+    def wrapper(*args, **kwargs):
+        profiler = active_profiler
+        if profiler is None:
+            return task_func(*args, **kwargs)
+        start = time.time()
+        try:
+            result = task_func(*args, **kwargs)
+        except BaseException as e:
+            profiler.record("task", task_func.__name__, time.time() - start, exit_code=repr(e))
+            raise
+        exit_code = repr(result) if isinstance(result, BaseException) else 0
+        profiler.record("task", task_func.__name__, time.time() - start, exit_code=exit_code)
+        return result
+
+    return wrapper
+
+
+__all__ = ["Profiler", "enable_profiling", "disable_profiling", "get_active_profiler", "profiled", "profiled_task"]
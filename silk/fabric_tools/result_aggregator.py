@@ -0,0 +1,118 @@
+import difflib
+import hashlib
+from typing import Any
+from typing import Dict
+from typing import List
+
+from silk.fabric_tools.output_sinks import OutputSink
+from silk.fabric_tools.output_sinks import BoundedBuffer
+
+
+class ResultGroup:
+    def __init__(self, digest: str, body: str, exit_code: Any):
+        self.digest = digest
+        self.body = body
+        self.exit_code = exit_code
+        self.hosts = list()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"digest": self.digest, "exit_code": self.exit_code, "hosts": list(self.hosts), "body": self.body}
+
+    def __repr__(self):
+        return "ResultGroup(\"{0}\", {1})".format(self.digest[:12], len(self.hosts))
+
+
+class ResultAggregator(OutputSink):
+    # 按输出内容的哈希把服务器分组, 相同的输出只保存一份
+    # 可以作为 AsyncExecutor 的 on_result 回调, 也可以作为 sink 边接收边计算哈希, 两种方式选一种使用
+    def __init__(self, max_body_size: int = None):
+        self.max_body_size = max_body_size
+        self.groups = dict()
+        self.__streams = dict()
+
+    @staticmethod
+    def get_digest(body: str, exit_code: Any) -> str:
+        return hashlib.sha256("{0}\0{1}".format(exit_code, body).encode(errors="replace")).hexdigest()
+
+    def __add_digest(self, host_name: str, digest: str, body: str, exit_code: Any) -> ResultGroup:
+        group = self.groups.get(digest, None)
+        if group is None:
+            group = self.groups[digest] = ResultGroup(digest, body, exit_code)
+        group.hosts.append(host_name)
+        return group
+
+    def add(self, host_name: str, output: Any, exit_code: Any = 0) -> ResultGroup:
+        body = output if isinstance(output, str) else repr(output)
+        if self.max_body_size is not None and len(body) > self.max_body_size:
+            body_to_keep = body[-self.max_body_size:]
+        else:
+            body_to_keep = body
+        return self.__add_digest(host_name, self.get_digest(body, exit_code), body_to_keep, exit_code)
+
+    def add_result(self, result) -> ResultGroup:
+        body = result.stdout if not result.stderr else "{0}[stderr]\n{1}".format(result.stdout, result.stderr)
+        exit_code = result.exit_code if result.error is None else repr(result.error)
+        return self.add(result.host.name, body, exit_code)
+
+    def __call__(self, result):
+        self.add_result(result)
+
+    def add_results(self, results: Dict[str, Any]) -> "ResultAggregator":
+        # 比如 execute 或者 run_per_role 返回的 {host_string: 返回值}
+        for host_name, output in results.items():
+            exit_code = "error" if isinstance(output, BaseException) else 0
+            self.add(host_name, output, exit_code)
+        return self
+
+    def write(self, host, stream: str, line: str):
+        # 同名的服务器可能同时在输出, 按 full_address 区分, 分组里仍然显示名称
+        state = self.__streams.get(host.full_address, None)
+        if state is None:
+            state = self.__streams[host.full_address] = (hashlib.sha256(), BoundedBuffer(self.max_body_size))
+        text = "{0}\n".format(line) if stream == "stdout" else "[stderr] {0}\n".format(line)
+        state[0].update(text.encode(errors="replace"))
+        state[1].append(text)
+
+    def finish(self, result):
+        sha256, buffer = self.__streams.pop(result.host.full_address, (hashlib.sha256(), BoundedBuffer(self.max_body_size)))
+        exit_code = result.exit_code if result.error is None else repr(result.error)
+        sha256.update("\0{0}".format(exit_code).encode())
+        self.__add_digest(result.host.name, sha256.hexdigest(), buffer.getvalue(), exit_code)
+
+    def get_groups(self) -> List[ResultGroup]:
+        return sorted(self.groups.values(), key=lambda group: (-len(group.hosts), group.digest))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"hosts": sum(len(group.hosts) for group in self.groups.values()),
+                "groups": [group.to_dict() for group in self.get_groups()]}
+
+    @staticmethod
+    def format_hosts(hosts: List[str], max_hosts: int) -> str:
+        if len(hosts) <= max_hosts:
+            return ", ".join(hosts)
+        return "{0} 等 {1} 台".format(", ".join(hosts[:max_hosts]), len(hosts))
+
+    def format_report(self, max_hosts: int = 10, max_diff_lines: int = 50) -> str:
+        # 输出最多的一组完整显示, 其他组只显示和它的差异
+        groups = self.get_groups()
+        if not groups:
+            return ""
+        majority = groups[0]
+        lines = ["== {0} 台服务器输出相同 (exit {1}): {2}".format(len(majority.hosts), majority.exit_code,
+                                                                self.format_hosts(majority.hosts, max_hosts)),
+                 majority.body.rstrip("\n")]
+        for group in groups[1:]:
+            lines.append("== {0} 台服务器 (exit {1}): {2}".format(len(group.hosts), group.exit_code,
+                                                              self.format_hosts(group.hosts, max_hosts)))
+            diff = list(difflib.unified_diff(majority.body.splitlines(), group.body.splitlines(),
+                                             majority.hosts[0], group.hosts[0], lineterm=""))
+            lines.extend(diff[:max_diff_lines])
+            if len(diff) > max_diff_lines:
+                lines.append("... 省略了 {0} 行差异".format(len(diff) - max_diff_lines))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "ResultAggregator({0})".format(len(self.groups))
+
+
+__all__ = ["ResultGroup", "ResultAggregator"]
@@ -0,0 +1,74 @@
+import math
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Union
+from typing import Callable
+from typing import Sequence
+from functools import wraps
+
+
+class RollingScheduler:
+    def __init__(self, batch_size: Union[int, str] = 1, window: int = None, max_failure_rate: float = 0.0,
+                 health_check: Callable[[Sequence[str], Dict[str, Any]], bool] = None):
+        self.batch_size = batch_size
+        self.window = window
+        self.max_failure_rate = max_failure_rate
+        self.health_check = health_check
+        self.results = dict()
+        self.get_batch_size(1)  # 提前检查 batch_size 的格式
+
+    def get_batch_size(self, total: int) -> int:
+        # batch_size 可以是固定数量, 也可以是 "25%" 这样的百分比
+        if isinstance(self.batch_size, str) and self.batch_size.endswith("%"):
+            percent = float(self.batch_size[:-1])
+            if not 0 < percent <= 100:
+                raise ValueError("batch_size 百分比必须在 (0, 100] 之间, 实际收到 {0}".format(self.batch_size))
+            return max(int(math.ceil(total * percent / 100)), 1)
+        if not isinstance(self.batch_size, int) or self.batch_size < 1:
+            raise ValueError("batch_size 必须是正整数或者百分比, 实际收到 {0}".format(self.batch_size))
+        return self.batch_size
+
+    def get_window(self, batch_size: int) -> int:
+        return min(self.window or batch_size, batch_size)
+
+    def split_batches(self, hosts: Sequence[str]) -> List[List[str]]:
+        hosts = list(hosts)
+        batch_size = self.get_batch_size(len(hosts))
+        return [hosts[offset:offset + batch_size] for offset in range(0, len(hosts), batch_size)]
+
+    @staticmethod
+    def is_failure(result: Any) -> bool:
+        return isinstance(result, BaseException)
+
+    @staticmethod
+    def catch_failures(task_func: Callable) -> Callable:
+        # 单台服务器失败时不终止整个 batch, 而是把异常当作结果返回, 由调度器统计失败率
+        @wraps(task_func)
+        def wrapper(*args, **kwargs):
+            try:
+                return task_func(*args, **kwargs)
+            except (Exception, SystemExit) as e:
+                return e
+
+        return wrapper
+
+    def run(self, hosts: Sequence[str], run_batch: Callable[[List[str]], Dict[str, Any]]) -> Dict[str, Any]:
+        self.results = dict()
+        finished, failed = 0, 0
+        for batch in self.split_batches(hosts):
+            batch_results = run_batch(batch)
+            self.results.update(batch_results)
+            finished += len(batch)
+            failed += len([result for result in batch_results.values() if self.is_failure(result)])
+            if failed / finished > self.max_failure_rate:
+                raise RuntimeError("失败率 {0}/{1} 超过了阈值 {2}, 停止发布".format(failed, finished, self.max_failure_rate))
+            if self.health_check and not self.health_check(batch, batch_results):
+                raise RuntimeError("服务器 {0} 的健康检查没有通过, 停止发布".format(", ".join(batch)))
+        return self.results
+
+    def __repr__(self):
+        return "RollingScheduler({0})".format(self.batch_size)
+
+
+__all__ = ["RollingScheduler"]
@@ -0,0 +1,213 @@
+import os
+import sys
+import pickle
+import select
+import signal
+from typing import Any
+from typing import Set
+from typing import Dict
+from typing import Tuple
+from typing import List
+from typing import Callable
+from typing import Sequence
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from fabric.state import connections
+
+from silk.fabric_tools import env
+from silk.fabric_tools.fabric_context import Environment
+from silk.fabric_tools.fabric_context import execute_on_roles
+from silk.fabric_tools.probe_cache import clear_probe_cache
+
+
+class TaskNode:
+    def __init__(self, name: str, func: Callable, roles: Sequence[str], depends_on: Sequence[str],
+                 run_parallel: bool = True, args: Sequence = None, kwargs: dict = None):
+        self.name = name
+        self.func = func
+        self.roles = list(roles)
+        self.depends_on = list(depends_on)
+        self.run_parallel = run_parallel
+        self.args = list(args or list())
+        self.kwargs = dict(kwargs or dict())
+
+    def __repr__(self):
+        return "TaskNode(\"{0}\")".format(self.name)
+
+
+class TaskGraph:
+    # 依赖可以是其他任务的名字, 也可以是 "role:web", 表示依赖所有在 web 上执行的任务
+    # 没有依赖关系的任务最多 max_workers 个同时执行
+    # 默认使用 fabric 执行任务: fabric 的 parallel 会 fork 子进程, 在多线程的进程里 fork 不安全, 全局 env 也不是线程安全的,
+    # 所以由单线程的主循环为每个任务 fork 一个子进程, 子进程执行完把结果 pickle 之后通过管道传回来,
+    # 任务的返回值和抛出的异常都需要可以 pickle, 任务里对 env 的修改不会带回主进程;
+    # 传入线程安全的 runner (比如基于 AsyncExecutor 的) 时, 在线程池里调用 runner
+    role_prefix = "role:"
+
+    def __init__(self, environment_name: str, max_workers: int = 4):
+        self.environment_name = environment_name
+        self.max_workers = max_workers
+        self.nodes = dict()
+        self.results = dict()
+        self.failed = set()
+        self.skipped = set()
+
+    def add_task(self, name: str, func: Callable, roles: Sequence[str] = None, depends_on: Sequence[str] = None,
+                 run_parallel: bool = True, args: Sequence = None, kwargs: dict = None) -> TaskNode:
+        if name in self.nodes:
+            raise Exception("已经存在同名的任务 {0}".format(name))
+        node = TaskNode(name, func, roles or list(), depends_on or list(), run_parallel, args, kwargs)
+        self.nodes[name] = node
+        return node
+
+    def get_dependencies(self, node: TaskNode) -> Set[str]:
+        dependencies = set()
+        for dependency in node.depends_on:
+            if dependency.startswith(self.role_prefix):
+                role_name = dependency[len(self.role_prefix):]
+                dependencies.update(name for name, other in self.nodes.items() if role_name in other.roles and other is not node)
+            elif dependency in self.nodes:
+                dependencies.add(dependency)
+            else:
+                raise ValueError("任务 {0} 依赖的 {1} 不存在".format(node.name, dependency))
+        return dependencies
+
+    def get_execution_order(self) -> List[List[str]]:
+        # 按层返回任务, 同一层的任务之间没有依赖, 可以并发执行
+        dependencies = {name: self.get_dependencies(node) for name, node in self.nodes.items()}
+        finished, levels = set(), list()
+        while len(finished) < len(dependencies):
+            level = sorted(name for name, deps in dependencies.items() if name not in finished and deps <= finished)
+            if not level:
+                raise ValueError("任务之间存在循环依赖: {0}".format(", ".join(sorted(set(dependencies) - finished))))
+            levels.append(level)
+            finished.update(level)
+        return levels
+
+    def run_node(self, node: TaskNode) -> Any:
+        # 和 run_per_role 一样清空探测缓存并记录 profiling, 只能在主线程里调用
+        return execute_on_roles(node.func, node.roles, node.args, node.kwargs, run_parallel=node.run_parallel)
+
+    def __get_ready(self, pending: Set[str], dependencies: Dict[str, Set[str]], done: Set[str]) -> List[str]:
+        # 依赖失败或者被跳过的任务也跳过
+        ready = list()
+        for name in sorted(pending):
+            deps = dependencies[name]
+            if deps & (self.failed | self.skipped):
+                pending.discard(name)
+                self.skipped.add(name)
+            elif deps <= done:
+                pending.discard(name)
+                ready.append(name)
+        return ready
+
+    def __fork_node(self, node: TaskNode) -> Tuple[int, int]:
+        read_fd, write_fd = os.pipe()
+        clear_probe_cache()  # 任务会修改服务器上的状态, 主进程里的探测结果也不再有效
+        pid = os.fork()
+        if pid != 0:
+            os.close(write_fd)
+            return read_fd, pid
+
+        # 子进程: 无论发生什么都不能回到主进程的调用栈里
+        try:
+            os.close(read_fd)
+            connections.clear()  # 不能和主进程以及其他任务共用 ssh 连接
+            try:
+                payload = pickle.dumps(("ok", self.run_node(node)))
+            except (Exception, SystemExit) as e:  # fabric 的 abort 会抛出 SystemExit
+                try:
+                    payload = pickle.dumps(("error", e))
+                except Exception:
+                    payload = pickle.dumps(("error", RuntimeError("任务 {0} 执行失败: {1!r}".format(node.name, e))))
+            with os.fdopen(write_fd, "wb") as f:
+                f.write(payload)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(0)
+
+    def __collect_node(self, name: str, pid: int, payload: bytes) -> bool:
+        os.waitpid(pid, 0)
+        try:
+            status, value = pickle.loads(payload)
+        except Exception as e:
+            status, value = "error", RuntimeError("任务 {0} 的子进程没有返回结果: {1!r}".format(name, e))
+        self.results[name] = value
+        if status != "ok":
+            self.failed.add(name)
+        return status == "ok"
+
+    def __run_in_processes(self, dependencies: Dict[str, Set[str]]):
+        pending, running, done = set(self.nodes), dict(), set()  # running: 管道 -> (pid, 任务名, 已经读到的数据)
+        try:
+            while pending or running:
+                ready = self.__get_ready(pending, dependencies, done)
+                free = self.max_workers - len(running)
+                pending.update(ready[free:])
+                for name in ready[:free]:
+                    read_fd, pid = self.__fork_node(self.nodes[name])
+                    running[read_fd] = (pid, name, list())
+                if not running:
+                    break
+                readable, _, _ = select.select(list(running), [], [])
+                for read_fd in readable:
+                    chunk = os.read(read_fd, 65536)
+                    if chunk:
+                        running[read_fd][2].append(chunk)
+                        continue
+                    os.close(read_fd)
+                    pid, name, chunks = running.pop(read_fd)
+                    if self.__collect_node(name, pid, b"".join(chunks)):
+                        done.add(name)
+        finally:
+            # 被 KeyboardInterrupt 等打断时结束还在执行的任务
+            for read_fd, (pid, _, _) in running.items():
+                os.close(read_fd)
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+
+    def __run_in_threads(self, runner: Callable[[TaskNode], Any], dependencies: Dict[str, Set[str]]):
+        pending, running, done = set(self.nodes), dict(), set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name in self.__get_ready(pending, dependencies, done):
+                    running[executor.submit(runner, self.nodes[name])] = name
+                if not running:
+                    continue
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                        done.add(name)
+                    except (Exception, SystemExit) as e:
+                        self.results[name] = e
+                        self.failed.add(name)
+
+    def run(self, runner: Callable[[TaskNode], Any] = None) -> Dict[str, Any]:
+        dependencies = {name: self.get_dependencies(node) for name, node in self.nodes.items()}
+        self.get_execution_order()  # 提前检查循环依赖
+        self.results, self.failed, self.skipped = dict(), set(), set()
+
+        if Environment.get_environment(self.environment_name):
+            Environment.finalize_environment(self.environment_name)
+        env.environment_name = self.environment_name
+
+        if runner is None:
+            self.__run_in_processes(dependencies)
+        else:
+            self.__run_in_threads(runner, dependencies)
+
+        if self.failed:
+            raise RuntimeError("任务 {0} 执行失败, 跳过了 {1}".format(", ".join(sorted(self.failed)),
+                                                                 ", ".join(sorted(self.skipped)) or "无"))
+        return self.results
+
+    def __repr__(self):
+        return "TaskGraph(\"{0}\")".format(self.environment_name)
+
+
+__all__ = ["TaskNode", "TaskGraph"]
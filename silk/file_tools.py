@@ -1,6 +1,9 @@
 import os
+import json
+import fcntl
 import shutil
 from typing import IO
+from typing import Dict
 from typing import Generator
 from random import Random
 from string import digits
@@ -67,9 +70,91 @@ def echo_file(content: str, mode: str, path: str) -> bool:
     return True
 
 
+@contextmanager
+def file_lock(lock_path: str, shared: bool = False) -> Generator[IO, None, None]:
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, "a") as fd:
+        fcntl.flock(fd.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield fd
+        finally:
+            fcntl.flock(fd.fileno(), fcntl.LOCK_UN)
+
+
+# 在 record_dir 下持久化空闲 index 列表, 用 flock 保证多进程之间分配不冲突
+class IndexAllocator:
+    def __init__(self, record_dir: str, max_index: int = 65536):
+        self.record_dir = record_dir
+        self.max_index = max_index
+        self.__state_file = os.path.join(record_dir, "allocator.json")
+        self.__lock_file = os.path.join(record_dir, "allocator.lock")
+
+    def acquire(self, pid: int = None) -> int:
+        pid = pid or os.getpid()
+        with file_lock(self.__lock_file):
+            state = self.__load_state()
+            if not state["free"]:
+                self.__reclaim_dead_owners(state)
+            if state["free"]:
+                index = state["free"].pop()
+            elif state["next"] < self.max_index:
+                index = state["next"]
+                state["next"] += 1
+            else:
+                raise RuntimeError("{0} 下已经没有空闲的 index 了".format(self.record_dir))
+            state["owners"][str(index)] = pid
+            self.__dump_state(state)
+        return index
+
+    def release(self, index: int) -> bool:
+        with file_lock(self.__lock_file):
+            state = self.__load_state()
+            if state["owners"].pop(str(index), None) is None:
+                return False
+            state["free"].append(index)
+            self.__dump_state(state)
+        return True
+
+    def owners(self) -> Dict[int, int]:
+        with file_lock(self.__lock_file, shared=True):
+            state = self.__load_state()
+        return {int(index): pid for index, pid in state["owners"].items()}
+
+    def __load_state(self) -> dict:
+        try:
+            with open(self.__state_file, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"next": 0, "free": [], "owners": {}}
+
+    def __dump_state(self, state: dict):
+        tmp_file = "{0}.{1}".format(self.__state_file, os.getpid())
+        with open(tmp_file, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.__state_file)
+
+    @staticmethod
+    def __is_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def __reclaim_dead_owners(self, state: dict):
+        for index, pid in list(state["owners"].items()):
+            if not self.__is_alive(pid):
+                state["owners"].pop(index)
+                state["free"].append(int(index))
+
+
 __all__ = ["generate_random_str",
            "generate_random_dir",
            "generate_random_file",
            "generate_random_file_path",
            "touch_file",
-           "echo_file"]
+           "echo_file",
+           "file_lock",
+           "IndexAllocator"]
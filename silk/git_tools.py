@@ -1,35 +1,129 @@
 import os
-import random
+import re
+import time
+import hashlib
 import weakref
+import threading
 from copy import deepcopy
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
 from typing import Dict
+from typing import Mapping
+from typing import Tuple
+from typing import Callable
+from typing import Optional
+from typing import Sequence
 
 import subprocess
-from subprocess import check_output
 from subprocess import CalledProcessError
 
 from fabric.api import local
-from silk.file_tools import touch_file
+from silk.file_tools import IndexAllocator
+from silk.file_tools import file_lock
+from silk.file_tools import generate_random_str
 from silk.python_hooks import atexit
 from silk.python_hooks import atexcp
 
 
+class GitRefResolver:
+    # 每个仓库维持一个常驻的 git cat-file --batch-check 进程, 批量解析 ref 只需要一次 fork/exec
+    __chunk_size = 256
+
+    def __init__(self, repo_path: str):
+        self.repo_path = repo_path
+        self.__process = None
+        self.__lock = threading.Lock()
+
+    def __start_process(self) -> subprocess.Popen:
+        if self.__process is None or self.__process.poll() is not None:
+            try:
+                self.__process = subprocess.Popen(["git", "cat-file", "--batch-check"], cwd=self.repo_path,
+                                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            except FileNotFoundError:
+                raise CalledProcessError(128, "git cat-file --batch-check")
+        return self.__process
+
+    def resolve_many(self, refs: Sequence[str]) -> Dict[str, Optional[str]]:
+        result = dict()
+        with self.__lock:
+            # 分批写入, 避免 stdin 和 stdout 的管道同时写满而互相等待
+            for offset in range(0, len(refs), self.__chunk_size):
+                chunk = refs[offset:offset + self.__chunk_size]
+                process = self.__start_process()
+                try:
+                    process.stdin.write("".join("{0}\n".format(ref) for ref in chunk).encode())
+                    process.stdin.flush()
+                except (BrokenPipeError, OSError):
+                    self.__kill_process()
+                    raise CalledProcessError(128, "git cat-file --batch-check")
+                for ref in chunk:
+                    line = process.stdout.readline().decode().rstrip("\n")
+                    if not line:
+                        self.__kill_process()
+                        raise CalledProcessError(128, "git cat-file --batch-check")
+                    object_info = line.split(" ")
+                    result[ref] = None if object_info[-1] in ("missing", "ambiguous") else object_info[0]
+        return result
+
+    def resolve(self, ref: str) -> Optional[str]:
+        return self.resolve_many([ref])[ref]
+
+    def __kill_process(self):
+        if self.__process is not None and self.__process.poll() is None:
+            self.__process.kill()
+            self.__process.wait()
+        self.__process = None
+
+    def close(self):
+        with self.__lock:
+            if self.__process is not None and self.__process.poll() is None:
+                self.__process.stdin.close()
+                try:
+                    self.__process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.__kill_process()
+            self.__process = None
+
+    def __deepcopy__(self, memo):
+        return GitRefResolver(self.repo_path)
+
+    def __del__(self):
+        self.close()
+
+
 class GitProject:
     __names = list()
     __max_index = 65536
+    __commit_pattern = re.compile("^[0-9a-f]{7,40}$")
+    __fetch_head_pattern = re.compile("^([0-9a-f]{40,64})\t[^\t]*\t(branch|tag) '")
+    __max_deepen_times = 3
     instances = dict()
+    max_workers = 4
 
-    def __init__(self, name: str, url: str, path: str, is_submodule: bool = False):
+    def __init__(self, name: str, url: str, path: str, is_submodule: bool = False, mirror_dir: str = None,
+                 use_worktree: bool = False):
         if name in self.__names:
             raise Exception("已经存在同名 {0} 的项目了".format(name))
 
         self.name = name
         self.url = url
         self.__path = path
+        self.mirror_dir = mirror_dir or os.path.join(self.__path, ".mirror")
+        self.use_worktree = use_worktree
+        self.depth = None
+        self.filter_spec = None
+        self.sparse_paths = None
         self.__index_record_dir = os.path.join(self.__path, ".index")
         self.__working_index = 0
+        self.__working_index_selected = False
+        self.__index_allocator = IndexAllocator(self.__index_record_dir, self.__max_index)
+        self.__ref_resolver = None
+        self.__mirror_ref_resolver = None
         self.is_submodule = is_submodule
         self.__submodules = dict()
+        self.clone_timings = dict()
+        self.state_timings = dict()
         self.__names.append(name)
 
         self.__select_working_index()
@@ -38,30 +132,40 @@ class GitProject:
     def add_submodule(self, name: str, url: str, relative_path: str) -> "GitProject":
         if self.__submodules.get(name, None):
             raise Exception("{0} 已经存在同名的 submodule".format(self.name))
-        sub_module = GitProject(name, url, os.path.abspath(os.path.join(self.path, relative_path)), is_submodule=True)
+        sub_module = GitProject(name, url, os.path.abspath(os.path.join(self.path, relative_path)),
+                                is_submodule=True, mirror_dir=self.mirror_dir, use_worktree=self.use_worktree)
         self.__submodules[name] = sub_module
         return sub_module
 
     @property
-    def submodules(self) -> Dict[str, "GitProject"]:
+    def submodules(self) -> Mapping[str, "GitProject"]:
+        return MappingProxyType(self.__submodules)
+
+    def snapshot_submodules(self) -> Dict[str, "GitProject"]:
         return deepcopy(self.__submodules)
 
+    def __deepcopy__(self, memo):
+        snapshot = self.__class__.__new__(self.__class__)
+        memo[id(self)] = snapshot
+        for key, value in self.__dict__.items():
+            setattr(snapshot, key, deepcopy(value, memo))
+        # 副本不占用工作目录, 析构时不能释放原项目的 index, 也不共享 git 进程
+        snapshot.__working_index_selected = False
+        snapshot.__ref_resolver = None
+        snapshot.__mirror_ref_resolver = None
+        return snapshot
+
     def __select_working_index(self):
         if self.is_submodule:
             return
-        for index in range(0, self.__max_index):
-            busy_flag = os.path.join(self.__index_record_dir, str(index))
-            if not os.path.exists(busy_flag):
-                touch_file(busy_flag, create_parents=True)
-                self.__working_index = index
-                return
+        self.__working_index = self.__index_allocator.acquire()
+        self.__working_index_selected = True
 
     def __unselect_working_index(self):
-        if self.is_submodule:
+        if self.is_submodule or not self.__working_index_selected:
             return
-        busy_flag = os.path.join(self.__index_record_dir, str(self.__working_index))
-        if os.path.exists(busy_flag):
-            os.remove(busy_flag)
+        self.__index_allocator.release(self.__working_index)
+        self.__working_index_selected = False
 
     @property
     def path(self):
@@ -69,72 +173,269 @@ class GitProject:
             return self.__path
         return os.path.join(self.__path, str(self.__working_index))
 
+    @property
+    def mirror_path(self) -> str:
+        url_hash = hashlib.sha1(self.url.encode()).hexdigest()
+        return os.path.join(self.mirror_dir, "{0}.git".format(url_hash))
+
+    def __update_mirror(self, commit_ref: str = None):
+        # 同一个 url 的所有工作目录共享一个 bare mirror, 只有 mirror 会访问网络
+        mirror_path = self.mirror_path
+        with file_lock("{0}.lock".format(mirror_path)):
+            if os.path.exists(os.path.join(mirror_path, "HEAD")):
+                if commit_ref and self.__find_ref(self.mirror_ref_resolver, commit_ref) == "branch":
+                    local("cd {0} && git fetch origin +refs/heads/{1}:refs/heads/{1}".format(mirror_path, commit_ref))
+                else:
+                    local("cd {0} && git remote update --prune".format(mirror_path))
+                return
+            local("rm -rf {0} && mkdir -p {1}".format(mirror_path, self.mirror_dir))
+            local("git clone --mirror {0} {1}".format(self.url, mirror_path))
+            # 工作目录通过 alternates 引用 mirror 的对象, mirror 不能清理掉它们
+            local("cd {0} && git config gc.pruneExpire never".format(mirror_path))
+
+    def __clone_from_mirror(self, target_path: str, no_checkout: bool = False):
+        with file_lock("{0}.lock".format(self.mirror_path), shared=True):
+            local("git clone --shared {0} {1} {2}".format("--no-checkout" if no_checkout else "", self.mirror_path, target_path))
+        local("cd {0} && git remote set-url origin {1}".format(target_path, self.url))
+
+    def __add_worktree(self, target_path: str, no_checkout: bool = False):
+        # worktree 直接挂在 mirror 上, 所有工作目录共享同一个对象库和 refs
+        with file_lock("{0}.lock".format(self.mirror_path)):
+            local("git --git-dir={0} worktree prune".format(self.mirror_path))
+            local("git --git-dir={0} worktree add --detach {1} {2} HEAD".format(
+                self.mirror_path, "--no-checkout" if no_checkout else "", target_path))
+
+    def __move_worktree(self, tmp_path: str, target_path: str):
+        local("mv {0}/.git {1}/.git".format(tmp_path, target_path))
+        with file_lock("{0}.lock".format(self.mirror_path)):
+            local("git --git-dir={0} worktree repair {1}".format(self.mirror_path, target_path))
+
+    def __fetch_from_mirror(self, refspec: str = None):
+        refspec = refspec or "'+refs/heads/*:refs/remotes/origin/*' '+refs/tags/*:refs/tags/*'"
+        with file_lock("{0}.lock".format(self.mirror_path), shared=True):
+            local("cd {0} && git fetch {1} {2}".format(self.path, self.mirror_path, refspec))
+
+    @property
+    def is_shallow(self) -> bool:
+        return bool(self.depth or self.filter_spec)
+
+    def __clone_options(self) -> str:
+        options = list()
+        if self.depth:
+            options.append("--depth {0}".format(self.depth))
+        if self.filter_spec:
+            options.append("--filter={0}".format(self.filter_spec))
+        return " ".join(options)
+
+    def __try_git(self, command: str, quiet: bool = False) -> bool:
+        stderr = subprocess.DEVNULL if quiet else None
+        return subprocess.call("cd {0} && {1}".format(self.path, command), shell=True, stderr=stderr) == 0
+
+    def __create_working_copy(self, target_path: str, no_checkout: bool = False):
+        # shallow/partial clone 只需要目标 commit 的内容, 直接从 url 拉取而不经过 mirror
+        if self.is_shallow:
+            local("git clone {0} {1} {2} {3}".format(self.__clone_options(), "--no-checkout" if no_checkout else "", self.url, target_path))
+            return
+        self.__update_mirror()
+        if self.use_worktree:
+            self.__add_worktree(target_path, no_checkout=no_checkout)
+        else:
+            self.__clone_from_mirror(target_path, no_checkout=no_checkout)
+
+    def __set_sparse_paths(self):
+        local("cd {0} && git sparse-checkout set {1}".format(self.path, " ".join(self.sparse_paths)))
+
     def __clone_project(self):
         if not os.path.exists(self.path):
             local("mkdir -p {0}".format(os.path.dirname(self.path)))
-            local("git clone {0} {1}".format(self.url, self.path))
+            self.__create_working_copy(self.path, no_checkout=bool(self.sparse_paths))
+            if self.sparse_paths:
+                self.__set_sparse_paths()
+                local("cd {0} && git checkout -f".format(self.path))
         if not os.path.exists(os.path.join(self.path, ".git")):
-            tmp_dir = "/tmp/git_temp_clone"
-            local("mkdir -p {0}".format(tmp_dir))
-            tmp_path = os.path.join(tmp_dir, str(random.randint(0, 100)))
-            local("git clone {0} {1}".format(self.url, tmp_path))
-            local("mv {0}/.git {1}/.git".format(tmp_path, self.path))
+            tmp_path = os.path.join("/tmp/git_temp_clone", generate_random_str(12))
+            local("mkdir -p {0}".format(os.path.dirname(tmp_path)))
+            self.__create_working_copy(tmp_path, no_checkout=True)
+            if self.use_worktree:
+                self.__move_worktree(tmp_path, self.path)
+            else:
+                local("mv {0}/.git {1}/.git".format(tmp_path, self.path))
             local("cd {0} && git add . && git checkout -f".format(self.path))
             local("rm -rf {0}".format(tmp_path))
+            if self.sparse_paths:
+                self.__set_sparse_paths()
+
+    def __run_for_submodules(self, func: Callable[["GitProject"], Any], max_workers: int = None) -> Dict[str, Tuple[Any, float]]:
+        def timed_func(submodule):
+            start = time.time()
+            result = func(submodule)
+            return result, time.time() - start
 
-    def clone_project(self, clone_submodules: bool = False) -> "GitProject":
+        if not self.__submodules:
+            return dict()
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+            futures = {name: executor.submit(timed_func, submodule) for name, submodule in self.__submodules.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+    def clone_project(self, clone_submodules: bool = False, max_workers: int = None, depth: int = None,
+                      filter_spec: str = None, sparse_paths: Sequence[str] = None) -> "GitProject":
+        if (depth or filter_spec) and self.use_worktree:
+            raise Exception("{0} 是 worktree 模式, 不支持 shallow/partial clone".format(self.name))
+        self.depth = depth or self.depth
+        self.filter_spec = filter_spec or self.filter_spec
+        self.sparse_paths = list(sparse_paths) if sparse_paths else self.sparse_paths
+
+        start = time.time()
         self.__clone_project()
+        self.clone_timings = {self.name: time.time() - start}
         if clone_submodules:
-            for submodule in self.submodules.values():
+            def clone_submodule(submodule):
+                submodule.depth = depth or submodule.depth
+                submodule.filter_spec = filter_spec or submodule.filter_spec
                 submodule.__clone_project()
+
+            results = self.__run_for_submodules(clone_submodule, max_workers)
+            self.clone_timings.update({name: cost for name, (_, cost) in results.items()})
         return self
 
+    @property
+    def ref_resolver(self) -> GitRefResolver:
+        if self.__ref_resolver is None:
+            self.__ref_resolver = GitRefResolver(self.path)
+        return self.__ref_resolver
+
+    @property
+    def mirror_ref_resolver(self) -> GitRefResolver:
+        if self.__mirror_ref_resolver is None:
+            self.__mirror_ref_resolver = GitRefResolver(self.mirror_path)
+        return self.__mirror_ref_resolver
+
+    def __find_ref(self, resolver: GitRefResolver, commit_ref: str, branch_prefix: str = "refs/heads") -> Optional[str]:
+        branch_ref = "{0}/{1}".format(branch_prefix, commit_ref)
+        tag_ref = "refs/tags/{0}".format(commit_ref)
+        commit = "{0}^{{commit}}".format(commit_ref)
+        refs = [branch_ref, tag_ref]
+        if self.__commit_pattern.match(commit_ref):
+            refs.append(commit)
+        try:
+            resolved_refs = resolver.resolve_many(refs)
+        except CalledProcessError:
+            return None
+        if resolved_refs[branch_ref]:
+            return "branch"
+        if resolved_refs[tag_ref]:
+            return "tag"
+        if resolved_refs.get(commit):
+            return "commit"
+        return None
+
+    def resolve_refs(self, commit_refs: Sequence[str]) -> Dict[str, Optional[str]]:
+        return self.ref_resolver.resolve_many(list(commit_refs))
+
     def get_commit_hash(self, commit_ref: str = None, length: int = 0) -> str:
         if commit_ref:
             self.fetch_commit_ref(commit_ref)
-        result = check_output("cd {0} && git rev-parse HEAD".format(self.path, commit_ref), shell=True, stderr=subprocess.DEVNULL)
-        result = result.decode().strip("\n")
+        result = self.ref_resolver.resolve("HEAD")
+        if result is None:
+            raise CalledProcessError(128, "git rev-parse HEAD")
         return result[:length] if length else result
 
     def check_is_branch(self, commit_ref: str) -> bool:
         try:
-            check_output("cd {0} && git show-ref --verify refs/heads/{1}".format(self.path, commit_ref), shell=True, stderr=subprocess.DEVNULL)
+            return self.ref_resolver.resolve("refs/heads/{0}".format(commit_ref)) is not None
         except CalledProcessError:
             return False
-        else:
-            return True
 
     def check_is_tag(self, commit_ref: str) -> bool:
         try:
-            check_output("cd {0} && git show-ref --verify refs/tags/{1}".format(self.path, commit_ref), shell=True, stderr=subprocess.DEVNULL)
+            return self.ref_resolver.resolve("refs/tags/{0}".format(commit_ref)) is not None
         except CalledProcessError:
             return False
-        else:
-            return True
+
+    def __fetch_from_origin(self, commit_ref: str) -> str:
+        # 一次 fetch 由服务器解析 branch/tag/commit, 再根据 FETCH_HEAD 判断拉到的是什么;
+        # commit 可能被服务器拒绝, 这是预期内的失败, 不输出错误信息
+        is_commit = bool(self.__commit_pattern.match(commit_ref))
+        command = "git fetch {0} origin {1}".format(self.__clone_options(), commit_ref)
+        if not self.__try_git(command, quiet=is_commit):
+            if not is_commit:
+                # branch/tag 不存在时加深历史也找不到, 不能因为写错名字就把整个历史拉下来
+                raise CalledProcessError(128, command)
+            # 服务器不允许按 commit 拉取时逐步加深历史直到能找到它
+            self.__deepen_until_resolvable(commit_ref)
+            return "commit"
+
+        with open(os.path.join(self.path, ".git", "FETCH_HEAD"), "r") as f:
+            match = self.__fetch_head_pattern.match(f.readline())
+        if match is None:
+            return "commit"
+        object_hash, ref_kind = match.groups()
+        local_ref = "refs/remotes/origin/{0}" if ref_kind == "branch" else "refs/tags/{0}"
+        local("cd {0} && git update-ref {1} {2}".format(self.path, local_ref.format(commit_ref), object_hash))
+        return ref_kind
+
+    def __deepen_until_resolvable(self, commit_ref: str):
+        refspecs = "'+refs/heads/*:refs/remotes/origin/*' '+refs/tags/*:refs/tags/*'"
+        filter_option = "--filter={0}".format(self.filter_spec) if self.filter_spec else ""
+        shallow_file = os.path.join(self.path, ".git", "shallow")
+        depth = self.depth or 1
+        for _ in range(self.__max_deepen_times):
+            if self.__find_ref(self.ref_resolver, commit_ref) or not os.path.exists(shallow_file):
+                break
+            depth *= 2
+            self.__try_git("git fetch {0} --deepen={1} origin {2}".format(filter_option, depth, refspecs))
+        if not self.__find_ref(self.ref_resolver, commit_ref):
+            unshallow_option = "--unshallow" if os.path.exists(shallow_file) else ""
+            local("cd {0} && git fetch {1} {2} origin {3}".format(self.path, filter_option, unshallow_option, refspecs))
 
     def fetch_commit_ref(self, commit_ref: str):
-        local("cd {0} && git add . && git checkout -f && git checkout master".format(self.path))
-        if self.check_is_branch(commit_ref):
-            if commit_ref == "master":
-                local("cd {0} && git fetch origin && git fetch origin --tags && git pull".format(self.path, commit_ref))
-            else:
-                local("cd {0} && git branch -d {1} && git fetch origin && git fetch origin --tags && git checkout {1}".format(self.path, commit_ref))
-        elif self.check_is_tag(commit_ref):
-            local("cd {0} && git tag -d {1} && git fetch origin && git fetch origin --tags && git checkout {1}".format(self.path, commit_ref))
+        # tag 和 commit 视为不可变, 本地已经有了就不访问网络; branch 每次只拉取它自己
+        if self.use_worktree:
+            if self.__find_ref(self.mirror_ref_resolver, commit_ref) not in ("tag", "commit"):
+                self.__update_mirror(commit_ref)
+            local("cd {0} && git add . && git checkout -f --detach {1}".format(self.path, commit_ref))
+            return self.get_commit_hash()
+
+        ref_kind = self.__find_ref(self.ref_resolver, commit_ref, branch_prefix="refs/remotes/origin")
+        if ref_kind not in ("tag", "commit") and self.is_shallow:
+            ref_kind = self.__fetch_from_origin(commit_ref)
+        elif ref_kind not in ("tag", "commit"):
+            if self.__find_ref(self.mirror_ref_resolver, commit_ref) not in ("tag", "commit"):
+                self.__update_mirror(commit_ref)
+            ref_kind = self.__find_ref(self.mirror_ref_resolver, commit_ref)
+            if ref_kind == "branch":
+                self.__fetch_from_mirror("+refs/heads/{0}:refs/remotes/origin/{0}".format(commit_ref))
+            elif ref_kind == "tag":
+                self.__fetch_from_mirror("+refs/tags/{0}:refs/tags/{0}".format(commit_ref))
+            elif ref_kind is None:
+                self.__fetch_from_mirror()
+
+        if ref_kind == "branch":
+            local("cd {0} && git add . && git checkout -f -B {1} origin/{1}".format(self.path, commit_ref))
         else:
-            local("cd {0} && git fetch origin && git fetch origin --tags && git checkout {1}".format(self.path, commit_ref))
+            local("cd {0} && git add . && git checkout -f {1}".format(self.path, commit_ref))
         return self.get_commit_hash()
 
-    def get_current_state(self) -> Dict[str, str]:
+    def get_current_state(self, max_workers: int = None) -> Dict[str, str]:
+        def get_submodule_hash(submodule):
+            if os.path.exists(os.path.join(submodule.path, ".git")):
+                return submodule.get_commit_hash()
+
+        start = time.time()
         result = dict()
         result[self.name] = self.get_commit_hash()
-        for dep_name, dep_project in self.__submodules.items():
-            if os.path.exists(os.path.join(dep_project.path, ".git")):
-                result[dep_name] = dep_project.get_commit_hash()
+        self.state_timings = {self.name: time.time() - start}
+        for dep_name, (commit_hash, cost) in self.__run_for_submodules(get_submodule_hash, max_workers).items():
+            if commit_hash:
+                result[dep_name] = commit_hash
+                self.state_timings[dep_name] = cost
         return result
 
     def __del__(self):
         self.__unselect_working_index()
+        for resolver in (getattr(self, "_GitProject__ref_resolver", None), getattr(self, "_GitProject__mirror_ref_resolver", None)):
+            if resolver is not None:
+                resolver.close()
 
     @staticmethod
     @atexit.register
@@ -144,6 +445,9 @@ class GitProject:
             instance = instance_weak_ref()
             if instance:
                 instance._GitProject__unselect_working_index()
+                for resolver in (instance._GitProject__ref_resolver, instance._GitProject__mirror_ref_resolver):
+                    if resolver is not None:
+                        resolver.close()
 
 
 __all__ = ["GitProject"]
@@ -0,0 +1,173 @@
+import os
+import shutil
+import subprocess
+import unittest.mock as mock
+
+from silk.fabric_tools.artifact_sync import build_manifest
+from silk.fabric_tools.artifact_sync import diff_manifests
+from silk.fabric_tools.artifact_sync import parse_remote_manifest
+from silk.fabric_tools.artifact_sync import build_remote_manifest_command
+from silk.fabric_tools.artifact_sync import sync_artifact
+from silk.file_tools import generate_random_dir
+
+
+class CommandOutput(str):
+    failed = False
+    stderr = ""
+
+
+def local_run(command, **kwargs):
+    result = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output = CommandOutput(result.stdout.decode())
+    output.failed = result.returncode != 0
+    output.stderr = result.stderr.decode()
+    if output.failed and not kwargs.get("quiet", False):
+        raise Exception(output.stderr)
+    return output
+
+
+def local_put(local_path, remote_path, **kwargs):
+    shutil.copy(local_path, remote_path)
+
+
+def write_file(dir_path, file_path, content):
+    file_path = os.path.join(dir_path, file_path)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w") as f:
+        f.write(content)
+
+
+def read_tree(dir_path):
+    tree = dict()
+    for top, dirs, files in os.walk(dir_path):
+        for file in files:
+            with open(os.path.join(top, file), "r") as f:
+                tree[os.path.relpath(os.path.join(top, file), dir_path)] = f.read()
+    return tree
+
+
+def test_build_manifest_uses_cached_hashes():
+    with generate_random_dir() as dir_path:
+        local_dir, cache_dir = os.path.join(dir_path, "local"), os.path.join(dir_path, "cache")
+        write_file(local_dir, "a.txt", "a")
+        write_file(local_dir, "lib/b.txt", "b")
+        manifest = build_manifest(local_dir, cache_dir)
+        assert set(manifest) == {"a.txt", "lib/b.txt"}
+
+        with mock.patch("silk.fabric_tools.artifact_sync.hash_file") as hash_file:
+            assert build_manifest(local_dir, cache_dir) == manifest
+            assert not hash_file.called
+
+
+def test_diff_manifests():
+    local_manifest = {"a": "1", "b": "2", "moved/c": "3", "d": "4"}
+    remote_manifest = {"a": "1", "b": "0", "c": "3", "old": "9"}
+    uploads, copies, deletes = diff_manifests(local_manifest, remote_manifest)
+    assert uploads == ["b", "d"]
+    assert copies == {"moved/c": "c"}
+    assert deletes == []
+    assert diff_manifests(local_manifest, remote_manifest, delete=True)[2] == ["c", "old"]
+
+
+def test_parse_remote_manifest():
+    with generate_random_dir() as dir_path:
+        write_file(dir_path, "a.txt", "a")
+        write_file(dir_path, "dir with space/b.txt", "b")
+        output = subprocess.check_output(build_remote_manifest_command(dir_path), shell=True).decode()
+        manifest = parse_remote_manifest(output + "garbage line\n")
+        assert manifest == build_manifest(dir_path, os.path.join(dir_path, ".cache"))
+
+
+@mock.patch("silk.fabric_tools.artifact_sync.put", local_put)
+@mock.patch("silk.fabric_tools.artifact_sync.run", local_run)
+def test_sync_artifact():
+    with generate_random_dir() as dir_path:
+        local_dir, remote_dir = os.path.join(dir_path, "local"), os.path.join(dir_path, "remote")
+        cache_dir = os.path.join(dir_path, "cache")
+        write_file(local_dir, "a.txt", "a")
+        write_file(local_dir, "b.txt", "b")
+        write_file(local_dir, "lib/c.txt", "c")
+
+        result = sync_artifact(local_dir, remote_dir, cache_dir=cache_dir)
+        assert result["uploaded"] == ["a.txt", "b.txt", "lib/c.txt"]
+        assert read_tree(remote_dir) == read_tree(local_dir)
+
+        # 交换 a 和 b 的内容, 移动 c, 修改一个文件: 只有修改的文件需要上传
+        write_file(local_dir, "a.txt", "b")
+        write_file(local_dir, "b.txt", "a")
+        os.renames(os.path.join(local_dir, "lib/c.txt"), os.path.join(local_dir, "lib2/c.txt"))
+        write_file(local_dir, "d.txt", "d")
+        result = sync_artifact(local_dir, remote_dir, delete=True, cache_dir=cache_dir)
+        assert result["uploaded"] == ["d.txt"]
+        assert result["copied"] == {"a.txt": "b.txt", "b.txt": "a.txt", "lib2/c.txt": "lib/c.txt"}
+        assert result["deleted"] == ["lib/c.txt"]
+        assert read_tree(remote_dir) == read_tree(local_dir)
+
+        result = sync_artifact(local_dir, remote_dir, cache_dir=cache_dir)
+        assert result["uploaded"] == [] and result["copied"] == {} and result["unchanged"] == 4
+
+
+@mock.patch("silk.fabric_tools.artifact_sync.put", local_put)
+def test_sync_artifact_trusts_cached_remote_manifest():
+    with generate_random_dir() as dir_path:
+        local_dir, remote_dir = os.path.join(dir_path, "local"), os.path.join(dir_path, "remote")
+        cache_dir = os.path.join(dir_path, "cache")
+        write_file(local_dir, "a.txt", "a")
+        commands = list()
+
+        def recording_run(command, **kwargs):
+            commands.append(command)
+            return local_run(command, **kwargs)
+
+        with mock.patch("silk.fabric_tools.artifact_sync.run", recording_run):
+            sync_artifact(local_dir, remote_dir, cache_dir=cache_dir)
+            assert len(commands) == 2
+            write_file(local_dir, "b.txt", "b")
+            result = sync_artifact(local_dir, remote_dir, trust_cache=True, cache_dir=cache_dir)
+            assert len(commands) == 3
+            assert result["uploaded"] == ["b.txt"]
+            assert read_tree(remote_dir) == read_tree(local_dir)
+
+
+def read_links_and_dirs(dir_path):
+    entries = dict()
+    for top, dirs, files in os.walk(dir_path):
+        for name in dirs + files:
+            path = os.path.join(top, name)
+            if os.path.islink(path):
+                entries[os.path.relpath(path, dir_path)] = os.readlink(path)
+            elif os.path.isdir(path) and not os.listdir(path):
+                entries[os.path.relpath(path, dir_path)] = "empty"
+    return entries
+
+
+@mock.patch("silk.fabric_tools.artifact_sync.put", local_put)
+@mock.patch("silk.fabric_tools.artifact_sync.run", local_run)
+def test_sync_artifact_with_symlinks_and_empty_dirs():
+    with generate_random_dir() as dir_path:
+        local_dir, remote_dir = os.path.join(dir_path, "local"), os.path.join(dir_path, "remote")
+        cache_dir = os.path.join(dir_path, "cache")
+        write_file(local_dir, "lib/a.txt", "a")
+        os.symlink("lib/a.txt", os.path.join(local_dir, "current"))
+        os.symlink("lib", os.path.join(local_dir, "lib_link"))
+        os.makedirs(os.path.join(local_dir, "logs"))
+        manifest = build_manifest(local_dir, cache_dir)
+        assert manifest["current"] == "symlink:lib/a.txt" and manifest["lib_link"] == "symlink:lib"
+        assert manifest["logs"] == "directory"
+
+        result = sync_artifact(local_dir, remote_dir, cache_dir=cache_dir)
+        assert result["uploaded"] == ["current", "lib/a.txt", "lib_link", "logs"]
+        assert read_links_and_dirs(remote_dir) == read_links_and_dirs(local_dir)
+        output = subprocess.check_output(build_remote_manifest_command(remote_dir), shell=True).decode()
+        assert parse_remote_manifest(output) == manifest
+
+        os.remove(os.path.join(local_dir, "current"))
+        os.symlink("lib_link/a.txt", os.path.join(local_dir, "current"))
+        os.rmdir(os.path.join(local_dir, "logs"))
+        result = sync_artifact(local_dir, remote_dir, delete=True, cache_dir=cache_dir)
+        assert result["uploaded"] == ["current"] and result["deleted"] == ["logs"]
+        assert read_links_and_dirs(remote_dir) == read_links_and_dirs(local_dir)
+        assert read_tree(remote_dir) == read_tree(local_dir)
+
+        result = sync_artifact(local_dir, remote_dir, delete=True, cache_dir=cache_dir)
+        assert result["uploaded"] == [] and result["deleted"] == []
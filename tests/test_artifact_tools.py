@@ -0,0 +1,132 @@
+import os
+import time
+import unittest.mock as mock
+
+import pytest
+
+from silk.artifact_tools import ArtifactCache
+from silk.file_tools import echo_file
+from silk.file_tools import generate_random_dir
+
+
+def create_build_output(output_dir: str, content: str):
+    os.makedirs(os.path.join(output_dir, "bin"), exist_ok=True)
+    echo_file(content, ">", os.path.join(output_dir, "bin", "app"))
+
+
+def test_make_key_is_stable():
+    key1 = ArtifactCache.make_key({"repo": "aaa", "dep": "bbb"}, "make release")
+    key2 = ArtifactCache.make_key({"dep": "bbb", "repo": "aaa"}, "make release")
+    assert key1 == key2
+    assert key1 != ArtifactCache.make_key({"repo": "aaa", "dep": "ccc"}, "make release")
+    assert key1 != ArtifactCache.make_key({"repo": "aaa", "dep": "bbb"}, "make debug")
+
+
+def test_create_artifact_cache_with_unknown_mode_will_raise():
+    with generate_random_dir() as cache_dir:
+        with pytest.raises(ValueError):
+            ArtifactCache(cache_dir, mode="zip")
+
+
+@pytest.mark.parametrize("mode", ArtifactCache.modes)
+def test_store_and_restore(mode):
+    with generate_random_dir() as cache_dir, generate_random_dir() as work_dir:
+        cache = ArtifactCache(cache_dir, mode=mode)
+        output_dir = os.path.join(work_dir, "output")
+        create_build_output(output_dir, "v1")
+        key = cache.make_key({"repo": "aaa"})
+        assert not cache.restore(key, os.path.join(work_dir, "restored"))
+
+        cache.store(key, output_dir)
+        assert cache.has(key)
+        assert cache.restore(key, os.path.join(work_dir, "restored"))
+        with open(os.path.join(work_dir, "restored", "bin", "app")) as f:
+            assert f.read() == "v1"
+
+
+@pytest.mark.parametrize("mode", ArtifactCache.modes)
+def test_rewrite_output_after_store_will_not_change_cache(mode):
+    with generate_random_dir() as cache_dir, generate_random_dir() as work_dir:
+        cache = ArtifactCache(cache_dir, mode=mode)
+        output_dir = os.path.join(work_dir, "output")
+        create_build_output(output_dir, "v1")
+        key1 = cache.make_key({"repo": "aaa"})
+        cache.store(key1, output_dir)
+        create_build_output(output_dir, "v2")  # 原地重新构建
+        key2 = cache.make_key({"repo": "bbb"})
+        cache.store(key2, output_dir)
+
+        restored_dir = os.path.join(work_dir, "restored")
+        assert cache.restore(key1, restored_dir)
+        with open(os.path.join(restored_dir, "bin", "app")) as f:
+            assert f.read() == "v1"
+        # 恢复到已有的目录时替换文件, 不会写入上一次恢复出来的硬链接
+        assert cache.restore(key2, restored_dir)
+        with open(os.path.join(restored_dir, "bin", "app")) as f:
+            assert f.read() == "v2"
+        assert cache.restore(key1, os.path.join(work_dir, "restored1"))
+        with open(os.path.join(work_dir, "restored1", "bin", "app")) as f:
+            assert f.read() == "v1"
+
+
+@pytest.mark.parametrize("euid", [0, 1000])
+def test_hardlink_mode_stores_read_only_copies(euid):
+    with generate_random_dir() as cache_dir, generate_random_dir() as work_dir, \
+            mock.patch("silk.artifact_tools.os.geteuid", return_value=euid):
+        cache = ArtifactCache(cache_dir, mode="hardlink")
+        output_dir = os.path.join(work_dir, "output")
+        create_build_output(output_dir, "v1")
+        key = cache.make_key({"repo": "aaa"})
+        cache.store(key, output_dir)
+
+        cached_file = os.path.join(cache_dir, key, "tree", "bin", "app")
+        assert os.stat(cached_file).st_ino != os.stat(os.path.join(output_dir, "bin", "app")).st_ino
+        assert os.stat(cached_file).st_mode & 0o222 == 0
+        cache.restore(key, os.path.join(work_dir, "restored"))
+        restored_file = os.path.join(work_dir, "restored", "bin", "app")
+        # root 不受只读权限限制, 恢复时复制, 原地写入不会改坏缓存
+        assert (os.stat(restored_file).st_ino == os.stat(cached_file).st_ino) == (euid != 0)
+        if euid == 0:
+            create_build_output(os.path.join(work_dir, "restored"), "v2")
+            with open(cached_file) as f:
+                assert f.read() == "v1"
+
+
+def test_evict_least_recently_used():
+    with generate_random_dir() as cache_dir, generate_random_dir() as work_dir:
+        cache = ArtifactCache(cache_dir)
+        keys = list()
+        for index in range(3):
+            output_dir = os.path.join(work_dir, str(index))
+            create_build_output(output_dir, "x" * 10 * 1024)
+            keys.append(cache.make_key({"repo": str(index)}))
+            cache.store(keys[-1], output_dir)
+            time.sleep(0.01)
+        cache.restore(keys[0], os.path.join(work_dir, "restored"))
+
+        with open(os.path.join(cache_dir, keys[0], "size")) as f:
+            cache.max_size = int(int(f.read()) * 2.5)
+        evicted = cache.evict()
+        assert list(evicted) == [keys[1]]
+        assert cache.has(keys[0]) and cache.has(keys[2])
+
+
+def test_fetch_or_build_only_changed_projects():
+    with generate_random_dir() as cache_dir, generate_random_dir() as work_dir:
+        cache = ArtifactCache(cache_dir)
+        built = list()
+
+        def builder(name, output_dir):
+            def build():
+                built.append(name)
+                create_build_output(output_dir, name)
+            return build
+
+        output_dirs = {name: os.path.join(work_dir, name) for name in ("repo", "dep")}
+        builders = {name: builder(name, output_dir) for name, output_dir in output_dirs.items()}
+        hits = cache.fetch_or_build_projects({"repo": "aaa", "dep": "bbb"}, "make", output_dirs, builders)
+        assert hits == {"repo": False, "dep": False}
+
+        hits = cache.fetch_or_build_projects({"repo": "aaa", "dep": "ccc"}, "make", output_dirs, builders)
+        assert hits == {"repo": True, "dep": False}
+        assert built == ["repo", "dep", "dep"]
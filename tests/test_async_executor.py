@@ -0,0 +1,166 @@
+import os
+import io
+import time
+import asyncio
+
+import pytest
+
+from silk.fabric_tools.fabric_context import Host
+from silk.fabric_tools.async_executor import HostResult
+from silk.fabric_tools.async_executor import AsyncExecutor
+from silk.fabric_tools.async_executor import LocalTransport
+from silk.fabric_tools.async_executor import SSHTransport
+from silk.fabric_tools.output_sinks import ConsoleSink
+from silk.fabric_tools.output_sinks import FileSink
+from silk.fabric_tools.output_sinks import RingBufferSink
+from silk.file_tools import generate_random_dir
+
+hosts = [Host("host{0}".format(index), "10.0.0.{0}".format(index)) for index in range(6)]
+
+
+def test_create_executor_with_invalid_concurrency_will_raise():
+    with pytest.raises(ValueError):
+        AsyncExecutor(LocalTransport(), concurrency=0)
+
+
+def test_run_on_all_hosts():
+    executor = AsyncExecutor(LocalTransport())
+    results = executor.run(hosts, "echo $SILK_HOST_NAME $SILK_HOST_ADDRESS")
+    assert set(results) == {host.full_address for host in hosts}
+    for host in hosts:
+        assert isinstance(results[host.full_address], HostResult)
+        assert results[host.full_address].succeeded
+        assert results[host.full_address].stdout == "{0} {1}\n".format(host.name, host.address)
+
+
+def test_run_respects_concurrency():
+    start = time.time()
+    AsyncExecutor(LocalTransport(), concurrency=2).run(hosts, "sleep 0.2")
+    assert time.time() - start >= 0.6
+
+    start = time.time()
+    AsyncExecutor(LocalTransport(), concurrency=6).run(hosts, "sleep 0.2")
+    assert time.time() - start < 0.6
+
+
+def test_run_returns_results_as_completed():
+    completed = list()
+    command = "if [ $SILK_HOST_NAME = host0 ]; then sleep 0.3; fi"
+    AsyncExecutor(LocalTransport()).run(hosts, command, on_result=lambda result: completed.append(result.host.name))
+    assert completed[-1] == "host0"
+    assert len(completed) == len(hosts)
+
+
+def test_run_with_timeout_and_failure():
+    command = "if [ $SILK_HOST_NAME = host0 ]; then sleep 5; fi; [ $SILK_HOST_NAME != host1 ]"
+    start = time.time()
+    results = AsyncExecutor(LocalTransport(), timeout=0.3).run(hosts, command)
+    assert time.time() - start < 2
+    assert isinstance(results[hosts[0].full_address].error, TimeoutError)
+    assert results[hosts[1].full_address].exit_code == 1 and not results[hosts[1].full_address].succeeded
+    assert all(results[host.full_address].succeeded for host in hosts[2:])
+
+
+def test_run_with_per_host_timeout():
+    command = "sleep 0.5"
+    executor = AsyncExecutor(LocalTransport(), timeout={"host0": 0.1, hosts[1].full_address: 0.2})
+    assert executor.get_timeout(hosts[1]) == 0.2 and executor.get_timeout(hosts[2]) is None
+    results = executor.run(hosts[:3], command)
+    assert isinstance(results[hosts[0].full_address].error, TimeoutError) and "0.1s" in str(results[hosts[0].full_address].error)
+    assert isinstance(results[hosts[1].full_address].error, TimeoutError)
+    assert results[hosts[2].full_address].succeeded
+
+    results = AsyncExecutor(LocalTransport(), timeout=lambda host: 0.1 if host.name == "host2" else 2).run(hosts[:3], command)
+    assert isinstance(results[hosts[2].full_address].error, TimeoutError)
+    assert results[hosts[0].full_address].succeeded and results[hosts[1].full_address].succeeded
+
+
+def test_run_iter_inside_event_loop():
+    async def collect():
+        executor = AsyncExecutor(LocalTransport(), concurrency=3)
+        return [result.host.name async for result in executor.run_iter(hosts, "true")]
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert sorted(loop.run_until_complete(collect())) == sorted(host.name for host in hosts)
+    finally:
+        loop.close()
+
+
+def test_ssh_transport_args():
+    transport = SSHTransport(ssh_options=["-p", "2222"])
+    assert transport.get_ssh_args(Host("web", "10.0.0.1")) == ["ssh", "-o", "BatchMode=yes", "-p", "2222", "deploy@10.0.0.1"]
+
+
+def test_stream_output_to_sinks():
+    with generate_random_dir() as dir_path:
+        console = io.StringIO()
+        ring_buffer = RingBufferSink(max_lines=3)
+        sinks = [ConsoleSink(console), FileSink(dir_path), ring_buffer]
+        command = "for i in 1 2 3 4 5; do echo $SILK_HOST_NAME-$i; done; echo oops >&2; printf tail"
+        results = AsyncExecutor(LocalTransport(), sinks=sinks).run(hosts[:2], command)
+
+        assert results[hosts[0].full_address].stdout == "host0-1\nhost0-2\nhost0-3\nhost0-4\nhost0-5\ntail"
+        assert "[host1] host1-3\n" in console.getvalue()
+        assert "[host0] oops\n" in console.getvalue()
+        # stdout 和 stderr 之间的先后顺序不确定, 只检查保留了最后 3 行
+        assert len(ring_buffer.get_lines(hosts[0].full_address)) == 3
+        assert "tail" in ring_buffer.get_lines(hosts[0].full_address) and "host0-1" not in ring_buffer.get_lines(hosts[0].full_address)
+        assert set(ring_buffer.get_all_lines()) == {hosts[0].full_address, hosts[1].full_address}
+        with open(os.path.join(dir_path, "host1-deploy@10.0.0.1.log"), "r") as f:
+            lines = f.read().splitlines()
+        assert lines[:5] == ["host1-{0}".format(index) for index in range(1, 6)]
+        assert "[stderr] oops" in lines and "tail" in lines
+
+
+def test_sinks_keep_hosts_with_duplicate_names_apart():
+    duplicate_hosts = [Host("web", "10.0.1.1"), Host("web", "10.0.1.2")]
+    with generate_random_dir() as dir_path:
+        ring_buffer = RingBufferSink()
+        AsyncExecutor(LocalTransport(), sinks=[FileSink(dir_path), ring_buffer]).run(
+            duplicate_hosts, "echo $SILK_HOST_ADDRESS")
+        for host in duplicate_hosts:
+            assert ring_buffer.get_lines(host.full_address) == [host.address]
+            with open(os.path.join(dir_path, "web-{0}.log".format(host.full_address)), "r") as f:
+                assert f.read() == "{0}\n".format(host.address)
+
+
+def test_bounded_capture():
+    command = "seq 1 10000; echo done >&2"
+    results = AsyncExecutor(LocalTransport(), max_capture=100).run(hosts[:1], command)
+    result = results[hosts[0].full_address]
+    assert result.succeeded and result.truncated
+    assert len(result.stdout) == 100
+    assert result.stdout.endswith("9999\n10000\n")
+    assert result.stderr == "done\n"
+
+
+def test_long_unterminated_line_is_split():
+    ring_buffer = RingBufferSink(max_lines=2)
+    command = "head -c 3000000 /dev/zero | tr '\\0' x; printf '\\n中文'"
+    executor = AsyncExecutor(LocalTransport(), sinks=[ring_buffer], max_capture=1000, max_line_length=1000)
+    start = time.time()
+    results = executor.run(hosts[:1], command)
+    assert time.time() - start < 5
+    assert results[hosts[0].full_address].succeeded and results[hosts[0].full_address].truncated
+    assert len(results[hosts[0].full_address].stdout) == 1000
+    assert ring_buffer.get_lines(hosts[0].full_address) == ["x" * 1000, "中文"]
+
+
+def test_long_line_is_split_on_character_boundary():
+    ring_buffer = RingBufferSink(max_lines=10)
+    AsyncExecutor(LocalTransport(), sinks=[ring_buffer], max_line_length=5).run(hosts[:1], "printf 'ab中文cd\\n'")
+    assert ring_buffer.get_lines(hosts[0].full_address) == ["ab中", "文cd"]
+
+
+def test_line_of_exact_max_length_is_not_followed_by_empty_line():
+    ring_buffer = RingBufferSink(max_lines=10)
+    AsyncExecutor(LocalTransport(), sinks=[ring_buffer], max_line_length=4).run(hosts[:1], "printf 'abcd\\nefghijkl\\n'")
+    assert ring_buffer.get_lines(hosts[0].full_address) == ["abcd", "efgh", "ijkl"]
+
+
+def test_run_on_hosts_with_duplicate_names():
+    duplicate_hosts = [Host("web", "10.0.1.1"), Host("web", "10.0.1.2")]
+    results = AsyncExecutor(LocalTransport()).run(duplicate_hosts, "echo $SILK_HOST_ADDRESS")
+    assert {address: result.stdout for address, result in results.items()} == {
+        "deploy@10.0.1.1": "10.0.1.1\n", "deploy@10.0.1.2": "10.0.1.2\n"}
@@ -0,0 +1,103 @@
+import os
+import subprocess
+import unittest.mock as mock
+
+from silk.fabric_tools import settings
+from silk.fabric_tools import exists
+from silk.fabric_tools import is_link
+from silk.fabric_tools.batch_probes import build_exists_script
+from silk.fabric_tools.batch_probes import build_contains_script
+from silk.fabric_tools.batch_probes import build_stat_script
+from silk.fabric_tools.batch_probes import parse_exists_output
+from silk.fabric_tools.batch_probes import parse_contains_output
+from silk.fabric_tools.batch_probes import parse_stat_output
+from silk.fabric_tools.batch_probes import exists_many
+from silk.fabric_tools.batch_probes import stat_many
+from silk.fabric_tools.probe_cache import clear_probe_cache
+from silk.file_tools import generate_random_dir
+
+
+class CommandOutput(str):
+    failed = False
+    stderr = ""
+
+
+def run_script(script):
+    return subprocess.run(script, shell=True, stdout=subprocess.PIPE).stdout.decode()
+
+
+def local_run(command, **kwargs):
+    return CommandOutput("motd banner\n" + run_script(command))
+
+
+def create_files(dir_path):
+    with open(os.path.join(dir_path, "app.conf"), "w") as f:
+        f.write("listen 80\nworkers 4\n")
+    os.symlink(os.path.join(dir_path, "app.conf"), os.path.join(dir_path, "link.conf"))
+    os.mkdir(os.path.join(dir_path, "dir with space"))
+    return [os.path.join(dir_path, name) for name in ("app.conf", "link.conf", "dir with space", "missing")]
+
+
+def test_exists_script():
+    with generate_random_dir() as dir_path:
+        paths = create_files(dir_path)
+        results = parse_exists_output(paths, run_script(build_exists_script(paths)))
+        assert results == {paths[0]: True, paths[1]: True, paths[2]: True, paths[3]: False}
+        assert parse_exists_output(["~"], run_script(build_exists_script(["~"]))) == {"~": True}
+
+
+def test_exists_script_matches_fabric_exists():
+    with generate_random_dir() as dir_path:
+        os.symlink(os.path.join(dir_path, "missing"), os.path.join(dir_path, "dangling"))
+        paths = [os.path.join(dir_path, "dangling"), "$HOME", os.path.join(dir_path, "dang*"),
+                 os.path.join(dir_path, "missing")]
+        results = parse_exists_output(paths, run_script(build_exists_script(paths)))
+        expected = {path: subprocess.run("stat \"$(echo {0})\"".format(path), shell=True,
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+                    for path in paths}
+        assert results == expected == {paths[0]: True, paths[1]: True, paths[2]: True, paths[3]: False}
+
+
+def test_contains_script():
+    with generate_random_dir() as dir_path:
+        conf, _, _, missing = create_files(dir_path)
+        checks = [(conf, "listen 80"), (conf, "LISTEN"), (conf, "workers"), (missing, "listen"), (conf, "a.*b")]
+        output = run_script(build_contains_script(checks))
+        assert parse_contains_output(checks, output) == {checks[0]: True, checks[1]: False, checks[2]: True,
+                                                         checks[3]: False, checks[4]: False}
+        output = run_script(build_contains_script(checks, exact=True, case_sensitive=False))
+        assert parse_contains_output(checks, output)[checks[1]] is False
+        assert parse_contains_output(checks, output)[(conf, "listen 80")] is True
+        assert parse_contains_output([(conf, "LISTEN 80")], run_script(build_contains_script(
+            [(conf, "LISTEN 80")], exact=True, case_sensitive=False))) == {(conf, "LISTEN 80"): True}
+
+
+def test_stat_script():
+    with generate_random_dir() as dir_path:
+        paths = create_files(dir_path)
+        stats = parse_stat_output(paths, run_script(build_stat_script(paths)))
+        assert stats[paths[0]]["type"] == "regular file"
+        assert stats[paths[0]]["size"] == os.path.getsize(paths[0])
+        assert stats[paths[0]]["mode"] == os.stat(paths[0]).st_mode & 0o7777
+        assert stats[paths[1]]["is_link"]
+        assert stats[paths[2]]["type"] == "directory"
+        assert stats[paths[3]] is None
+
+
+@mock.patch("silk.fabric_tools.batch_probes.run", local_run)
+def test_batch_probes_seed_probe_cache():
+    clear_probe_cache()
+    with generate_random_dir() as dir_path, settings(host_string="deploy@batch-host"):
+        paths = create_files(dir_path)
+        assert exists_many(paths)[paths[3]] is False
+        stats = stat_many(paths)
+        assert stats[paths[1]]["is_link"] and stats[paths[3]] is None
+
+        with mock.patch("fabric.contrib.files.run") as fabric_run:
+            assert exists(paths[0]) is True
+            assert exists(paths[3]) is False
+            assert not fabric_run.called
+            # stat_many 按字面路径检查, 不会替 is_link 写入缓存
+            is_link(paths[1])
+            assert fabric_run.called
+    clear_probe_cache()
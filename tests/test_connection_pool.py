@@ -0,0 +1,158 @@
+import os
+import time
+import stat
+import threading
+
+import pytest
+
+from silk.fabric_tools.fabric_context import Host
+from silk.fabric_tools.fabric_context import Role
+from silk.fabric_tools.fabric_context import Environment
+from silk.fabric_tools.connection_pool import ConnectionPool
+from silk.fabric_tools.async_executor import AsyncExecutor
+from silk.fabric_tools.async_executor import SSHTransport
+from silk.file_tools import echo_file
+from silk.file_tools import generate_random_dir
+
+# 假的 ssh: 记录收到的参数, 然后在本机执行最后一个参数
+fake_ssh_script = """#!/bin/sh
+echo "$@" >> {0}
+for arg in "$@"; do
+    if [ "$arg" = "-O" ]; then exit 0; fi
+    command="$arg"
+done
+exec /bin/sh -c "$command"
+"""
+
+
+def create_fake_ssh(parent: str) -> (str, str):
+    log_file = os.path.join(parent, "ssh.log")
+    ssh_binary = os.path.join(parent, "ssh")
+    echo_file(fake_ssh_script.format(log_file), ">", ssh_binary)
+    os.chmod(ssh_binary, os.stat(ssh_binary).st_mode | stat.S_IEXEC)
+    return ssh_binary, log_file
+
+
+def test_create_pool_with_invalid_max_sessions_will_raise():
+    with pytest.raises(ValueError):
+        ConnectionPool(max_sessions_per_host=0)
+
+
+def test_pool_ssh_options():
+    with generate_random_dir() as control_dir:
+        pool = ConnectionPool(control_dir=control_dir, idle_timeout=60)
+        host = Host("web", "10.0.0.1")
+        options = pool.get_ssh_options(host)
+        assert "ControlMaster=auto" in options
+        assert "ControlPersist=60" in options
+        assert "ControlPath={0}".format(pool.get_control_path(host)) in options
+        assert pool.get_control_path(host) != pool.get_control_path(Host("db", "10.0.0.2"))
+        assert pool.get_ssh_args(host)[-1] == "deploy@10.0.0.1"
+
+
+def test_pool_limit_sessions_per_host():
+    with generate_random_dir() as control_dir:
+        pool = ConnectionPool(control_dir=control_dir, max_sessions_per_host=2)
+        host = Host("web", "10.0.0.1")
+        pool.acquire_session(host)
+        pool.acquire_session(host)
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: (pool.acquire_session(host), acquired.set()))
+        thread.start()
+        assert not acquired.wait(0.1)
+        pool.release_session(host)
+        assert acquired.wait(1)
+        thread.join()
+        assert pool.active_sessions() == {"deploy@10.0.0.1": 2}
+
+
+def test_pool_run_and_evict_idle():
+    with generate_random_dir() as test_dir:
+        ssh_binary, log_file = create_fake_ssh(test_dir)
+        pool = ConnectionPool(control_dir=test_dir, ssh_binary=ssh_binary)
+        host = Host("web", "10.0.0.1")
+        result = pool.run(host, "echo hello")
+        assert result.returncode == 0
+        assert result.stdout == b"hello\n"
+        assert pool.active_sessions() == dict()
+
+        assert pool.evict_idle(idle_timeout=3600) == list()
+        echo_file("", ">", pool.get_control_path(host))  # 假装 master 已经建立
+        assert pool.evict_idle(idle_timeout=0) == ["deploy@10.0.0.1"]
+        with open(log_file) as f:
+            assert "-O exit deploy@10.0.0.1" in f.read()
+
+
+def test_ssh_transport_reuse_pool():
+    with generate_random_dir() as test_dir:
+        ssh_binary, log_file = create_fake_ssh(test_dir)
+        pool = ConnectionPool(control_dir=test_dir, ssh_binary=ssh_binary, max_sessions_per_host=2)
+        host = Host("web", "10.0.0.1")
+        executor = AsyncExecutor(SSHTransport(pool=pool), concurrency=10)
+
+        start = time.time()
+        for _ in range(2):
+            results = executor.run([host, Host("web2", "10.0.0.1"), Host("web3", "10.0.0.1")], "sleep 0.2")
+            assert all(result.succeeded for result in results.values())
+        assert time.time() - start >= 0.8  # 同一台服务器最多只有 2 个会话
+        assert pool.active_sessions() == dict()
+        with open(log_file) as f:
+            lines = f.readlines()
+        assert len(lines) == 6
+        assert all("ControlPath={0}".format(pool.get_control_path(host)) in line for line in lines)
+
+
+def test_environment_owns_connection_pool():
+    host = Host("pool_host", "10.0.0.1")
+    environment = Environment("test_connection_pool", [Role("pool_role", [host])], ssh_max_sessions=3)
+    assert environment.connection_pool is environment.connection_pool
+    assert environment.connection_pool.max_sessions_per_host == 3
+
+
+def test_pool_limit_sessions_per_host_async():
+    import asyncio
+
+    async def hold_session(pool, host, events):
+        await pool.acquire_session_async(host)
+        events.append(("acquired", time.time()))
+        await asyncio.sleep(0.1)
+        pool.release_session(host)
+
+    with generate_random_dir() as control_dir:
+        pool = ConnectionPool(control_dir=control_dir, max_sessions_per_host=1)
+        host = Host("web", "10.0.0.1")
+        events = list()
+        loop = asyncio.new_event_loop()
+
+        async def hold_sessions():
+            await asyncio.gather(*[hold_session(pool, host, events) for _ in range(3)])
+
+        try:
+            loop.run_until_complete(hold_sessions())
+        finally:
+            loop.close()
+        times = [event_time for _, event_time in events]
+        assert len(times) == 3 and times[2] - times[0] >= 0.18
+        assert pool.active_sessions() == dict()
+
+
+def test_close_all_removes_created_control_dir():
+    import gc
+    import weakref
+    pool = ConnectionPool()
+    control_dir = pool.control_dir
+    assert os.path.isdir(control_dir)
+    pool.close_all()
+    assert not os.path.exists(control_dir)
+
+    with pool.session(Host("web", "10.0.0.1")):
+        assert os.path.isdir(control_dir)
+    pool_ref = weakref.ref(pool)
+    del pool
+    gc.collect()
+    assert pool_ref() is None
+    assert not os.path.exists(control_dir)
+
+    with generate_random_dir() as dir_path:
+        ConnectionPool(control_dir=dir_path).close_all()
+        assert os.path.isdir(dir_path)
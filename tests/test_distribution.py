@@ -0,0 +1,138 @@
+import os
+
+import pytest
+
+from silk.fabric_tools.fabric_context import Host
+from silk.fabric_tools.async_executor import LocalTransport
+from silk.fabric_tools.async_executor import SSHTransport
+from silk.fabric_tools.distribution import plan_fanout
+from silk.fabric_tools.distribution import FanoutDistributor
+from silk.fabric_tools.distribution import distribute_file
+from silk.file_tools import generate_random_dir
+
+hosts = [Host("host{0:02d}".format(index), "10.0.0.{0}".format(index)) for index in range(20)]
+
+
+def create_artifact(dir_path):
+    file_path = os.path.join(dir_path, "artifact.bin")
+    with open(file_path, "wb") as f:
+        f.write(os.urandom(256 * 1024))
+    return file_path
+
+
+def read_file(file_path):
+    with open(file_path, "rb") as f:
+        return f.read()
+
+
+def test_plan_fanout():
+    rounds = plan_fanout(hosts, seeds=2, fanout=3)
+    assert [len(current_round) for current_round in rounds] == [2, 6, 12]
+    assert all(source is None for source, _ in rounds[0])
+    assert sorted(target.name for current_round in rounds for _, target in current_round) == [host.name for host in hosts]
+
+    holders = set()
+    for current_round in rounds:
+        for source, target in current_round:
+            assert source is None or source in holders
+        holders.update(target for _, target in current_round)
+
+    assert plan_fanout(list()) == []
+    with pytest.raises(ValueError):
+        plan_fanout(hosts, fanout=0)
+
+
+def test_distribute_file():
+    with generate_random_dir() as dir_path:
+        artifact = create_artifact(dir_path)
+        transport = LocalTransport(os.path.join(dir_path, "hosts"))
+        distributor = FanoutDistributor(transport, seeds=1, fanout=2)
+        results = distributor.distribute(hosts, artifact, "artifact.bin")
+        assert len(distributor.rounds) == 4
+        assert all(result.succeeded for result in results.values())
+        assert sum(1 for result in results.values() if result.command.startswith("put")) == 1
+        for host in hosts:
+            assert read_file(transport.get_host_path(host, "artifact.bin")) == read_file(artifact)
+
+
+def test_failed_relay_falls_back_to_control_node():
+    class BrokenRelayTransport(LocalTransport):
+        def get_relay_command(self, source, target, remote_path):
+            if source.name == "host00":
+                return "exit 1"
+            return super().get_relay_command(source, target, remote_path)
+
+    with generate_random_dir() as dir_path:
+        artifact = create_artifact(dir_path)
+        transport = BrokenRelayTransport(os.path.join(dir_path, "hosts"))
+        results = distribute_file(hosts[:7], artifact, "artifact.bin", transport, seeds=1, fanout=2)
+        assert all(result.succeeded for result in results.values())
+        assert results[hosts[1].full_address].command == "put artifact.bin"
+        assert results[hosts[3].full_address].command == "put artifact.bin"
+        assert results[hosts[5].full_address].command == "relay from host01"
+
+
+def test_fallback_uploads_are_bounded():
+    class CountingTransport(LocalTransport):
+        def get_relay_command(self, source, target, remote_path):
+            return "exit 1"
+
+        async def put(self, host, local_path, remote_path):
+            # 用日志里 start/end 的先后顺序计算同时进行的上传数量
+            command = "echo start >> {0}; sleep 0.05; cp {1} {2}; status=$?; echo end >> {0}; exit $status".format(
+                log_file, local_path, self.get_host_path(host, remote_path))
+            return await self.open(host, command)
+
+    with generate_random_dir() as dir_path:
+        artifact = create_artifact(dir_path)
+        log_file = os.path.join(dir_path, "uploads.log")
+        transport = CountingTransport(os.path.join(dir_path, "hosts"))
+        results = distribute_file(hosts[:10], artifact, "artifact.bin", transport, seeds=1, fanout=9, max_uploads=2)
+        assert all(result.succeeded and result.command == "put artifact.bin" for result in results.values())
+
+        active, max_active = 0, 0
+        with open(log_file) as f:
+            for line in f.read().split():
+                active += 1 if line == "start" else -1
+                max_active = max(max_active, active)
+        assert max_active == 2
+
+    with pytest.raises(ValueError):
+        FanoutDistributor(max_uploads=0)
+
+
+def test_checksum_mismatch_will_fail():
+    class CorruptTransport(LocalTransport):
+        async def put(self, host, local_path, remote_path):
+            return await self.open(host, "echo corrupted > {0}".format(remote_path))
+
+    with generate_random_dir() as dir_path:
+        artifact = create_artifact(dir_path)
+        results = distribute_file(hosts[:3], artifact, "artifact.bin", CorruptTransport(os.path.join(dir_path, "hosts")))
+        assert not any(result.succeeded for result in results.values())
+        assert "校验失败" in results[hosts[0].full_address].stderr
+
+
+def test_ssh_transport_relay_command():
+    transport = SSHTransport()
+    command = transport.get_relay_command(hosts[0], hosts[1], "/tmp/my artifact.tar")
+    assert command.startswith("scp -q -o BatchMode=yes")
+    assert command.endswith("'/tmp/my artifact.tar' 'deploy@10.0.0.1:/tmp/my artifact.tar'")
+
+
+def test_distribute_to_hosts_with_duplicate_names():
+    class BrokenRelayTransport(LocalTransport):
+        def get_relay_command(self, source, target, remote_path):
+            if source.address == "10.0.1.1":
+                return "exit 1"
+            return super().get_relay_command(source, target, remote_path)
+
+    duplicate_hosts = [Host("web", "10.0.1.{0}".format(index)) for index in range(6)]
+    with generate_random_dir() as dir_path:
+        artifact = create_artifact(dir_path)
+        transport = BrokenRelayTransport(os.path.join(dir_path, "hosts"))
+        results = distribute_file(duplicate_hosts, artifact, "artifact.bin", transport, seeds=1, fanout=1)
+        assert set(results) == {host.full_address for host in duplicate_hosts}
+        assert all(result.succeeded for result in results.values())
+        for host in duplicate_hosts:
+            assert read_file(transport.get_host_path(host, "artifact.bin")) == read_file(artifact)
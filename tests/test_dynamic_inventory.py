@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import threading
+from http.server import HTTPServer
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from silk.fabric_tools.dynamic_inventory import CommandSource
+from silk.fabric_tools.dynamic_inventory import FileSource
+from silk.fabric_tools.dynamic_inventory import HttpSource
+from silk.fabric_tools.dynamic_inventory import InventorySource
+from silk.fabric_tools.dynamic_inventory import DynamicInventory
+from silk.fabric_tools.dynamic_inventory import create_source
+from silk.file_tools import generate_random_dir
+
+
+def make_inventory(environment_name, address):
+    return {"environments": {environment_name: {"options": {"attr": "attr"},
+                                                "hosts": [{"name": "web-01", "address": address, "roles": ["web"]}]}}}
+
+
+class CountingSource(InventorySource):
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def get_cache_key(self):
+        return "counting"
+
+    def fetch(self):
+        time.sleep(self.delay)
+        self.calls += 1
+        return make_inventory("dynamic", "10.0.0.{0}".format(self.calls))
+
+
+def get_address(data):
+    return data["dynamic"]["hosts"][0]["address"]
+
+
+def test_create_source():
+    assert isinstance(create_source("cmd:./inventory.py --list"), CommandSource)
+    assert create_source("cmd:./inventory.py --list").command == "./inventory.py --list"
+    assert isinstance(create_source("https://cmdb/api/inventory"), HttpSource)
+    assert isinstance(create_source("file:/etc/hosts.yaml"), FileSource)
+    assert create_source("/etc/hosts.yaml").file_path == "/etc/hosts.yaml"
+
+
+def test_command_and_file_sources():
+    data = make_inventory("dynamic_command", "10.0.0.1")
+    source = CommandSource("echo '{0}'".format(json.dumps(data)))
+    assert source.fetch() == data
+    with pytest.raises(Exception):
+        CommandSource("exit 3").fetch()
+
+    with generate_random_dir() as dir_path:
+        file_path = os.path.join(dir_path, "inventory.json")
+        with open(file_path, "w") as f:
+            json.dump(data, f)
+        environments = FileSource(file_path).fetch()["environments"]
+        assert environments["dynamic_command"]["hosts"][0]["address"] == "10.0.0.1"
+
+
+def test_http_source():
+    data = make_inventory("dynamic_http", "10.0.0.1")
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with generate_random_dir() as dir_path:
+            url = "http://127.0.0.1:{0}/inventory".format(server.server_port)
+            environment, = DynamicInventory(create_source(url), cache_dir=dir_path).load()
+            assert environment.name == "dynamic_http"
+            assert environment.attr == "attr"
+            assert environment.get_host("deploy@10.0.0.1").name == "web-01"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_ttl_cache():
+    with generate_random_dir() as dir_path:
+        source = CountingSource()
+        inventory = DynamicInventory(source, ttl=60, cache_dir=dir_path)
+        assert get_address(inventory.load_data()) == "10.0.0.1"
+        assert get_address(inventory.load_data()) == "10.0.0.1"
+        assert source.calls == 1
+
+        # 新的进程通过磁盘缓存拿到数据
+        assert get_address(DynamicInventory(source, ttl=60, cache_dir=dir_path).load_data()) == "10.0.0.1"
+        assert source.calls == 1
+
+
+def test_stale_cache_refreshes_in_background():
+    with generate_random_dir() as dir_path:
+        source = CountingSource(delay=0.3)
+        inventory = DynamicInventory(source, ttl=0, cache_dir=dir_path)
+        assert get_address(inventory.load_data()) == "10.0.0.1"
+
+        start = time.time()
+        assert get_address(inventory.load_data()) == "10.0.0.1"
+        assert time.time() - start < 0.2
+        inventory.wait_for_refresh()
+        assert source.calls == 2
+        assert get_address(DynamicInventory(source, ttl=60, cache_dir=dir_path).load_data()) == "10.0.0.2"
+
+        # 超过 max_stale 之后必须同步刷新
+        inventory = DynamicInventory(source, ttl=0, max_stale=0, cache_dir=dir_path)
+        assert get_address(inventory.load_data()) == "10.0.0.3"
+
+
+def test_background_refresh_failure_keeps_stale_data():
+    class FailingSource(CountingSource):
+        def fetch(self):
+            if self.calls:
+                raise RuntimeError("inventory service is down")
+            return super().fetch()
+
+    with generate_random_dir() as dir_path:
+        inventory = DynamicInventory(FailingSource(), ttl=0, cache_dir=dir_path)
+        assert get_address(inventory.load_data()) == "10.0.0.1"
+        assert get_address(inventory.load_data()) == "10.0.0.1"
+        inventory.wait_for_refresh()
+        assert isinstance(inventory.last_error, RuntimeError)
+        assert get_address(inventory.load_data()) == "10.0.0.1"
+
+
+def test_load_again_after_ttl_updates_environment_in_place():
+    class ReloadSource(CountingSource):
+        def fetch(self):
+            self.calls += 1
+            role_name = "web" if self.calls == 1 else "app"
+            return {"environments": {"dynamic_reload": {"options": {"attr": self.calls}, "hosts": [
+                {"name": "web-01", "address": "10.0.0.{0}".format(self.calls), "roles": [role_name]}]}}}
+
+    with generate_random_dir() as dir_path:
+        inventory = DynamicInventory(ReloadSource(), ttl=0, max_stale=0, cache_dir=dir_path)
+        environment, = inventory.load()
+        web = environment.get_role("web")
+        assert environment.get_host("deploy@10.0.0.1").has_role(web)
+
+        time.sleep(0.01)
+        reloaded, = inventory.load()
+        assert reloaded is environment
+        assert environment.attr == 2
+        assert environment.get_host("deploy@10.0.0.1") is None
+        host = environment.get_host("deploy@10.0.0.2")
+        assert host.roles == {environment.get_role("app")}
+        assert environment.get_role("web") is None and web.index is None
+        assert environment.get_hosts("web-01") == [host]
@@ -8,6 +8,9 @@ from silk.fabric_tools.fabric_context import Role
 from silk.fabric_tools.fabric_context import Environment
 from silk.fabric_tools.fabric_context import run_per_host
 from silk.fabric_tools.fabric_context import run_per_role
+from silk.fabric_tools.rolling_scheduler import RollingScheduler
+from silk.fabric_tools.profiler import enable_profiling
+from silk.fabric_tools.profiler import disable_profiling
 from silk.fabric_tools import env
 from silk.fabric_tools import run
 from silk.fabric_tools import local
@@ -111,6 +114,84 @@ def test_finalize_environment():
     assert env.roledefs == roledefs
 
 
+def test_environment_indexes():
+    host1 = Host("host1", "10.0.0.1")
+    host2 = Host("host2", "10.0.0.2")
+    role1 = Role("role1", [host1, host2])
+    role2 = Role("role2", [host2])
+    test_env = Environment("test_env_indexes", [role1, role2])
+
+    assert test_env.get_host("deploy@10.0.0.1") is host1
+    assert test_env.get_host("deploy@10.0.0.3") is None
+    assert test_env.get_hosts("host2") == [host2]
+    assert set(test_env.get_hosts("all")) == {host1, host2}
+    assert test_env.get_role("role2") is role2
+    assert test_env.get_roles(["role2", "role1", "missing"]) == [role2, role1]
+
+    host3 = Host("host3", "10.0.0.3")
+    test_env.add_host(host3, ["role2"])
+    assert test_env.get_host("deploy@10.0.0.3") is host3
+    assert role2.has_host(host3) and host3 in test_env.hosts
+    with pytest.raises(Exception):
+        test_env.add_host(Host("host4", "10.0.0.4"), ["missing"])
+
+    role3 = Role("role3", [Host("host5", "10.0.0.5")])
+    test_env.add_role(role3)
+    assert test_env.get_roles(["role3"]) == [role3]
+    assert test_env.get_hosts("host5")[0].address == "10.0.0.5"
+
+
+def test_host_and_role_are_slotted():
+    host = Host("host", "127.0.0.1")
+    role = Role("role", [host])
+    assert not hasattr(host, "__dict__") and not hasattr(role, "__dict__")
+    assert host.roles == {role}
+    assert host.full_address is Host("other", "127.0.0.1").full_address
+
+
+def test_released_role_bit_is_reused():
+    import gc
+    host = Host("host", "127.0.0.1")
+    host.add_role(Role("unreferenced", []))
+    gc.collect()
+    assert {role.name for role in host.roles} == {"unreferenced"}
+
+    role = Role("role", [host])
+    index = role.index
+    role.release()
+    assert not host.has_role(role) and role.hosts == set()
+    assert {role.name for role in host.roles} == {"unreferenced"}
+    new_role = Role("new_role", [])
+    assert new_role.index == index
+    assert not host.has_role(new_role)
+
+
+def test_create_environment_from_records():
+    records = [{"name": "web-{0:02d}".format(index), "address": "10.0.3.{0}".format(index),
+                "roles": ["web", "eu"] if index % 2 else ["web"]} for index in range(1, 7)]
+    records.append({"name": "db-01", "address": "10.0.4.1", "user": "root", "roles": ["db"]})
+    test_env = Environment.from_records("test_env_from_records", records, attr="attr")
+
+    assert test_env.attr == "attr"
+    assert len(test_env.hosts) == 7
+    assert {role.name for role in test_env.roles} == {"web", "eu", "db"}
+    assert len(test_env.get_role("eu").hosts) == 3
+    db_host = test_env.get_host("root@10.0.4.1")
+    assert db_host.name == "db-01"
+    assert db_host.roles == {test_env.get_role("db")}
+    assert test_env.get_hosts("web-01")[0].has_role(test_env.get_role("eu"))
+    assert not test_env.get_hosts("web-02")[0].has_role(test_env.get_role("eu"))
+
+
+def test_create_existing_environment_from_records_will_raise_before_creating_roles():
+    records = [{"name": "web-01", "address": "10.0.5.1", "roles": ["web"]}]
+    Environment.from_records("test_env_duplicate_records", records)
+    next_index = Role("probe", []).index
+    with pytest.raises(Exception):
+        Environment.from_records("test_env_duplicate_records", records)
+    assert Role("probe", []).index == next_index + 1
+
+
 def setup_key():
     pubkey_file = os.path.join(os.path.expanduser("~"), ".ssh/id_rsa.pub")
     if not os.path.exists(pubkey_file):
@@ -199,6 +280,21 @@ def test_run_per_role():
     fab_task_("test", "all")
 
 
+def test_run_per_role_with_profiling():
+    profiler = enable_profiling()
+    try:
+        fab_task_ = run_per_role(fab_task)
+        fab_task_("test", "all")
+    finally:
+        disable_profiling()
+
+    summary = profiler.summary()
+    assert summary["kinds"]["task"]["count"] == 2
+    assert summary["kinds"]["run"]["count"] == 4
+    assert {host for host, _ in summary["slowest_hosts"]} == {host.full_address, host2.full_address}
+    os.remove(profiler.event_file)
+
+
 def test_run_per_role_ask_input():
     fab_task_ = run_per_role(inputs=["sudo password:"])(fab_sudo_task)
     with mock.patch("builtins.input", lambda x: os.environ.get("sudo_password")):
@@ -210,6 +306,12 @@ def test_run_per_role_default_input():
     fab_task_("test", "all")
 
 
+def test_run_per_role_with_rolling_scheduler():
+    fab_task_ = run_per_role(scheduler=RollingScheduler(1))(fab_task)
+    results = fab_task_("test", "all")
+    assert set(results) == {host.full_address, host2.full_address}
+
+
 def fab_task_for_role2():
     run("ls")
     assert env.roles == [role2]
@@ -1,5 +1,7 @@
 import os
 import shutil
+import subprocess
+import multiprocessing
 
 import pytest
 
@@ -9,6 +11,8 @@ from silk.file_tools import generate_random_file
 from silk.file_tools import generate_random_file_path
 from silk.file_tools import touch_file
 from silk.file_tools import echo_file
+from silk.file_tools import file_lock
+from silk.file_tools import IndexAllocator
 
 
 def test_generate_random_str_working():
@@ -137,3 +141,72 @@ def test_echo_file_in_append_mode():
     echo_file("testB", ">>", file_path)
     with open(file_path, "r") as f:
         assert f.read() == "testAtestB"
+
+
+def test_file_lock_exclusive():
+    import fcntl
+    lock_path = generate_random_file_path()
+    with file_lock(lock_path):
+        with open(lock_path, "a") as fd:
+            with pytest.raises(BlockingIOError):
+                fcntl.flock(fd.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    with open(lock_path, "a") as fd:
+        fcntl.flock(fd.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    os.remove(lock_path)
+
+
+def test_file_lock_shared():
+    import fcntl
+    lock_path = generate_random_file_path()
+    with file_lock(lock_path, shared=True):
+        with open(lock_path, "a") as fd:
+            fcntl.flock(fd.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+    os.remove(lock_path)
+
+
+def test_index_allocator_reuse_released_index():
+    with generate_random_dir() as record_dir:
+        allocator = IndexAllocator(record_dir)
+        assert allocator.acquire() == 0
+        assert allocator.acquire() == 1
+        assert allocator.release(0)
+        assert not allocator.release(0)
+        assert allocator.acquire() == 0
+        assert allocator.owners() == {0: os.getpid(), 1: os.getpid()}
+
+
+def test_index_allocator_reclaim_dead_owner():
+    dead_process = subprocess.Popen(["true"])
+    dead_process.wait()
+    with generate_random_dir() as record_dir:
+        allocator = IndexAllocator(record_dir)
+        assert allocator.acquire(pid=dead_process.pid) == 0
+        assert allocator.acquire() == 0
+        assert allocator.owners() == {0: os.getpid()}
+
+
+def test_index_allocator_exhausted_will_raise():
+    with generate_random_dir() as record_dir:
+        allocator = IndexAllocator(record_dir, max_index=1)
+        allocator.acquire()
+        with pytest.raises(RuntimeError):
+            allocator.acquire()
+
+
+def acquire_index(record_dir, queue, done):
+    queue.put(IndexAllocator(record_dir).acquire())
+    done.wait()  # 进程退出后 index 会被回收, 所以要等所有进程都分配完
+
+
+def test_index_allocator_across_processes():
+    with generate_random_dir() as record_dir:
+        queue = multiprocessing.Queue()
+        done = multiprocessing.Event()
+        processes = [multiprocessing.Process(target=acquire_index, args=(record_dir, queue, done)) for _ in range(8)]
+        for process in processes:
+            process.start()
+        indexes = sorted(queue.get() for _ in processes)
+        done.set()
+        for process in processes:
+            process.join()
+        assert indexes == list(range(8))
@@ -1,15 +1,39 @@
 import os
+import gc
 import pytest
 import shutil
+import subprocess
+import unittest.mock as mock
+from copy import deepcopy
 
 from silk.git_tools import GitProject
+from silk.git_tools import GitRefResolver
 from silk.file_tools import touch_file
+from silk.file_tools import IndexAllocator
 from silk.file_tools import generate_random_dir
 
 test_git_repo = "https://gitlab.com/imhuwq/test.git"
 test_dep_git_repo = "https://gitlab.com/imhuwq/test-dep.git"
 
 
+def create_upstream_repo(parent: str) -> str:
+    repo_path = os.path.join(parent, "upstream")
+    git = "cd {0} && git -c user.name=silk -c user.email=silk@localhost".format(repo_path)
+    os.makedirs(repo_path)
+    subprocess.check_call("cd {0} && git init -q && git symbolic-ref HEAD refs/heads/master".format(repo_path), shell=True)
+    touch_file(os.path.join(repo_path, "README"))
+    subprocess.check_call("{0} add . && {0} commit -q -m init".format(git), shell=True)
+    subprocess.check_call("{0} tag v0.0.1 && git branch develop".format(git), shell=True)
+    return repo_path
+
+
+def commit_upstream_repo(repo_path: str, file_name: str, branch: str = "master"):
+    git = "cd {0} && git -c user.name=silk -c user.email=silk@localhost".format(repo_path)
+    subprocess.check_call("{0} checkout -q {1}".format(git, branch), shell=True)
+    touch_file(os.path.join(repo_path, file_name))
+    subprocess.check_call("{0} add . && {0} commit -q -m {1} && git checkout -q master".format(git, file_name), shell=True)
+
+
 def test_create_git_project():
     with generate_random_dir() as test_repo_dir:
         test_repo = GitProject("test", test_git_repo, test_repo_dir)
@@ -56,3 +80,283 @@ def test_git_clone():
         touch_file(os.path.join(test_repo.path, "aabb"))
         test_repo.fetch_commit_ref("v0.0.2")
         test_repo.get_current_state()
+
+
+def test_git_clone_from_shared_mirror():
+    with generate_random_dir() as test_dir:
+        upstream = create_upstream_repo(test_dir)
+        repo_dir = os.path.join(test_dir, "repo")
+        mirror_repo_a = GitProject("mirror_repo_a", upstream, repo_dir).clone_project()
+        mirror_repo_b = GitProject("mirror_repo_b", upstream, repo_dir).clone_project()
+
+        assert mirror_repo_a.mirror_path == mirror_repo_b.mirror_path
+        assert os.path.exists(os.path.join(mirror_repo_a.mirror_path, "HEAD"))
+        for project in (mirror_repo_a, mirror_repo_b):
+            with open(os.path.join(project.path, ".git/objects/info/alternates")) as f:
+                assert f.read().strip() == os.path.join(project.mirror_path, "objects")
+            remote_url = subprocess.check_output("cd {0} && git remote get-url origin".format(project.path), shell=True)
+            assert remote_url.decode().strip() == upstream
+
+
+def test_git_clone_into_existing_dir_from_mirror():
+    with generate_random_dir() as test_dir:
+        upstream = create_upstream_repo(test_dir)
+        mirror_existing_repo = GitProject("mirror_existing_repo", upstream, os.path.join(test_dir, "repo"))
+        os.makedirs(mirror_existing_repo.path)
+        touch_file(os.path.join(mirror_existing_repo.path, "aabb"))
+        mirror_existing_repo.clone_project()
+        assert os.path.exists(os.path.join(mirror_existing_repo.path, ".git"))
+        assert os.path.exists(os.path.join(mirror_existing_repo.path, "README"))
+
+
+def test_fetch_commit_ref_through_mirror():
+    with generate_random_dir() as test_dir:
+        upstream = create_upstream_repo(test_dir)
+        mirror_fetch_repo = GitProject("mirror_fetch_repo", upstream, os.path.join(test_dir, "repo")).clone_project()
+        commit_upstream_repo(upstream, "develop_file", branch="develop")
+        commit_upstream_repo(upstream, "master_file")
+
+        mirror_fetch_repo.fetch_commit_ref("develop")
+        assert os.path.exists(os.path.join(mirror_fetch_repo.path, "develop_file"))
+        mirror_fetch_repo.fetch_commit_ref("v0.0.1")
+        assert not os.path.exists(os.path.join(mirror_fetch_repo.path, "develop_file"))
+        commit_hash = mirror_fetch_repo.fetch_commit_ref("master")
+        assert os.path.exists(os.path.join(mirror_fetch_repo.path, "master_file"))
+        upstream_hash = subprocess.check_output("cd {0} && git rev-parse master".format(upstream), shell=True)
+        assert commit_hash == upstream_hash.decode().strip()
+
+
+def test_git_worktree_slots_share_mirror():
+    with generate_random_dir() as test_dir:
+        upstream = create_upstream_repo(test_dir)
+        repo_dir = os.path.join(test_dir, "repo")
+        worktree_repo_a = GitProject("worktree_repo_a", upstream, repo_dir, use_worktree=True).clone_project()
+        worktree_repo_b = GitProject("worktree_repo_b", upstream, repo_dir, use_worktree=True).clone_project()
+        assert worktree_repo_a.path != worktree_repo_b.path
+
+        worktrees = subprocess.check_output("git --git-dir={0} worktree list --porcelain".format(worktree_repo_a.mirror_path), shell=True)
+        worktrees = worktrees.decode()
+        assert "worktree {0}\n".format(worktree_repo_a.path) in worktrees
+        assert "worktree {0}\n".format(worktree_repo_b.path) in worktrees
+        assert os.path.isfile(os.path.join(worktree_repo_a.path, ".git"))
+
+        commit_upstream_repo(upstream, "develop_file", branch="develop")
+        worktree_repo_a.fetch_commit_ref("develop")
+        worktree_repo_b.fetch_commit_ref("v0.0.1")
+        assert os.path.exists(os.path.join(worktree_repo_a.path, "develop_file"))
+        assert not os.path.exists(os.path.join(worktree_repo_b.path, "develop_file"))
+        assert worktree_repo_a.get_commit_hash() != worktree_repo_b.get_commit_hash()
+
+
+def test_git_worktree_into_existing_dir():
+    with generate_random_dir() as test_dir:
+        upstream = create_upstream_repo(test_dir)
+        worktree_existing_repo = GitProject("worktree_existing_repo", upstream, os.path.join(test_dir, "repo"), use_worktree=True)
+        os.makedirs(worktree_existing_repo.path)
+        touch_file(os.path.join(worktree_existing_repo.path, "aabb"))
+        worktree_existing_repo.clone_project()
+        assert os.path.exists(os.path.join(worktree_existing_repo.path, "README"))
+        status = subprocess.check_output("cd {0} && git status --porcelain".format(worktree_existing_repo.path), shell=True)
+        assert "README" not in status.decode()
+
+
+def test_git_ref_resolver_batch():
+    with generate_random_dir() as test_dir:
+        upstream = create_upstream_repo(test_dir)
+        master_hash = subprocess.check_output("cd {0} && git rev-parse master".format(upstream), shell=True).decode().strip()
+        resolver = GitRefResolver(upstream)
+        refs = ["refs/heads/master", "refs/tags/v0.0.1", "refs/heads/missing"] + ["HEAD"] * 1000
+        result = resolver.resolve_many(refs)
+        assert result["refs/heads/master"] == master_hash
+        assert result["refs/tags/v0.0.1"] == master_hash
+        assert result["refs/heads/missing"] is None
+        assert result["HEAD"] == master_hash
+
+        commit_upstream_repo(upstream, "new_file")
+        new_master_hash = subprocess.check_output("cd {0} && git rev-parse master".format(upstream), shell=True).decode().strip()
+        assert resolver.resolve("refs/heads/master") == new_master_hash
+        resolver.close()
+
+
+def test_git_ref_resolver_not_a_repo_will_raise():
+    with generate_random_dir() as test_dir:
+        resolver = GitRefResolver(test_dir)
+        with pytest.raises(subprocess.CalledProcessError):
+            resolver.resolve("HEAD")
+
+
+def test_git_project_check_refs():
+    with generate_random_dir() as test_dir:
+        upstream = create_upstream_repo(test_dir)
+        resolver_repo = GitProject("resolver_repo", upstream, os.path.join(test_dir, "repo"))
+        assert not resolver_repo.check_is_branch("master")
+        resolver_repo.clone_project()
+        assert resolver_repo.check_is_branch("master")
+        assert not resolver_repo.check_is_branch("v0.0.1")
+        assert resolver_repo.check_is_tag("v0.0.1")
+        assert not resolver_repo.check_is_tag("master")
+        assert resolver_repo.get_commit_hash(length=7) == resolver_repo.get_commit_hash()[:7]
+        resolved_refs = resolver_repo.resolve_refs(["refs/remotes/origin/develop", "refs/tags/v0.0.1", "refs/tags/v9"])
+        assert resolved_refs["refs/remotes/origin/develop"] == resolver_repo.get_commit_hash()
+        assert resolved_refs["refs/tags/v9"] is None
+
+
+def test_fetch_commit_ref_skip_network_for_known_refs():
+    with generate_random_dir() as test_dir:
+        upstream = create_upstream_repo(test_dir)
+        offline_repo = GitProject("offline_repo", upstream, os.path.join(test_dir, "repo")).clone_project()
+        commit_hash = offline_repo.get_commit_hash()
+        shutil.move(upstream, upstream + ".moved")  # 之后任何访问网络的操作都会失败
+
+        assert offline_repo.fetch_commit_ref("v0.0.1") == commit_hash
+        assert offline_repo.fetch_commit_ref(commit_hash[:10]) == commit_hash
+        with pytest.raises(SystemExit):
+            offline_repo.fetch_commit_ref("master")
+
+
+def test_fetch_commit_ref_branch_repeatedly():
+    with generate_random_dir() as test_dir:
+        upstream = create_upstream_repo(test_dir)
+        branch_repo = GitProject("branch_repo", upstream, os.path.join(test_dir, "repo")).clone_project()
+        branch_repo.fetch_commit_ref("develop")
+        commit_upstream_repo(upstream, "develop_file", branch="develop")
+        branch_repo.fetch_commit_ref("develop")
+        assert os.path.exists(os.path.join(branch_repo.path, "develop_file"))
+        assert branch_repo.check_is_branch("develop")
+
+        commit_upstream_repo(upstream, "master_file")
+        upstream_hash = subprocess.check_output("cd {0} && git rev-parse master".format(upstream), shell=True)
+        upstream_hash = upstream_hash.decode().strip()
+        assert branch_repo.fetch_commit_ref(upstream_hash) == upstream_hash
+        assert branch_repo.fetch_commit_ref("master") == upstream_hash
+        assert not os.path.exists(os.path.join(branch_repo.path, "develop_file"))
+
+
+def test_clone_and_collect_submodules_concurrently():
+    with generate_random_dir() as test_dir:
+        upstream = create_upstream_repo(test_dir)
+        parallel_repo = GitProject("parallel_repo", upstream, os.path.join(test_dir, "repo"))
+        for index in range(3):
+            dep_upstream = create_upstream_repo(os.path.join(test_dir, "dep{0}".format(index)))
+            parallel_repo.add_submodule("parallel_repo_dep{0}".format(index), dep_upstream, "dep{0}".format(index))
+
+        parallel_repo.clone_project(clone_submodules=True, max_workers=2)
+        assert set(parallel_repo.clone_timings) == {"parallel_repo"} | {"parallel_repo_dep{0}".format(i) for i in range(3)}
+        for index in range(3):
+            assert os.path.exists(os.path.join(parallel_repo.path, "dep{0}".format(index), ".git"))
+
+        state = parallel_repo.get_current_state(max_workers=3)
+        assert set(state) == set(parallel_repo.clone_timings)
+        assert set(parallel_repo.state_timings) == set(state)
+        assert all(len(commit_hash) == 40 for commit_hash in state.values())
+
+
+def test_shallow_clone_and_fetch():
+    with generate_random_dir() as test_dir:
+        upstream = create_upstream_repo(test_dir)
+        first_hash = subprocess.check_output("cd {0} && git rev-parse master".format(upstream), shell=True).decode().strip()
+        commit_upstream_repo(upstream, "second_file")
+        commit_upstream_repo(upstream, "develop_file", branch="develop")
+        subprocess.check_call("cd {0} && git config uploadpack.allowFilter true".format(upstream), shell=True)
+
+        shallow_repo = GitProject("shallow_repo", "file://" + upstream, os.path.join(test_dir, "repo"))
+        shallow_repo.clone_project(depth=1, filter_spec="blob:none")
+        assert shallow_repo.depth == 1 and shallow_repo.filter_spec == "blob:none"
+        assert os.path.exists(os.path.join(shallow_repo.path, ".git", "shallow"))
+        commit_count = subprocess.check_output("cd {0} && git rev-list --count HEAD".format(shallow_repo.path), shell=True)
+        assert commit_count.decode().strip() == "1"
+
+        shallow_repo.fetch_commit_ref("develop")
+        assert os.path.exists(os.path.join(shallow_repo.path, "develop_file"))
+        assert shallow_repo.fetch_commit_ref(first_hash) == first_hash
+        assert not os.path.exists(os.path.join(shallow_repo.path, "second_file"))
+        shallow_repo.fetch_commit_ref("v0.0.1")
+        assert shallow_repo.get_commit_hash() == first_hash
+
+
+def test_shallow_fetch_uses_one_round_trip():
+    with generate_random_dir() as test_dir:
+        upstream = create_upstream_repo(test_dir)
+        commit_upstream_repo(upstream, "develop_file", branch="develop")
+        subprocess.check_call("cd {0} && git tag v0.0.2 develop".format(upstream), shell=True)
+        shallow_repo = GitProject("shallow_round_trip_repo", "file://" + upstream, os.path.join(test_dir, "repo"))
+        shallow_repo.clone_project(depth=1)
+
+        fetches = list()
+        call = subprocess.call
+
+        def counting_call(command, *args, **kwargs):
+            if " fetch " in command:
+                fetches.append(command)
+            return call(command, *args, **kwargs)
+
+        with mock.patch("silk.git_tools.subprocess.call", side_effect=counting_call):
+            shallow_repo.fetch_commit_ref("v0.0.2")
+            assert len(fetches) == 1
+            assert shallow_repo.check_is_tag("v0.0.2")
+            assert os.path.exists(os.path.join(shallow_repo.path, "develop_file"))
+            shallow_repo.fetch_commit_ref("develop")
+            assert len(fetches) == 2
+            assert shallow_repo.ref_resolver.resolve("refs/remotes/origin/develop") == shallow_repo.get_commit_hash()
+
+
+def test_shallow_fetch_unknown_ref_keeps_clone_shallow():
+    with generate_random_dir() as test_dir:
+        upstream = create_upstream_repo(test_dir)
+        commit_upstream_repo(upstream, "second_file")
+        shallow_repo = GitProject("shallow_unknown_ref_repo", "file://" + upstream, os.path.join(test_dir, "repo"))
+        shallow_repo.clone_project(depth=1)
+        with pytest.raises(subprocess.CalledProcessError):
+            shallow_repo.fetch_commit_ref("devlop")
+        assert os.path.exists(os.path.join(shallow_repo.path, ".git", "shallow"))
+        commit_count = subprocess.check_output("cd {0} && git rev-list --count --all".format(shallow_repo.path), shell=True)
+        assert commit_count.decode().strip() == "1"
+
+
+def test_shallow_clone_in_worktree_mode_will_raise():
+    with generate_random_dir() as test_dir:
+        shallow_worktree_repo = GitProject("shallow_worktree_repo", test_git_repo, test_dir, use_worktree=True)
+        with pytest.raises(Exception):
+            shallow_worktree_repo.clone_project(depth=1)
+        assert shallow_worktree_repo.depth is None and not shallow_worktree_repo.is_shallow
+
+
+def test_sparse_checkout_clone():
+    with generate_random_dir() as test_dir:
+        upstream = create_upstream_repo(test_dir)
+        for dir_name in ("app", "docs"):
+            touch_file(os.path.join(upstream, dir_name, "file"), create_parents=True)
+        subprocess.check_call("cd {0} && git add . && git -c user.name=silk -c user.email=silk@localhost commit -q -m dirs".format(upstream), shell=True)
+
+        sparse_repo = GitProject("sparse_repo", upstream, os.path.join(test_dir, "repo"))
+        sparse_repo.clone_project(sparse_paths=["app"])
+        assert os.path.exists(os.path.join(sparse_repo.path, "app", "file"))
+        assert not os.path.exists(os.path.join(sparse_repo.path, "docs"))
+        sparse_repo.fetch_commit_ref("master")
+        assert not os.path.exists(os.path.join(sparse_repo.path, "docs"))
+
+
+def test_submodules_view_and_snapshot():
+    with generate_random_dir() as test_dir:
+        view_repo = GitProject("view_repo", test_git_repo, test_dir)
+        view_repo_dep = view_repo.add_submodule("view_repo_dep", test_dep_git_repo, "dep")
+
+        assert view_repo.submodules["view_repo_dep"] is view_repo_dep
+        with pytest.raises(TypeError):
+            view_repo.submodules["other"] = view_repo_dep
+
+        snapshot = view_repo.snapshot_submodules()
+        assert snapshot["view_repo_dep"] is not view_repo_dep
+        assert snapshot["view_repo_dep"].path == view_repo_dep.path
+
+
+def test_deepcopy_git_project_keep_working_index():
+    with generate_random_dir() as test_dir:
+        copied_repo = GitProject("copied_repo", test_git_repo, test_dir)
+        allocator = IndexAllocator(os.path.join(test_dir, ".index"))
+        owners = allocator.owners()
+        repo_copy = deepcopy(copied_repo)
+        assert repo_copy.path == copied_repo.path
+        del repo_copy
+        gc.collect()
+        assert allocator.owners() == owners
@@ -0,0 +1,58 @@
+import pytest
+
+from silk.fabric_tools.fabric_context import Host
+from silk.fabric_tools.fabric_context import Role
+from silk.fabric_tools.fabric_context import Environment
+from silk.fabric_tools.host_selector import compile_selector
+from silk.fabric_tools.host_selector import select_hosts
+
+web_hosts = [Host("web-{0:02d}".format(index), "10.0.1.{0}".format(index)) for index in range(1, 11)]
+db_hosts = [Host("db-{0:02d}".format(index), "10.0.2.{0}".format(index)) for index in range(1, 3)]
+web = Role("web", web_hosts)
+db = Role("db", db_hosts)
+eu = Role("eu", web_hosts[:5] + db_hosts[:1])
+environment = Environment("test_host_selector", [web, db, eu])
+
+
+def names(expression):
+    return [host.name for host in select_hosts(environment, expression)]
+
+
+def test_select_by_name_and_all():
+    assert names("web-03") == ["web-03"]
+    assert names("web-99") == []
+    assert len(names("all")) == 12
+
+
+def test_select_by_glob_and_regex():
+    assert names("web-0[1-4]*") == ["web-01", "web-02", "web-03", "web-04"]
+    assert names("db-*") == ["db-01", "db-02"]
+    assert names("re:^web-1") == ["web-10"]
+    assert names("re:'^web-(09|10)$'") == ["web-09", "web-10"]
+
+
+def test_select_by_role_and_operators():
+    assert names("role:db") == ["db-01", "db-02"]
+    assert names("role:web & role:eu") == ["web-01", "web-02", "web-03", "web-04", "web-05"]
+    assert names("role:db | web-10") == ["db-01", "db-02", "web-10"]
+    assert names("role:eu & !role:web") == ["db-01"]
+    assert names("!(role:web | db-02)") == ["db-01"]
+    assert names("role:e* & db-*") == ["db-01"]
+
+
+def test_select_slices():
+    assert names("role:web/30%") == ["web-01", "web-02", "web-03"]
+    assert names("role:web/25%") == ["web-01", "web-02", "web-03"]
+    assert names("role:web & !web-01/2") == ["web-02", "web-03"]
+    assert names("role:db/100%") == ["db-01", "db-02"]
+
+
+def test_compile_selector_is_cached():
+    assert compile_selector("role:web & !web-01") is compile_selector("role:web & !web-01")
+
+
+@pytest.mark.parametrize("expression", ["", "role:web &", "(role:web", "role:web)", "web/abc", "web/0%", "re:'(",
+                                        "web-01 web-02", "re:'abc", "re:^web-(09|10)$"])
+def test_invalid_expression_will_raise(expression):
+    with pytest.raises(ValueError):
+        compile_selector(expression)
@@ -0,0 +1,104 @@
+import os
+import json
+import time
+
+import pytest
+
+from silk.fabric_tools.inventory import InventoryLoader
+from silk.file_tools import generate_random_dir
+
+yaml_content = """
+environments:
+  inventory_yaml:
+    options:
+      ssh_max_sessions: 4
+    hosts:
+      - {name: web-01, address: 10.0.0.1, roles: [web]}
+      - {name: web-01, address: 10.0.0.1, roles: [eu]}
+      - {name: db-01, address: 10.0.0.2, user: root, roles: [db]}
+"""
+
+ini_content = """
+# 注释
+[inventory_ini]
+ssh_max_sessions = 4
+region = eu
+
+[inventory_ini:web]
+web-01 address=10.0.0.1
+web-02 address=10.0.0.2 user=root
+
+[inventory_ini:eu]
+web-01 address=10.0.0.1
+"""
+
+
+def write_file(dir_path, file_name, content):
+    os.makedirs(dir_path, exist_ok=True)
+    file_path = os.path.join(dir_path, file_name)
+    with open(file_path, "w") as f:
+        f.write(content)
+    return file_path
+
+
+def test_load_yaml_inventory():
+    with generate_random_dir() as dir_path:
+        file_path = write_file(dir_path, "inventory.yaml", yaml_content)
+        environment, = InventoryLoader(os.path.join(dir_path, "cache")).load(file_path)
+        assert environment.name == "inventory_yaml"
+        assert environment.ssh_max_sessions == 4
+        assert len(environment.hosts) == 2
+        web_host = environment.get_host("deploy@10.0.0.1")
+        assert {role.name for role in web_host.roles} == {"web", "eu"}
+        assert environment.get_host("root@10.0.0.2").name == "db-01"
+
+
+def test_load_json_and_ini_inventory():
+    with generate_random_dir() as dir_path:
+        data = json.dumps({"environments": {"inventory_json": {"hosts": [{"name": "web-01", "address": "10.0.0.1",
+                                                                          "roles": ["web"]}]}}})
+        environment, = InventoryLoader(os.path.join(dir_path, "cache")).load(write_file(dir_path, "inventory.json", data))
+        assert environment.get_role("web").hosts == {environment.get_host("deploy@10.0.0.1")}
+
+        environment, = InventoryLoader(os.path.join(dir_path, "cache")).load(write_file(dir_path, "inventory.ini", ini_content))
+        assert environment.ssh_max_sessions == 4
+        assert environment.region == "eu"
+        assert len(environment.get_role("web").hosts) == 2
+        assert environment.get_host("root@10.0.0.2").name == "web-02"
+        assert environment.get_hosts("web-01")[0].has_role(environment.get_role("eu"))
+
+
+def test_invalid_inventory_will_raise():
+    with generate_random_dir() as dir_path:
+        loader = InventoryLoader(os.path.join(dir_path, "cache"))
+        with pytest.raises(ValueError):
+            loader.parse(write_file(dir_path, "inventory.toml", ""))
+        with pytest.raises(ValueError):
+            loader.parse(write_file(dir_path, "missing_address.ini", "[prod:web]\nweb-01 user=root\n"))
+
+
+def test_inventory_cache():
+    with generate_random_dir() as dir_path:
+        file_path = write_file(dir_path, "inventory.yaml", yaml_content)
+        loader = InventoryLoader(os.path.join(dir_path, "cache"))
+        parsed = list()
+        original_parse = loader.parse
+
+        def parse(path):
+            parsed.append(path)
+            return original_parse(path)
+
+        loader.parse = parse
+        data = loader.load_data(file_path)
+        assert os.path.exists(loader.get_cache_path(file_path))
+        assert loader.load_data(file_path) == data
+        assert len(parsed) == 1
+
+        # 只修改 mtime 时按内容哈希命中缓存
+        os.utime(file_path, (time.time() + 10, time.time() + 10))
+        assert loader.load_data(file_path) == data
+        assert len(parsed) == 1
+
+        write_file(dir_path, "inventory.yaml", yaml_content.replace("10.0.0.2", "10.0.0.3"))
+        assert loader.load_data(file_path)["inventory_yaml"]["hosts"][1]["address"] == "10.0.0.3"
+        assert len(parsed) == 2
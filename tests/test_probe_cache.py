@@ -0,0 +1,76 @@
+from silk.fabric_tools import settings
+from silk.fabric_tools import cd
+from silk.fabric_tools import exists
+from silk.fabric_tools import run
+from silk.fabric_tools import sed
+from silk.fabric_tools.probe_cache import cached_probe
+from silk.fabric_tools.probe_cache import invalidates_probes
+from silk.fabric_tools.probe_cache import clear_probe_cache
+
+calls = list()
+
+
+@cached_probe
+def probe(path, use_sudo=False):
+    calls.append(path)
+    return len(calls)
+
+
+@invalidates_probes
+def mutate(path):
+    pass
+
+
+def setup_function():
+    calls.clear()
+    clear_probe_cache()
+
+
+def test_probe_is_cached_per_host():
+    with settings(host_string="deploy@host1"):
+        assert probe("/etc/app.conf") == 1
+        assert probe("/etc/app.conf") == 1
+        assert probe("/etc/app.conf", use_sudo=True) == 2
+        with cd("/opt"):
+            assert probe("/etc/app.conf") == 3
+    with settings(host_string="deploy@host2"):
+        assert probe("/etc/app.conf") == 4
+    assert len(calls) == 4
+
+
+def test_mutation_invalidates_only_current_host():
+    with settings(host_string="deploy@host1"):
+        probe("/etc/app.conf")
+    with settings(host_string="deploy@host2"):
+        probe("/etc/app.conf")
+        mutate("/etc/app.conf")
+        probe("/etc/app.conf")
+    with settings(host_string="deploy@host1"):
+        probe("/etc/app.conf")
+    assert len(calls) == 3
+
+
+def test_probe_cache_can_be_disabled_and_cleared():
+    with settings(host_string="deploy@host1", silk_probe_cache=False):
+        probe("/etc/app.conf")
+        probe("/etc/app.conf")
+    assert len(calls) == 2
+
+    with settings(host_string="deploy@host1"):
+        probe("/etc/app.conf")
+        clear_probe_cache()
+        probe("/etc/app.conf")
+    assert len(calls) == 4
+
+
+def test_probe_with_unhashable_args_is_not_cached():
+    with settings(host_string="deploy@host1"):
+        probe(["/etc/a", "/etc/b"])
+        probe(["/etc/a", "/etc/b"])
+    assert len(calls) == 2
+
+
+def test_silk_helpers_are_wrapped():
+    assert exists.__wrapped__.__module__ == "fabric.contrib.files"
+    assert run.__wrapped__.__module__ == "fabric.operations"
+    assert sed.__wrapped__.__module__ == "fabric.contrib.files"
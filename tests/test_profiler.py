@@ -0,0 +1,127 @@
+import os
+import time
+import multiprocessing
+
+from silk.fabric_tools import execute
+from silk.fabric_tools import settings
+from silk.fabric_tools.fabric_context import Host
+from silk.fabric_tools.async_executor import AsyncExecutor
+from silk.fabric_tools.async_executor import LocalTransport
+from silk.fabric_tools.profiler import Profiler
+from silk.fabric_tools.profiler import percentile
+from silk.fabric_tools.profiler import profiled
+from silk.fabric_tools.profiler import profiled_task
+from silk.fabric_tools.profiler import enable_profiling
+from silk.fabric_tools.profiler import disable_profiling
+from silk.file_tools import generate_random_dir
+
+
+class RunResult(str):
+    return_code = 0
+    failed = False
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 100) == 100
+    assert percentile([3.0], 95) == 3.0
+    assert percentile([], 50) == 0.0
+
+
+def test_summary():
+    with generate_random_dir() as dir_path:
+        profiler = Profiler(os.path.join(dir_path, "events.jsonl"))
+        for index in range(1, 21):
+            profiler.record("run", "uptime", index / 10, host="deploy@host{0}".format(index % 4), exit_code=0)
+        profiler.record("run", "false", 0.1, host="deploy@host0", exit_code=1)
+        profiler.record("put", "app.tar", 0.5, host="deploy@host1", exit_code=0, size=1024)
+        profiler.record("task", "deploy", 9.0, host="deploy@host3")
+        profiler.record("task", "deploy", 1.0, host="deploy@host1")
+
+        summary = profiler.summary(slowest=1)
+        assert summary["events"] == 24
+        assert summary["kinds"]["run"]["count"] == 21
+        assert summary["kinds"]["run"]["failed"] == 1
+        assert summary["kinds"]["run"]["p50"] == 1.0
+        assert summary["kinds"]["run"]["max"] == 2.0
+        assert summary["kinds"]["put"]["bytes"] == 1024
+        assert summary["slowest_hosts"] == [("deploy@host3", 9.0)]
+        assert "slowest hosts:\n  deploy@host3: 9.000s" in profiler.format_summary(slowest=1)
+
+
+def record_in_child(event_file, index):
+    Profiler(event_file).record("run", "child-{0}".format(index), 0.01, host="deploy@child{0}".format(index))
+
+
+def test_events_from_forked_children():
+    with generate_random_dir() as dir_path:
+        profiler = Profiler(os.path.join(dir_path, "events.jsonl"))
+        context = multiprocessing.get_context("fork")
+        processes = [context.Process(target=record_in_child, args=(profiler.event_file, index)) for index in range(8)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        events = profiler.load_events()
+        assert sorted(event["name"] for event in events) == sorted("child-{0}".format(index) for index in range(8))
+        assert len({event["pid"] for event in events}) == 8
+
+
+def test_profiled_operations_are_opt_in():
+    with generate_random_dir() as dir_path:
+        local_file = os.path.join(dir_path, "artifact.bin")
+        with open(local_file, "wb") as f:
+            f.write(b"x" * 300)
+
+        fake_run = profiled("run")(lambda command: RunResult("ok"))
+        fake_put = profiled("put")(lambda local_path, remote_path: ["/remote/artifact.bin"])
+        fake_run("uptime")
+        assert disable_profiling() is None
+
+        profiler = enable_profiling(os.path.join(dir_path, "events.jsonl"))
+        try:
+            with settings(host_string="deploy@host1"):
+                fake_run("uptime")
+                fake_put(local_file, "/remote/artifact.bin")
+        finally:
+            assert disable_profiling() is profiler
+
+        run_event, put_event = profiler.load_events()
+        assert run_event["kind"] == "run" and run_event["name"] == "uptime" and run_event["host"] == "deploy@host1"
+        assert run_event["exit_code"] == 0
+        assert put_event["bytes"] == 300
+
+
+def test_profiled_task_and_async_executor():
+    def slow_task():
+        time.sleep(0.05)
+        return "done"
+
+    def failed_task():
+        raise ValueError("failed")
+
+    with generate_random_dir() as dir_path:
+        profiler = enable_profiling(os.path.join(dir_path, "events.jsonl"))
+        try:
+            assert execute(profiled_task(slow_task)) == {"<local-only>": "done"}
+            try:
+                profiled_task(failed_task)()
+            except ValueError:
+                pass
+            hosts = [Host("host{0}".format(index), "10.0.0.{0}".format(index)) for index in range(3)]
+            AsyncExecutor(LocalTransport()).run(hosts, "echo hello; [ $SILK_HOST_NAME != host2 ]")
+        finally:
+            disable_profiling()
+
+        summary = profiler.summary()
+        assert summary["kinds"]["task"]["count"] == 2
+        assert summary["kinds"]["task"]["failed"] == 1
+        assert summary["kinds"]["task"]["max"] >= 0.05
+        assert summary["kinds"]["async"]["count"] == 3
+        assert summary["kinds"]["async"]["failed"] == 1
+        assert summary["kinds"]["async"]["bytes"] == 18
+        # 和 fabric 操作记录的 env.host_string 一致, 同一台服务器的事件才能汇总到一起
+        async_hosts = {event["host"] for event in profiler.load_events() if event["kind"] == "async"}
+        assert async_hosts == {host.full_address for host in hosts}
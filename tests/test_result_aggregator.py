@@ -0,0 +1,54 @@
+from silk.fabric_tools.fabric_context import Host
+from silk.fabric_tools.async_executor import AsyncExecutor
+from silk.fabric_tools.async_executor import LocalTransport
+from silk.fabric_tools.result_aggregator import ResultAggregator
+
+hosts = [Host("host{0:02d}".format(index), "10.0.0.{0}".format(index)) for index in range(20)]
+command = "echo kernel 5.4; echo uptime ok; if [ $SILK_HOST_NAME = host07 ]; then echo disk full; exit 2; fi"
+
+
+def test_group_identical_outputs():
+    aggregator = ResultAggregator()
+    for index in range(100):
+        aggregator.add("web-{0:03d}".format(index), "version 1.2\n")
+    aggregator.add("web-100", "version 1.3\n")
+    aggregator.add("web-101", "version 1.2\n", exit_code=1)
+
+    groups = aggregator.get_groups()
+    assert len(groups) == 3
+    assert len(groups[0].hosts) == 100 and groups[0].body == "version 1.2\n"
+    assert aggregator.to_dict()["hosts"] == 102
+
+    report = aggregator.format_report(max_hosts=3)
+    assert report.startswith("== 100 台服务器输出相同 (exit 0): web-000, web-001, web-002 等 100 台\nversion 1.2")
+    assert "-version 1.2\n+version 1.3" in report
+
+
+def test_add_results_from_execute():
+    aggregator = ResultAggregator().add_results({"deploy@a": {"ok": True}, "deploy@b": {"ok": True},
+                                                 "deploy@c": Exception("failed")})
+    groups = aggregator.get_groups()
+    assert groups[0].hosts == ["deploy@a", "deploy@b"]
+    assert groups[1].exit_code == "error"
+
+
+def test_aggregate_as_callback_and_as_sink():
+    callback = ResultAggregator()
+    AsyncExecutor(LocalTransport()).run(hosts, command, on_result=callback)
+    sink = ResultAggregator(max_body_size=64)
+    AsyncExecutor(LocalTransport(), sinks=[sink]).run(hosts, command)
+
+    for aggregator in (callback, sink):
+        groups = aggregator.get_groups()
+        assert [len(group.hosts) for group in groups] == [19, 1]
+        assert groups[1].hosts == ["host07"] and groups[1].exit_code == 2
+        assert "+disk full" in aggregator.format_report()
+
+
+def test_aggregate_hosts_with_duplicate_names_as_sink():
+    duplicate_hosts = [Host("web", "10.0.1.{0}".format(index)) for index in range(1, 4)]
+    sink = ResultAggregator()
+    AsyncExecutor(LocalTransport(), sinks=[sink]).run(duplicate_hosts, "echo $SILK_HOST_ADDRESS")
+    groups = sink.get_groups()
+    assert len(groups) == 3 and all(group.hosts == ["web"] for group in groups)
+    assert sorted(group.body for group in groups) == ["{0}\n".format(host.address) for host in duplicate_hosts]
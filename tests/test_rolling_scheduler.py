@@ -0,0 +1,84 @@
+import pytest
+
+from silk.fabric_tools.rolling_scheduler import RollingScheduler
+
+hosts = ["deploy@web-{0:02d}".format(index) for index in range(10)]
+
+
+def test_batch_size():
+    assert RollingScheduler(3).get_batch_size(10) == 3
+    assert RollingScheduler("25%").get_batch_size(10) == 3
+    assert RollingScheduler("1%").get_batch_size(10) == 1
+    assert RollingScheduler("100%").get_batch_size(10) == 10
+    assert RollingScheduler(4, window=2).get_window(4) == 2
+    assert RollingScheduler(4).get_window(3) == 3
+
+
+@pytest.mark.parametrize("batch_size", [0, "0%", "120%", "abc", 1.5])
+def test_invalid_batch_size_will_raise(batch_size):
+    with pytest.raises(ValueError):
+        RollingScheduler(batch_size)
+
+
+def test_split_batches():
+    batches = RollingScheduler("40%").split_batches(hosts)
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert sum(batches, []) == hosts
+
+
+def test_run_all_batches():
+    batches = list()
+
+    def run_batch(batch):
+        batches.append(batch)
+        return {host: host.upper() for host in batch}
+
+    results = RollingScheduler(3).run(hosts, run_batch)
+    assert len(batches) == 4
+    assert results == {host: host.upper() for host in hosts}
+
+
+def test_abort_when_failure_rate_exceeded():
+    batches = list()
+
+    def run_batch(batch):
+        batches.append(batch)
+        return {host: Exception("failed") if host == "deploy@web-03" else None for host in batch}
+
+    scheduler = RollingScheduler(2, max_failure_rate=0.2)
+    with pytest.raises(RuntimeError):
+        scheduler.run(hosts, run_batch)
+    assert len(batches) == 2
+    assert set(scheduler.results) == set(hosts[:4])
+
+    batches.clear()
+    RollingScheduler(2, max_failure_rate=0.5).run(hosts, run_batch)
+    assert len(batches) == 5
+
+
+def test_abort_when_health_check_failed():
+    checked = list()
+
+    def health_check(batch, results):
+        checked.append(batch)
+        return "deploy@web-05" not in batch
+
+    scheduler = RollingScheduler(2, health_check=health_check)
+    with pytest.raises(RuntimeError):
+        scheduler.run(hosts, lambda batch: {host: None for host in batch})
+    assert checked == [hosts[0:2], hosts[2:4], hosts[4:6]]
+
+
+def test_catch_failures():
+    def task(value):
+        if value == "abort":
+            raise SystemExit(1)
+        if value == "error":
+            raise ValueError(value)
+        return value
+
+    task_ = RollingScheduler.catch_failures(task)
+    assert task_("ok") == "ok"
+    assert isinstance(task_("abort"), SystemExit)
+    assert RollingScheduler.is_failure(task_("error"))
+    assert not RollingScheduler.is_failure(task_("ok"))
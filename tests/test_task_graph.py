@@ -0,0 +1,188 @@
+import os
+import time
+import threading
+
+import pytest
+
+from silk.fabric_tools.fabric_context import Host
+from silk.fabric_tools.fabric_context import Role
+from silk.fabric_tools.fabric_context import Environment
+from silk.fabric_tools.task_graph import TaskGraph
+from silk.fabric_tools.probe_cache import probe_results
+from silk.fabric_tools.profiler import enable_profiling
+from silk.fabric_tools.profiler import disable_profiling
+from silk.fabric_tools import env
+from silk.fabric_tools import local
+from silk.file_tools import generate_random_dir
+
+
+def create_environment(name):
+    db = Role("db", [Host("db-01", "10.0.0.1")])
+    app = Role("app", [Host("app-01", "10.0.0.2"), Host("app-02", "10.0.0.3")])
+    lb = Role("lb", [Host("lb-01", "10.0.0.4")])
+    return Environment(name, [db, app, lb])
+
+
+def noop():
+    pass
+
+
+def test_execution_order():
+    graph = TaskGraph("graph-order")
+    graph.add_task("migrate", noop, roles=["db"])
+    graph.add_task("deploy_app", noop, roles=["app"], depends_on=["role:db"])
+    graph.add_task("deploy_static", noop, roles=["app"])
+    graph.add_task("reload_lb", noop, roles=["lb"], depends_on=["role:app"])
+    assert graph.get_execution_order() == [["deploy_static", "migrate"], ["deploy_app"], ["reload_lb"]]
+
+
+def test_cycle_and_unknown_dependency_will_raise():
+    graph = TaskGraph("graph-cycle")
+    graph.add_task("a", noop, depends_on=["b"])
+    graph.add_task("b", noop, depends_on=["a"])
+    with pytest.raises(ValueError):
+        graph.get_execution_order()
+    with pytest.raises(ValueError):
+        graph.run(runner=lambda node: None)
+
+    graph = TaskGraph("graph-unknown")
+    graph.add_task("a", noop, depends_on=["missing"])
+    with pytest.raises(ValueError):
+        graph.get_execution_order()
+
+    with pytest.raises(Exception):
+        graph.add_task("a", noop)
+
+
+def test_run_independent_branches_concurrently():
+    create_environment("graph-concurrent")
+    graph = TaskGraph("graph-concurrent", max_workers=4)
+    graph.add_task("migrate", noop, roles=["db"])
+    graph.add_task("build_static", noop)
+    graph.add_task("deploy_app", noop, roles=["app"], depends_on=["migrate", "build_static"])
+    graph.add_task("reload_lb", noop, roles=["lb"], depends_on=["role:app"])
+
+    lock = threading.Lock()
+    events, running, max_running = list(), [0], [0]
+
+    def runner(node):
+        with lock:
+            events.append(("start", node.name))
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.2)
+        with lock:
+            running[0] -= 1
+            events.append(("end", node.name))
+        return node.name.upper()
+
+    start = time.time()
+    results = graph.run(runner=runner)
+    assert time.time() - start < 0.75
+    assert max_running[0] == 2
+    assert results == {name: name.upper() for name in graph.nodes}
+    assert events.index(("end", "migrate")) < events.index(("start", "deploy_app"))
+    assert events.index(("end", "build_static")) < events.index(("start", "deploy_app"))
+    assert events.index(("end", "deploy_app")) < events.index(("start", "reload_lb"))
+
+
+def test_failure_skips_downstream_tasks():
+    create_environment("graph-failure")
+    graph = TaskGraph("graph-failure")
+    graph.add_task("migrate", noop, roles=["db"])
+    graph.add_task("build_static", noop)
+    graph.add_task("deploy_app", noop, roles=["app"], depends_on=["migrate"])
+    graph.add_task("reload_lb", noop, roles=["lb"], depends_on=["deploy_app"])
+
+    executed = list()
+
+    def runner(node):
+        executed.append(node.name)
+        if node.name == "migrate":
+            raise Exception("migration failed")
+
+    with pytest.raises(RuntimeError):
+        graph.run(runner=runner)
+    assert sorted(executed) == ["build_static", "migrate"]
+    assert graph.failed == {"migrate"}
+    assert graph.skipped == {"deploy_app", "reload_lb"}
+    assert isinstance(graph.results["migrate"], Exception)
+
+
+def test_run_with_fabric_runner():
+    create_environment("graph-fabric")
+    with generate_random_dir() as dir_path:
+        log_file = os.path.join(dir_path, "tasks.log")
+        profiler = enable_profiling(os.path.join(dir_path, "profile.jsonl"))
+        probe_results["stale"] = {"key": True}
+
+        def record(name):
+            local("echo {0} {1} >> {2}".format(name, env.host_string, log_file))
+            return name
+
+        graph = TaskGraph("graph-fabric")
+        graph.add_task("migrate", record, roles=["db"], run_parallel=False, args=["migrate"])
+        graph.add_task("deploy_app", record, roles=["app"], depends_on=["role:db"], args=["deploy_app"])
+        graph.add_task("reload_lb", record, roles=["lb"], depends_on=["role:app"], kwargs={"name": "reload_lb"})
+        try:
+            results = graph.run()
+        finally:
+            disable_profiling()
+
+        assert "stale" not in probe_results
+        assert results["migrate"] == {"deploy@10.0.0.1": "migrate"}
+        assert results["deploy_app"] == {"deploy@10.0.0.2": "deploy_app", "deploy@10.0.0.3": "deploy_app"}
+        assert results["reload_lb"] == {"deploy@10.0.0.4": "reload_lb"}
+        with open(log_file) as f:
+            lines = f.read().splitlines()
+        assert lines[0] == "migrate deploy@10.0.0.1" and lines[-1] == "reload_lb deploy@10.0.0.4"
+        assert sorted(lines[1:3]) == ["deploy_app deploy@10.0.0.2", "deploy_app deploy@10.0.0.3"]
+        assert len([event for event in profiler.load_events() if event["kind"] == "task"]) == 4
+
+
+def test_fabric_nodes_run_concurrently_by_default():
+    create_environment("graph-fabric-concurrent")
+    with generate_random_dir() as dir_path:
+        log_file = os.path.join(dir_path, "tasks.log")
+
+        def slow(name):
+            local("echo start {0} >> {1}; sleep 0.5; echo end {0} >> {1}".format(name, log_file))
+            return os.getpid()
+
+        graph = TaskGraph("graph-fabric-concurrent")
+        graph.add_task("migrate", slow, roles=["db"], run_parallel=False, args=["migrate"])
+        graph.add_task("reload_lb", slow, roles=["lb"], run_parallel=False, args=["reload_lb"])
+        graph.add_task("failed", lambda: local("exit 1"), roles=["db"], run_parallel=False)
+        graph.add_task("deploy_app", noop, roles=["app"], depends_on=["failed"])
+
+        start = time.time()
+        with pytest.raises(RuntimeError):
+            graph.run()
+        assert time.time() - start < 0.9
+        with open(log_file) as f:
+            lines = f.read().splitlines()
+        assert sorted(lines[:2]) == ["start migrate", "start reload_lb"]
+        assert graph.results["migrate"]["deploy@10.0.0.1"] != graph.results["reload_lb"]["deploy@10.0.0.4"]
+        assert graph.failed == {"failed"} and isinstance(graph.results["failed"], SystemExit)
+        assert graph.skipped == {"deploy_app"}
+
+
+def test_keyboard_interrupt_is_not_recorded_as_failure():
+    create_environment("graph-interrupt")
+    graph = TaskGraph("graph-interrupt")
+    graph.add_task("migrate", noop, roles=["db"])
+    graph.add_task("deploy_app", noop, roles=["app"], depends_on=["migrate"])
+
+    def runner(node):
+        if node.name == "migrate":
+            raise SystemExit(1)
+
+    with pytest.raises(RuntimeError):
+        graph.run(runner=runner)
+    assert graph.failed == {"migrate"} and isinstance(graph.results["migrate"], SystemExit)
+
+    def interrupted(node):
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        graph.run(runner=interrupted)